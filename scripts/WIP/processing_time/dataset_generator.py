@@ -0,0 +1,78 @@
+import itertools
+import json
+import random
+
+# Streaming generator of synthetic farm documents shaped like sample_agriculture_data.json.
+# Documents are produced one at a time from a seeded random.Random, so the same seed always gives
+# the same dataset and millions of documents can be inserted without holding them in RAM.
+
+COUNTRIES = ["Netherlands", "Greece", "Spain", "France", "Italy", "Germany", "Poland", "Portugal", "Ireland", "Denmark"]
+CROPS = [("Wheat Field", "Wheat"), ("Apple Orchard", "Apples"), ("Olive Grove", "Olives"), ("Vineyard", "Grapes"),
+         ("Corn Field", "Corn"), ("Potato Field", "Potatoes"), ("Barley Field", "Barley"), ("Citrus Grove", "Oranges")]
+ANIMALS = [("Cow", "Holstein"), ("Chicken", "Rhode Island Red"), ("Sheep", "Merino"), ("Goat", "Saanen"),
+           ("Pig", "Large White"), ("Horse", "Friesian")]
+SIZE_DISTRIBUTIONS = ("fixed", "uniform", "lognormal")
+
+def target_size(rng, document_size, size_distribution):
+    if size_distribution == "uniform":
+        return rng.randint(document_size // 2, document_size * 3 // 2)
+    if size_distribution == "lognormal":
+        # Median of document_size with a long tail of larger documents
+        return int(rng.lognormvariate(0, 0.5) * document_size)
+    return document_size
+
+def nested_details(rng, depth, fields):
+    details = {f"attribute_{index}": rng.random() for index in range(fields)}
+    if depth > 1:
+        details["details"] = nested_details(rng, depth - 1, fields)
+    return details
+
+def generate_farm(rng, index, nesting_depth=1, extra_fields=0, document_size=0, size_distribution="fixed"):
+    farm = {
+        "farm_name": f"Farm{index + 1}",
+        "country": rng.choice(COUNTRIES),
+        "plantations": [
+            {
+                "name": name,
+                "crop": crop,
+                "area_acres": rng.randint(1, 500),
+                "yield_bushels_per_acre": rng.randint(10, 400),
+            }
+            for name, crop in rng.sample(CROPS, rng.randint(1, 4))
+        ],
+        "animals": [
+            {"name": name, "species": species, "count": rng.randint(1, 1000)}
+            for name, species in rng.sample(ANIMALS, rng.randint(0, 3))
+        ],
+        "weather": {
+            "temperature_celsius": rng.randint(-10, 40),
+            "rain_mm": rng.randint(0, 100),
+            "wind_speed_kph": rng.randint(0, 80),
+        },
+    }
+    # Extra scalar fields, nested nesting_depth levels deep under "details"
+    if extra_fields or nesting_depth > 1:
+        farm["details"] = nested_details(rng, nesting_depth, extra_fields)
+
+    # Pad to the target size (approximate, measured as JSON)
+    if document_size:
+        missing = target_size(rng, document_size, size_distribution) - len(json.dumps(farm)) - len(', "notes": ""')
+        if missing > 0:
+            farm["notes"] = "x" * missing
+    return farm
+
+def generate_documents(count, seed=0, nesting_depth=1, extra_fields=0, document_size=0, size_distribution="fixed"):
+    if size_distribution not in SIZE_DISTRIBUTIONS:
+        raise ValueError(f"Unknown size_distribution '{size_distribution}'. Available: {', '.join(SIZE_DISTRIBUTIONS)}")
+    rng = random.Random(seed)
+    for index in range(count):
+        yield generate_farm(rng, index, nesting_depth, extra_fields, document_size, size_distribution)
+
+def iter_batches(documents, batch_size):
+    # Groups any iterable of documents into lists of batch_size, reading it lazily
+    documents = iter(documents)
+    while True:
+        batch = list(itertools.islice(documents, batch_size))
+        if not batch:
+            return
+        yield batch
@@ -2,26 +2,91 @@ import time
 import random
 import os
 import json
-import configparser
-from pymongo import MongoClient
+import itertools
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import bson
+from pymongo import MongoClient, WriteConcern
 import datetime
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common.config import config_path, load_config, script_config
+from common.results_store import ResultsStore, new_run_id
+from common.stats import summarize
+from dataset_generator import generate_documents, iter_batches
+from query_benchmark import QUERY_CLASSES, populate_collection, run_open_loop, set_indexes
 
 def read_config(filename):
-    config = configparser.ConfigParser()
-    config.read(filename)
+    config = load_config(filename)
+    db_file = config['general'].get('db_file', 'sample_agriculture_data.json').strip()
 
     return {
         "mongodb_port": int(config['general'].get('mongodb_port')),
-        "results_file": config['general'].get('results_file', ''),
+        "results_file": config_path(filename, config['general'].get('results_file', '')),
         "repetitions": int(config['general'].get('repetitions')),
         "database_name": config['general'].get('database_name', ''),
         "collection_name": config['general'].get('collection_name', ''),
+        "store_dir": config_path(filename, config['general'].get('store_dir', '')),
+        "text_results": config['general'].getboolean('text_results', True),
+        "backend": config['general'].get('backend', 'pymongo').strip(),
+        "db_file": db_file if db_file == 'synthetic' else config_path(filename, db_file),
+        "dataset": read_dataset_config(config),
+        "insert_suite": read_insert_suite_config(config),
+        "query_workload": read_query_workload_config(config),
         "extreme-edge": {k.replace("_ip", ""): v for k, v in config['extreme-edge'].items() if not k.startswith('#') and k.endswith('_ip')},
         "near-edge": {k.replace("_ip", ""): v for k, v in config['near-edge'].items() if not k.startswith('#') and k.endswith('_ip')}
     }
 
-def get_mongo_client(device_ip, port, database_name):
+def read_dataset_config(config):
+    section = config['dataset'] if config.has_section('dataset') else {}
+    return {
+        "documents": int(section.get('documents', 10000)),
+        "seed": int(section.get('seed', 0)),
+        "nesting_depth": int(section.get('nesting_depth', 1)),
+        "extra_fields": int(section.get('extra_fields', 0)),
+        "document_size": int(section.get('document_size', 0)),
+        "size_distribution": section.get('size_distribution', 'fixed').strip(),
+        "batch_size": int(section.get('batch_size', 1000)),
+    }
+
+def read_insert_suite_config(config):
+    if not config.has_section('insert-suite'):
+        return {"enabled": False}
+    section = config['insert-suite']
+    split = lambda key, default: [value.strip() for value in section.get(key, default).split(',') if value.strip()]
+    return {
+        "enabled": section.getboolean('enabled', False),
+        "documents": int(section.get('documents', 10000)),
+        "batch_sizes": [int(value) for value in split('batch_sizes', '1, 10, 100, 1000')],
+        "concurrency": [int(value) for value in split('concurrency', '1, 2, 4')],
+        "writer": section.get('writer', 'threads').strip(),
+        "ordered": [value.lower() in ('yes', 'true', '1') for value in split('ordered', 'yes, no')],
+        "write_concerns": split('write_concerns', '1'),
+    }
+
+def read_query_workload_config(config):
+    if not config.has_section('query-workload'):
+        return {"enabled": False}
+    section = config['query-workload']
+    split = lambda key, default: [value.strip() for value in section.get(key, default).split(',') if value.strip()]
+    return {
+        "enabled": section.getboolean('enabled', False),
+        "rate": float(section.get('rate', 100)),
+        "duration": float(section.get('duration', 10)),
+        "workers": int(section.get('workers', 8)),
+        "classes": split('classes', ', '.join(QUERY_CLASSES)),
+        "index_modes": split('index_modes', 'none, indexed'),
+    }
+
+def get_mongo_client(device_ip, port, database_name, backend='pymongo'):
     try:
+        if backend == 'mongomock':
+            # In-process fake MongoDB, to run the benchmarks without a mongod (pip install mongomock)
+            import mongomock
+            return mongomock.MongoClient()[database_name]
         client = MongoClient(device_ip, port)
         db = client[database_name]
         return db
@@ -34,31 +99,260 @@ def read_json_file(filename):
         data = json.load(file)
     return data
 
-def measure_insertion_time(db, collection_name, data, repetitions):
+def load_dataset(config):
+    # Returns a function giving a fresh iterator over the documents to insert.
+    # db_file = synthetic streams generated documents instead of loading a JSON file
+    if config['db_file'] == 'synthetic':
+        dataset = config['dataset']
+        return lambda: generate_documents(dataset['documents'], dataset['seed'], dataset['nesting_depth'],
+                                          dataset['extra_fields'], dataset['document_size'], dataset['size_distribution'])
+    data = read_json_file(config['db_file'])
+    return lambda: iter(data)
+
+def measure_insertion_time(db, collection_name, dataset, repetitions, batch_size=None):
+    # dataset: list of documents or a function returning a fresh iterator over them (see load_dataset).
+    # With a batch_size the documents are read and inserted batch by batch, so they are never all in RAM.
+    # Only the insert_many calls are timed, not the generation of the documents
     collection = db[collection_name]
     
     total_successful_inserts = 0
     total_failed_inserts = 0
+    total_attempts = 0
+    insertion_time = 0.0
 
-    start_time = time.time()
     for _ in range(repetitions):
-        try:
-            result = collection.insert_many(data, ordered=False)
-            total_successful_inserts += len(result.inserted_ids)
-        except Exception as e:
-            # When using ordered=False, BulkWriteError is raised for failed inserts.
-            # The details of the failed inserts can be found in the 'writeErrors' attribute.
-            if hasattr(e, 'details') and 'writeErrors' in e.details:
-                total_failed_inserts += len(e.details['writeErrors'])
-    end_time = time.time()
-
-    total_attempts = len(data) * repetitions
-    success_rate = (total_successful_inserts / total_attempts) * 100
+        documents = dataset() if callable(dataset) else dataset
+        batches = iter_batches(documents, batch_size) if batch_size else [list(documents)]
+        for batch in batches:
+            # Fresh copies without _id, so repeating the same documents doesn't fail on duplicate keys
+            batch = [{k: v for k, v in document.items() if k != '_id'} for document in batch]
+            total_attempts += len(batch)
+            start_time = time.perf_counter()
+            try:
+                result = collection.insert_many(batch, ordered=False)
+                total_successful_inserts += len(result.inserted_ids)
+            except Exception as e:
+                # When using ordered=False, BulkWriteError is raised for failed inserts.
+                # The details of the failed inserts can be found in the 'writeErrors' attribute.
+                if hasattr(e, 'details') and 'writeErrors' in e.details:
+                    total_failed_inserts += len(e.details['writeErrors'])
+                    total_successful_inserts += e.details.get('nInserted', 0)
+            insertion_time += time.perf_counter() - start_time
+
+    success_rate = (total_successful_inserts / total_attempts) * 100 if total_attempts else 0
     
-    avg_insertion_time = (end_time - start_time) / repetitions
+    avg_insertion_time = insertion_time / repetitions
 
     return avg_insertion_time, success_rate
 
+def parse_write_concern(value):
+    # "1", "0", "majority", optionally with ":j" to wait for the journal (e.g. "majority:j")
+    w, _, journal = value.partition(':')
+    return WriteConcern(w=int(w) if w.isdigit() else w, j=True if journal == 'j' else None)
+
+def cycle_documents(dataset):
+    # Like itertools.cycle, but restarts the dataset instead of keeping a copy of everything it returned
+    while True:
+        empty = True
+        for document in dataset():
+            empty = False
+            yield document
+        if empty:
+            return
+
+def make_batches(dataset, documents, batch_size):
+    # Cycles over the source documents, as fresh copies without _id so every insert is a new document
+    source = itertools.islice(cycle_documents(dataset), documents)
+    while True:
+        batch = [{k: v for k, v in document.items() if k != '_id'} for document in itertools.islice(source, batch_size)]
+        if not batch:
+            return
+        yield batch
+
+def counted_batches(batches, totals):
+    # Adds the BSON size of every batch to totals['payload_bytes'] as it's produced
+    for batch in batches:
+        totals['payload_bytes'] += sum(len(bson.encode(document)) for document in batch)
+        yield batch
+
+def locked_batches(batches, lock):
+    # One per writer thread: they all pull from the same batch generator, each batch going to whichever is free first
+    while True:
+        with lock:
+            batch = next(batches, None)
+        if batch is None:
+            return
+        yield batch
+
+def feed_batches(batches, batch_queue, writers, errors):
+    # Producer thread of the writer processes, then one None per writer to stop them, even when producing failed
+    # (the error goes to errors for run_insert_case to raise). The queue is bounded, so only a few batches are ever waiting
+    try:
+        for batch in batches:
+            batch_queue.put(batch)
+    except Exception as e:
+        errors.append(e)
+    finally:
+        for _ in range(writers):
+            batch_queue.put(None)
+
+def insert_batches(collection, batches, ordered):
+    # Returns the latency (ms) of every batch and the number of documents inserted
+    latencies = []
+    inserted = 0
+    for batch in batches:
+        started = time.perf_counter()
+        try:
+            result = collection.insert_many(batch, ordered=ordered)
+            inserted += len(result.inserted_ids)
+        except Exception as e:
+            if hasattr(e, 'details') and 'nInserted' in e.details:
+                inserted += e.details['nInserted']
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies, inserted
+
+def insert_batches_worker(device_ip, port, database_name, backend, collection_name, write_concern, batch_queue, ordered):
+    # Writer process: opens its own connection and inserts the batches of the queue until it gets None
+    db = get_mongo_client(device_ip, port, database_name, backend)
+    collection = db[collection_name].with_options(write_concern=parse_write_concern(write_concern))
+    return insert_batches(collection, iter(batch_queue.get, None), ordered)
+
+def run_insert_case(db, device_ip, config, dataset, batch_size, concurrency, ordered, write_concern):
+    suite = config['insert_suite']
+    collection_name = config['collection_name']
+    drop_collection(db, collection_name)
+    collection = db[collection_name].with_options(write_concern=parse_write_concern(write_concern))
+
+    # Batches are generated (and sized) while the writers take them, so the documents are never all in RAM.
+    # Generating them and handing them to the writers isn't ingest, so the throughput only counts insert_many time
+    totals = {'payload_bytes': 0}
+    batches = counted_batches(make_batches(dataset, suite['documents'], batch_size), totals)
+
+    started = time.perf_counter()
+    if suite['writer'] == 'processes':
+        errors = []
+        with multiprocessing.Manager() as manager, ProcessPoolExecutor(max_workers=concurrency) as executor:
+            batch_queue = manager.Queue(maxsize=2 * concurrency)
+            feeder = threading.Thread(target=feed_batches, args=(batches, batch_queue, concurrency, errors), daemon=True)
+            feeder.start()
+            futures = [executor.submit(insert_batches_worker, device_ip, config['mongodb_port'], config['database_name'],
+                                       config['backend'], collection_name, write_concern, batch_queue, ordered)
+                       for _ in range(concurrency)]
+            results = [future.result() for future in futures]
+            feeder.join()
+        if errors:
+            raise errors[0]
+    else:
+        lock = threading.Lock()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(lambda _: insert_batches(collection, locked_batches(batches, lock), ordered),
+                                        range(concurrency)))
+    elapsed = time.perf_counter() - started
+    payload_bytes = totals['payload_bytes']
+
+    latencies = [latency for worker_latencies, _ in results for latency in worker_latencies]
+    inserted = sum(worker_inserted for _, worker_inserted in results)
+    # The writers insert in parallel: the ingest time is that of the busiest one, the sum of its insert_many calls
+    insert_seconds = max((sum(worker_latencies) for worker_latencies, _ in results), default=0) / 1000
+    stats = summarize(latencies, resamples=0)
+    return {
+        "batch_size": batch_size,
+        "concurrency": concurrency,
+        "ordered": ordered,
+        "write_concern": write_concern,
+        "documents": suite['documents'],
+        "inserted": inserted,
+        "seconds": elapsed,
+        "insert_seconds": insert_seconds,
+        "docs_per_second": inserted / insert_seconds if insert_seconds else 0,
+        "mb_per_second": payload_bytes / insert_seconds / 1e6 if insert_seconds else 0,
+        "latencies": latencies,
+        "stats": stats,
+    }
+
+def run_insert_suite(db, device_ip, config, dataset):
+    # Sweeps batch size x writer concurrency x ordered/unordered x write concern
+    suite = config['insert_suite']
+    cases = []
+    for batch_size, concurrency, ordered, write_concern in itertools.product(
+            suite['batch_sizes'], suite['concurrency'], suite['ordered'], suite['write_concerns']):
+        cases.append(run_insert_case(db, device_ip, config, dataset, batch_size, concurrency, ordered, write_concern))
+    drop_collection(db, config['collection_name'])
+    return cases
+
+def write_insert_suite_to_file(results_file, device_name, device_ip, writer, cases):
+    with open(results_file, "a") as file:
+        file.write("-------------------------\n")
+        file.write(f"Device Name: {device_name}\n")
+        file.write(f"Device IP: {device_ip}\n")
+        file.write(f"Insert Suite ({writer} writers):\n")
+        for case in cases:
+            stats = case['stats']
+            file.write(f"Batch Size: {case['batch_size']}, Writers: {case['concurrency']}, "
+                       f"Ordered: {'yes' if case['ordered'] else 'no'}, Write Concern: {case['write_concern']} -> "
+                       f"{case['docs_per_second']:.0f} docs/s, {case['mb_per_second']:.2f} MB/s, "
+                       f"batch latency p50/p90/p99: {stats['p50']:.3f}/{stats['p90']:.3f}/{stats['p99']:.3f} ms, "
+                       f"inserted {case['inserted']}/{case['documents']}\n")
+        file.write("\n")
+
+def store_insert_suite(store, run_id, category, device_name, device_ip, writer, cases):
+    for case in cases:
+        store.append(run_id, category, device_name, "insert_batch_latency", case['latencies'], "ms",
+                     device_ip=device_ip, writer=writer, batch_size=case['batch_size'], concurrency=case['concurrency'],
+                     ordered=case['ordered'], write_concern=case['write_concern'], inserted=case['inserted'],
+                     docs_per_second=case['docs_per_second'], mb_per_second=case['mb_per_second'])
+
+def run_query_workload(db, config, dataset):
+    # Loads the dataset once, then runs the open-loop query mix without and with secondary indexes
+    workload = config['query_workload']
+    unknown = [name for name in workload['classes'] if name not in QUERY_CLASSES]
+    if unknown:
+        raise ValueError(f"Unknown query classes {unknown}. Available: {', '.join(QUERY_CLASSES)}")
+
+    drop_collection(db, config['collection_name'])
+    collection = db[config['collection_name']]
+    farm_names = populate_collection(collection, dataset(), config['dataset']['batch_size'])
+
+    cases = []
+    for index_mode in workload['index_modes']:
+        set_indexes(collection, index_mode == 'indexed')
+        histograms, errors, elapsed = run_open_loop(collection, workload['classes'], farm_names,
+                                                    workload['rate'], workload['duration'], workload['workers'])
+        for name in workload['classes']:
+            histogram = histograms[name]
+            cases.append({
+                "index_mode": index_mode,
+                "query_class": name,
+                "errors": errors[name],
+                "throughput": histogram.total_count / elapsed if elapsed else 0,
+                "histogram": histogram,
+                "stats": dict(zip(("p50", "p90", "p99", "p99_9"), histogram.percentiles((50, 90, 99, 99.9))),
+                              mean=histogram.mean(), count=histogram.total_count),
+            })
+    drop_collection(db, config['collection_name'])
+    return cases
+
+def write_query_workload_to_file(results_file, device_name, device_ip, workload, cases):
+    with open(results_file, "a") as file:
+        file.write("-------------------------\n")
+        file.write(f"Device Name: {device_name}\n")
+        file.write(f"Device IP: {device_ip}\n")
+        file.write(f"Query Workload ({workload['rate']:g} requests/s for {workload['duration']:g} s, open loop):\n")
+        for case in cases:
+            stats = case['stats']
+            file.write(f"Index: {case['index_mode']}, Query: {case['query_class']} -> {case['throughput']:.1f} queries/s, "
+                       f"latency p50/p90/p99: {stats['p50']:.3f}/{stats['p90']:.3f}/{stats['p99']:.3f} ms, "
+                       f"errors: {case['errors']}\n")
+        file.write("\n")
+
+def store_query_workload(store, run_id, category, device_name, device_ip, workload, cases):
+    # No raw samples, the record carries the encoded histogram of the corrected latencies
+    for case in cases:
+        store.append(run_id, category, device_name, "query_latency", [], "ms", device_ip=device_ip,
+                     query_class=case['query_class'], index_mode=case['index_mode'], rate=workload['rate'],
+                     throughput=case['throughput'], errors=case['errors'], histogram=case['histogram'].encode(),
+                     **case['stats'])
+
 def drop_collection(db, collection_name):
     try:
         db.drop_collection(collection_name)
@@ -77,6 +371,10 @@ def write_processing_time_to_file(results_file, device_name, device_ip, avg_inse
         file.write("-------------------------\n")
         file.write("\n".join(results) + "\n\n")
 
+def store_processing_time(store, run_id, category, device_name, device_ip, avg_insertion_time, success_rate):
+    store.append(run_id, category, device_name, "insertion_time", [avg_insertion_time], "s",
+                 device_ip=device_ip, success_rate=success_rate)
+
 def write_completion_layer_notice(results_file, category):
     with open(results_file, "a") as file:
         file.write("\n" + ('*' * 40) + "\n")
@@ -86,32 +384,58 @@ def write_completion_layer_notice(results_file, category):
 
 if __name__ == "__main__":
     try:
-        config = read_config("config.cfg")
-        # json_data = read_json_file(config['db_file'])
-        json_data = read_json_file("sample_agriculture_data.json") # TODO: hardcoded
+        config = read_config(script_config(__file__))
+        store = ResultsStore(config['store_dir']) if config['store_dir'] else None
+        run_id = new_run_id(__file__)
+        dataset = load_dataset(config)
 
          # Write the initial lines to the results file
         script_name = os.path.basename(__file__)
         current_date = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-        with open(config['results_file'], "a") as file:
-            file.write(f"Running {script_name} on {current_date}\n")
-            file.write(f"(Configuration: Repetitions: {config['repetitions']})\n")
-            file.write(f"{'*' * 60}\n\n")
+        if config['text_results']:
+            with open(config['results_file'], "a") as file:
+                file.write(f"Running {script_name} on {current_date}\n")
+                file.write(f"(Configuration: Repetitions: {config['repetitions']})\n")
+                file.write(f"{'*' * 60}\n\n")
 
         # Run the script for the devices specified in the config file
         for category in ['extreme-edge', 'near-edge']:
             for device_name, device_ip in config[category].items():
-                db = get_mongo_client(device_ip, config['mongodb_port'], config['database_name'])
+                db = get_mongo_client(device_ip, config['mongodb_port'], config['database_name'], config['backend'])
                 
                 if db is None:
                     print(f"Skipping {device_name} due to connection issues.")
                     continue  # Skip the rest of the loop for this device
-                
-                avg_insertion_time, success_rate = measure_insertion_time(db, config['collection_name'], json_data, config['repetitions'])
-                write_processing_time_to_file(config['results_file'], device_name, device_ip, avg_insertion_time, success_rate)
+
+                if config['insert_suite']['enabled']:
+                    cases = run_insert_suite(db, device_ip, config, dataset)
+                    writer = config['insert_suite']['writer']
+                    if store is not None:
+                        store_insert_suite(store, run_id, category, device_name, device_ip, writer, cases)
+                    if config['text_results']:
+                        write_insert_suite_to_file(config['results_file'], device_name, device_ip, writer, cases)
+
+                if config['query_workload']['enabled']:
+                    cases = run_query_workload(db, config, dataset)
+                    workload = config['query_workload']
+                    if store is not None:
+                        store_query_workload(store, run_id, category, device_name, device_ip, workload, cases)
+                    if config['text_results']:
+                        write_query_workload_to_file(config['results_file'], device_name, device_ip, workload, cases)
+
+                if config['insert_suite']['enabled'] or config['query_workload']['enabled']:
+                    continue
+
+                avg_insertion_time, success_rate = measure_insertion_time(db, config['collection_name'], dataset, config['repetitions'],
+                                                                   config['dataset']['batch_size'] if config['db_file'] == 'synthetic' else None)
+                if store is not None:
+                    store_processing_time(store, run_id, category, device_name, device_ip, avg_insertion_time, success_rate)
+                if config['text_results']:
+                    write_processing_time_to_file(config['results_file'], device_name, device_ip, avg_insertion_time, success_rate)
                 drop_collection(db, config['collection_name'])
-            write_completion_layer_notice(config['results_file'], category)
+            if config['text_results']:
+                write_completion_layer_notice(config['results_file'], category)
 
     except Exception as e:
         print(f"Error: {e}")
@@ -0,0 +1,74 @@
+import random
+
+import numpy as np
+
+from common.open_loop import OpenLoopScheduler
+from dataset_generator import iter_batches
+
+# Read-path workload for the processing_time database: point lookups, range scans and aggregations,
+# issued at a fixed request rate with and without secondary indexes.
+
+INDEXES = ["farm_name", "plantations.area_acres", "plantations.yield_bushels_per_acre"]
+MAX_LOOKUP_NAMES = 10000
+
+def point_lookup(collection, rng, farm_names):
+    return collection.find_one({"farm_name": rng.choice(farm_names)})
+
+def range_area(collection, rng, farm_names):
+    low = rng.randint(0, 450)
+    return list(collection.find({"plantations.area_acres": {"$gte": low, "$lt": low + 50}}).limit(100))
+
+def range_yield(collection, rng, farm_names):
+    low = rng.randint(0, 350)
+    return list(collection.find({"plantations.yield_bushels_per_acre": {"$gte": low, "$lt": low + 50}}).limit(100))
+
+def aggregate_plantations(collection, rng, farm_names):
+    return list(collection.aggregate([
+        {"$unwind": "$plantations"},
+        {"$group": {"_id": "$plantations.crop", "area_acres": {"$sum": "$plantations.area_acres"}}},
+    ]))
+
+def aggregate_animals(collection, rng, farm_names):
+    return list(collection.aggregate([
+        {"$unwind": "$animals"},
+        {"$group": {"_id": "$animals.species", "count": {"$sum": "$animals.count"}}},
+    ]))
+
+QUERY_CLASSES = {
+    "point_lookup": point_lookup,
+    "range_area": range_area,
+    "range_yield": range_yield,
+    "aggregate_plantations": aggregate_plantations,
+    "aggregate_animals": aggregate_animals,
+}
+
+def populate_collection(collection, documents, batch_size=1000):
+    # Inserts the dataset and returns a sample of farm names for the point lookups
+    farm_names = []
+    for batch in iter_batches(documents, batch_size):
+        batch = [{k: v for k, v in document.items() if k != '_id'} for document in batch]
+        collection.insert_many(batch, ordered=False)
+        farm_names.extend(document["farm_name"] for document in batch[:MAX_LOOKUP_NAMES - len(farm_names)])
+    return farm_names
+
+def set_indexes(collection, indexed):
+    collection.drop_indexes()
+    if indexed:
+        for field in INDEXES:
+            collection.create_index(field)
+
+def run_open_loop(collection, query_classes, farm_names, rate, duration, workers, seed=0):
+    # Requests are issued every 1 / rate seconds whatever the previous ones are doing (open loop, see
+    # common.open_loop), cycling through the query classes. Returns {class: latency histogram} measured from the
+    # scheduled start of each request, {class: failed requests} and the elapsed seconds
+    rng = random.Random(seed)
+    scheduler = OpenLoopScheduler(rate, int(rate * duration), workers)
+    scheduler.run(lambda seq: QUERY_CLASSES[query_classes[seq % len(query_classes)]](collection, rng, farm_names))
+
+    histograms, errors = {}, {}
+    seqs = np.arange(scheduler.issued)
+    for position, name in enumerate(query_classes):
+        class_seqs = seqs[seqs % len(query_classes) == position]
+        histograms[name] = scheduler.histogram(seqs=class_seqs)
+        errors[name] = int((~scheduler.ok[class_seqs]).sum())
+    return histograms, errors, scheduler.elapsed
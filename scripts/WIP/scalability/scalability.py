@@ -1,72 +1,214 @@
 import subprocess
-import configparser
 import datetime
+import multiprocessing
 import os
+import shutil
 import socket
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from common.config import config_path, load_config, script_config
+from common.proc_sampler import ProcSampler
+from common.results_store import ResultsStore, new_run_id
+from common.stress import run_cpu_stress
+
+# SLO metrics a load step can be evaluated against
+SLO_METRICS = {
+    "cpu": "CPU usage (us + sy, %)",
+    "run_queue": "Run queue length (runnable tasks)",
+    "psi": "CPU pressure stall (%)",
+    "probe_latency": "p99 wake-up latency of a probe task (ms)",
+}
+PROBE_SLEEP = 0.005  # Seconds the probe task asks to sleep, the overshoot is its latency
+MIN_SAMPLES = 3  # Samples taken before a step can be stopped early
 
 def read_config(filename):
-    config = configparser.ConfigParser()
-    config.read(filename)
+    config = load_config(filename)
     return {
-        "results_file": config['general'].get('results_file', ''),
+        "results_file": config_path(filename, config['general'].get('results_file', '')),
         "duration": int(config['general'].get('duration')),
-        "stress_cpu": int(config['scalability'].get('stress_cpu', 1)),
-        "stress_io": int(config['scalability'].get('stress_io', 1)),
-        "stress_vm": int(config['scalability'].get('stress_vm', 1)),
+        "store_dir": config_path(filename, config['general'].get('store_dir', '')),
+        "process_increment": int(config['scalability'].get('process_increment', 1)),
+        "max_processes": int(config['scalability'].get('max_processes', 10)),
+        "load": config['scalability'].get('load', 'native').strip(),
         "stress_vm_bytes": config['scalability'].get('stress_vm_bytes', '50M'),
-        "threshold": int(config['scalability'].get('threshold', 95))
+        "slo_metric": config['scalability'].get('slo_metric', 'cpu').strip(),
+        "threshold": float(config['scalability'].get('threshold', 95)),
+        "early_stop_margin": float(config['scalability'].get('early_stop_margin', 10)),
+        "sample_interval": float(config['scalability'].get('sample_interval', 0.5))
     }
 
 def stress_system(cpu, io, vm, vm_bytes, duration):
+    # Starts the stress tool without waiting for it, so the system can be sampled while it runs
     cmd = [
         "stress",
         "--cpu", str(cpu),
         "--io", str(io),
         "--vm", str(vm),
         "--vm-bytes", vm_bytes,
-        "--timeout", str(duration) + "s",
-        "--verbose"
+        "--timeout", str(duration) + "s"
     ]
-    subprocess.run(cmd)
+    return subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def start_load(workers, duration, load, vm_bytes):
+    # Returns a function stopping the load early
+    if load == 'stress':
+        if shutil.which("stress") is None:
+            raise RuntimeError("load = stress needs the stress tool (apt-get install stress)")
+        process = stress_system(workers, workers, workers, vm_bytes, duration)
+        def stop():
+            process.terminate()
+            process.wait()
+        return stop
+
+    stop_event = multiprocessing.Event()
+    thread = threading.Thread(target=run_cpu_stress, args=(duration, workers, "integer", 1.0, stop_event))
+    thread.start()
+    def stop():
+        stop_event.set()
+        thread.join()
+    return stop
+
+def probe_task(stop_event, delays):
+    # Measures how late a short sleep wakes up, a proxy for the latency a real task would see
+    while not stop_event.is_set():
+        started = time.perf_counter()
+        time.sleep(PROBE_SLEEP)
+        delays.append((time.perf_counter() - started - PROBE_SLEEP) * 1000)
+
+def slo_value(metric, series, delays):
+    if metric == "cpu":
+        values = series["cpu_us"] + series["cpu_sy"]
+    elif metric == "run_queue":
+        values = series["run_queue"]
+    elif metric == "psi":
+        if "psi_cpu" not in series:
+            raise RuntimeError("slo_metric = psi needs /proc/pressure/cpu (Linux 4.20+ with PSI enabled)")
+        values = series["psi_cpu"]
+    else:
+        return float(np.percentile(delays, 99)) if delays else float("nan"), np.asarray(delays)
+    return float(values.mean()) if values.size else float("nan"), values
+
+def measure_step(workers, config):
+    # Runs the load and samples the system at the same time. The step ends early once the SLO metric
+    # is clearly above or below the threshold (outside threshold +/- early_stop_margin %) for MIN_SAMPLES samples
+    duration, interval = config['duration'], config['sample_interval']
+    threshold, margin = config['threshold'], config['early_stop_margin'] / 100
+    sampler = ProcSampler(interval, duration)
+    probe_stop, delays = threading.Event(), []
+    probe_thread = threading.Thread(target=probe_task, args=(probe_stop, delays), daemon=True)
 
-def capture_vmstat(interval=1, duration=60):
-    cmd = ["vmstat", str(interval), str(duration)]
-    result = subprocess.check_output(cmd, universal_newlines=True)
-    return result.split("\n")[2:-1]
+    stop_load = start_load(workers, duration, config['load'], config['stress_vm_bytes'])
+    probe_thread.start()
+    start = time.monotonic()
+    early_stop = None
+    try:
+        sampler.sample()
+        tick = 0
+        while sampler.num_samples < sampler.capacity:
+            tick += 1
+            delay = start + tick * interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            sampler.sample()
+
+            if sampler.num_samples < MIN_SAMPLES:
+                continue
+            _, values = slo_value(config['slo_metric'], sampler.series(), list(delays))
+            recent = values[-MIN_SAMPLES:]
+            if recent.size and np.all(recent > threshold * (1 + margin)):
+                early_stop = "over"
+                break
+            if recent.size and np.all(recent < threshold * (1 - margin)) and time.monotonic() - start >= duration / 2:
+                early_stop = "under"
+                break
+    finally:
+        stop_load()
+        probe_stop.set()
+        probe_thread.join()
+        sampler.close()
 
-def stress_until_limit(cpu_start=1, io_start=1, vm_start=1, vm_bytes="50M", duration=60, threshold=95):
-    max_processes = 0
-    while True:
-        # Run stress tool
-        stress_system(cpu_start, io_start, vm_start, vm_bytes, duration)
+    value, _ = slo_value(config['slo_metric'], sampler.series(), delays)
+    return {
+        "workers": workers,
+        "value": value,
+        "breached": value > threshold,
+        "seconds": time.monotonic() - start,
+        "early_stop": early_stop,
+    }
 
-        # Get the output of vmstat
-        results = capture_vmstat(1, duration)
+def find_capacity(config):
+    # Brackets the breaking point by doubling the workers from process_increment up to max_processes,
+    # then binary searches inside the bracket with a resolution of process_increment workers.
+    # Returns the largest worker count meeting the SLO (0 if even the first step breaches it) and every step run
+    increment, maximum = max(1, config['process_increment']), config['max_processes']
+    steps = {}
 
-        # Extract CPU user time from the last line
-        cpu_usage = int(results[-1].split()[12])
+    def run(workers):
+        if workers not in steps:
+            steps[workers] = measure_step(workers, config)
+            step = steps[workers]
+            print(f"{workers} workers: {config['slo_metric']} = {step['value']:.2f} "
+                  f"({'breached' if step['breached'] else 'ok'}{', stopped early' if step['early_stop'] else ''})")
+        return steps[workers]['breached']
 
-        # If CPU usage exceeds threshold, break
-        if cpu_usage > threshold:
+    # Bracketing
+    good, bad = 0, None
+    workers = increment
+    while workers <= maximum:
+        if run(workers):
+            bad = workers
             break
+        good = workers
+        if workers == maximum:
+            break
+        workers = min(workers * 2, maximum)
+
+    if bad is None:
+        return good, [steps[workers] for workers in sorted(steps)]
 
-        # Increase the number of processes for the next run
-        cpu_start += 1
-        io_start += 1
-        vm_start += 1
-        max_processes += 1
+    # Binary search between the last passing and the first breaching step
+    while bad - good > increment:
+        middle = good + (bad - good) // 2
+        middle -= (middle - good) % increment
+        if middle <= good:
+            break
+        if run(middle):
+            bad = middle
+        else:
+            good = middle
 
-    return max_processes
+    return good, [steps[workers] for workers in sorted(steps)]
 
-def write_results_to_file(results_file, hostname, max_processes):
+def write_results_to_file(results_file, hostname, config, capacity, steps):
     with open(results_file, "a") as file:
         file.write("-------------------------\n")
         file.write(f"Device name: {hostname}\n\n")
-        file.write(f"Maximum number of processes achieved before hitting the threshold: {max_processes}\n\n")
+        file.write(f"SLO: {SLO_METRICS[config['slo_metric']]} <= {config['threshold']}\n")
+        file.write(f"Search bounds: {config['process_increment']} to {config['max_processes']} workers "
+                   f"(step {config['process_increment']})\n")
+        for step in steps:
+            early_stop = f", stopped early ({step['early_stop']} threshold)" if step['early_stop'] else ""
+            file.write(f"Workers: {step['workers']} -> {step['value']:.2f} in {step['seconds']:.1f} s"
+                       f"{' (breached)' if step['breached'] else ''}{early_stop}\n")
+        file.write(f"Maximum number of processes achieved before hitting the threshold: {capacity}\n\n")
+
+def store_results(store, run_id, hostname, config, capacity, steps):
+    for step in steps:
+        store.append(run_id, "local", hostname, "capacity_step", [step['value']], "", workers=step['workers'],
+                     breached=step['breached'], early_stop=step['early_stop'], slo_metric=config['slo_metric'])
+    store.append(run_id, "local", hostname, "capacity", [capacity], "workers", slo_metric=config['slo_metric'],
+                 threshold=config['threshold'])
 
 if __name__ == "__main__":
     try:
-        config = read_config("config.cfg")
+        config = read_config(script_config(__file__))
+        if config['slo_metric'] not in SLO_METRICS:
+            raise ValueError(f"Unknown slo_metric '{config['slo_metric']}'. Available: {', '.join(SLO_METRICS)}")
 
         # Initial info for results file
         script_name = os.path.basename(__file__)
@@ -75,19 +217,14 @@ if __name__ == "__main__":
             file.write(f"Running {script_name} on {current_date}\n")
             file.write(f"{'*' * 60}\n\n")
 
-        # Stress the system until limit and get max processes
-        max_processes = stress_until_limit(
-            cpu_start=config['stress_cpu'],
-            io_start=config['stress_io'],
-            vm_start=config['stress_vm'],
-            vm_bytes=config['stress_vm_bytes'],
-            duration=config['duration'],
-            threshold=config['threshold']
-        )
+        # Search the number of workers at which the SLO is breached
+        capacity, steps = find_capacity(config)
 
         # Write the results to the file
         hostname = socket.gethostname()
-        write_results_to_file(config['results_file'], hostname, max_processes)
+        write_results_to_file(config['results_file'], hostname, config, capacity, steps)
+        if config['store_dir']:
+            store_results(ResultsStore(config['store_dir']), new_run_id(__file__), hostname, config, capacity, steps)
 
     except Exception as e:
         print(f"Error: {e}")
@@ -0,0 +1,109 @@
+import argparse
+import datetime
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common.config import config_path, load_config, read_layers
+from common.instrumentation import HARNESS, report_overhead, report_usage
+from common.kpi import Device, load_kpi, store_records
+from common.results_store import ResultsStore, new_run_id
+from common.sweep import SharedExclusiveLock, sweep_devices
+
+# Runs several KPIs in a single pass over the device inventory of benchmark.cfg:
+#   python benchmark.py [--config benchmark.cfg] [--kpis latency,availability,throughput]
+# Every device gets its non-exclusive KPIs (latency, availability) at the same time, then its exclusive ones
+# (throughput) alone: no other measurement runs anywhere while an exclusive one does. Devices are swept
+# concurrently within the concurrency limits, and every record goes to the results store.
+
+def read_config(filename, kpis=None):
+    config = load_config(filename)
+
+    concurrency = int(config['general'].get('concurrency', 1))
+    kpis = kpis or [kpi.strip() for kpi in config['general'].get('kpis', '').split(',') if kpi.strip()]
+    variables = {
+        "kpis": kpis,
+        "concurrency": concurrency,
+        "store_dir": config_path(filename, config['general'].get('store_dir', '')),
+        "instrumentation": config['general'].getboolean('instrumentation', False),
+        "options": {},
+    }
+    for kpi in kpis:
+        if not config.has_section(kpi):
+            raise ValueError(f"Missing [{kpi}] section in {filename}")
+        variables["options"][kpi] = load_kpi(kpi).read_options(config[kpi])
+    if not variables['store_dir']:
+        raise ValueError("The runner only writes to the results store, store_dir can't be empty")
+    variables.update(read_layers(config, concurrency))
+    return variables
+
+def measure_device(device, plugins, lock):
+    # Returns {kpi: records, or the exception raised while measuring it}
+    outcomes = {}
+
+    def run(plugin):
+        # Timed per KPI, as the KPIs of a device run at the same time
+        with HARNESS.scope((device.layer, device.name, plugin.name)):
+            try:
+                return plugin.measure(device)
+            except Exception as e:
+                return e
+
+    shared = [plugin for plugin in plugins if not plugin.exclusive]
+    if shared:
+        with lock.shared(), ThreadPoolExecutor(max_workers=len(shared)) as executor:
+            for plugin, outcome in zip(shared, executor.map(run, shared)):
+                outcomes[plugin.name] = outcome
+    for plugin in plugins:
+        if plugin.exclusive:
+            with lock.exclusive():
+                outcomes[plugin.name] = run(plugin)
+    return outcomes
+
+def write_device_summary(device, outcomes, peak_concurrency):
+    parts = []
+    for kpi, outcome in outcomes.items():
+        parts.append(f"{kpi}: error ({outcome})" if isinstance(outcome, Exception) else f"{kpi}: {len(outcome)} records")
+    print(f"[{device.layer}] {device.name} ({device.ip}) -> {', '.join(parts)} (concurrent devices: {peak_concurrency})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure several KPIs in one sweep over the devices")
+    parser.add_argument("--config", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark.cfg"))
+    parser.add_argument("--kpis", help="Comma-separated KPIs, overriding the kpis key of the config")
+    args = parser.parse_args()
+
+    try:
+        kpis = [kpi.strip() for kpi in args.kpis.split(',') if kpi.strip()] if args.kpis else None
+        config = read_config(args.config, kpis)
+        plugins = [load_kpi(kpi)(config['options'][kpi]) for kpi in config['kpis']]
+        store = ResultsStore(config['store_dir'])
+        run_id = new_run_id(__file__)
+        lock = SharedExclusiveLock()
+
+        current_date = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        if config['instrumentation']:
+            HARNESS.start()
+        print(f"Running {', '.join(config['kpis'])} on {current_date} (run {run_id})")
+
+        sweep = sweep_devices(config, lambda device: measure_device(device, plugins, lock))
+        for layer in config['layers']:
+            for device_name, device_ip, future in sweep[layer]:
+                device = Device(layer, device_name, device_ip)
+                outcomes, peak_concurrency = future.result()
+                for kpi, outcome in outcomes.items():
+                    scope = (layer, device_name, kpi)
+                    if not isinstance(outcome, Exception):
+                        with HARNESS.scope(scope):
+                            store_records(store, run_id, device, outcome, peak_concurrency=peak_concurrency)
+                    if config['instrumentation']:
+                        # Next to the KPI's records, and for failed measurements too
+                        report_overhead(scope, device, store=store, run_id=run_id, measured_kpi=kpi)
+                write_device_summary(device, outcomes, peak_concurrency)
+        if config['instrumentation']:
+            report_usage(Device("local", "harness", ""), store=store, run_id=run_id)
+        print(f"Benchmark successfully executed. Results stored in: {config['store_dir']} (run {run_id})")
+
+    except Exception as e:
+        print(f"Error: {e}")
@@ -0,0 +1,115 @@
+import math
+
+import numpy as np
+
+from common.kpi import Record
+
+# Availability from a stream of probes (common.prober ProbeSamples), so the same probes can also give the latency.
+#
+# An outage is a run of at least `outage_probes` consecutive lost probes. It starts when the first lost probe was
+# scheduled and ends when the next successful one was (or one interval after the last probe if it never recovered).
+# MTBF is the time up divided by the number of outages, MTTR the time down divided by it: both are None without
+# any outage, as there's nothing to average.
+
+def outages(samples, interval=1.0, outage_probes=1):
+    # [(start_ns, end_ns, lost_probes)] of a time-ordered list of samples
+    found = []
+    start, lost = None, 0
+    for sample in samples:
+        scheduled = sample.intended_ns if sample.intended_ns is not None else sample.sent_ns
+        if not sample.ok:
+            if start is None:
+                start = scheduled
+            lost += 1
+            continue
+        if start is not None and lost >= outage_probes:
+            found.append((start, scheduled, lost))
+        start, lost = None, 0
+    if start is not None and lost >= outage_probes:
+        last = samples[-1].intended_ns if samples[-1].intended_ns is not None else samples[-1].sent_ns
+        found.append((start, last + int(interval * 1e9), lost))
+    return found
+
+def summarize_availability(samples_per_repetition, interval=1.0, outage_probes=1):
+    # Every repetition is its own probe stream: outages don't span the gap between two of them
+    successful = total = 0
+    found = []
+    observed = 0.0
+    for samples in samples_per_repetition:
+        if not samples:
+            continue
+        successful += sum(1 for sample in samples if sample.ok)
+        total += len(samples)
+        found += outages(samples, interval, outage_probes)
+        observed += len(samples) * interval
+    downtime = sum(end - start for start, end, _ in found) / 1e9
+    uptime = max(observed - downtime, 0.0)
+    return {
+        "successful": successful,
+        "total": total,
+        "availability": successful / total * 100 if total else 0,
+        "outages": found,
+        "observed_s": observed,
+        "downtime_s": downtime,
+        "mtbf_s": uptime / len(found) if found else None,
+        "mttr_s": downtime / len(found) if found else None,
+    }
+
+def format_seconds(value):
+    return "n/a (no outage)" if value is None else f"{value:.3f} s"
+
+def availability_lines(summary):
+    # Human-readable lines, as written to the results files
+    return [
+        f"Service Availability: {summary['availability']:.2f}%",
+        f"Successful Pings: {summary['successful']}",
+        f"Total Pings: {summary['total']}",
+        f"Outages: {len(summary['outages'])} (downtime {summary['downtime_s']:.3f} s of {summary['observed_s']:.3f} s)",
+        f"MTBF: {format_seconds(summary['mtbf_s'])}",
+        f"MTTR: {format_seconds(summary['mttr_s'])}",
+    ]
+
+def availability_records(summary):
+    fields = {
+        "successful_pings": summary['successful'],
+        "total_pings": summary['total'],
+        "outages": len(summary['outages']),
+        "outage_durations_s": [(end - start) / 1e9 for start, end, _ in summary['outages']],
+        "downtime_s": summary['downtime_s'],
+        "mtbf_s": summary['mtbf_s'],
+        "mttr_s": summary['mttr_s'],
+    }
+    return [Record("availability", [summary['availability']], "%", fields)]
+
+class RollingAvailability:
+    # Availability over the last `window` seconds of a probe stream, for monitoring over weeks. Probes are counted into
+    # `buckets` time slots of window / buckets seconds reused in a ring, so the memory is constant whatever the window
+    # and the probing rate. The window moves a slot at a time: it covers between window - slot and window seconds
+    def __init__(self, window, buckets=60):
+        self.window = window
+        self.slot = window / buckets
+        self._epochs = np.full(buckets, -1, dtype=np.int64)
+        self._successful = np.zeros(buckets, dtype=np.int64)
+        self._total = np.zeros(buckets, dtype=np.int64)
+        self._latest = -1
+
+    def add(self, timestamp, ok):
+        # timestamp in seconds (any clock, as long as it doesn't go back)
+        epoch = int(timestamp // self.slot)
+        index = epoch % self._epochs.size
+        if self._epochs[index] != epoch:
+            self._epochs[index] = epoch
+            self._successful[index] = self._total[index] = 0
+        self._successful[index] += ok
+        self._total[index] += 1
+        self._latest = max(self._latest, epoch)
+
+    def counts(self, now=None):
+        # (successful, total) of the slots still inside the window at `now` (default: the latest probe)
+        latest = self._latest if now is None else int(now // self.slot)
+        current = self._epochs > latest - self._epochs.size
+        return int(self._successful[current].sum()), int(self._total[current].sum())
+
+    def availability(self, now=None):
+        successful, total = self.counts(now)
+        return successful / total * 100 if total else math.nan
@@ -0,0 +1,50 @@
+import time
+
+import numpy as np
+
+# Clock offset between this machine (the reference) and a remote one, estimated like NTP does: the remote clock is
+# read during a request/reply exchange and compared with the midpoint of the exchange on the local clock. The error
+# is at most half the round trip, so the exchange with the shortest round trip of a few is kept.
+#
+# Remote measurements then start at the same reference instant (each device waits for its own clock to reach the
+# start time shifted by its offset), and their samples are moved to the reference clock and resampled on a shared
+# grid, so the time series of every device line up.
+
+def estimate_offset(read_remote_clock, exchanges=8):
+    # read_remote_clock() returns (sent, remote, received): local wall time just before the request, remote wall time
+    # while serving it and local wall time just after the reply.
+    # Returns (offset, round_trip) in seconds, offset being remote - local
+    best = None
+    for _ in range(exchanges):
+        sent, remote, received = read_remote_clock()
+        round_trip = received - sent
+        if best is None or round_trip < best[1]:
+            best = (remote - (sent + received) / 2, round_trip)
+    return best
+
+def wait_until(wall_time, spin=0.002):
+    # Sleeps until time.time() reaches wall_time, spinning through the last `spin` seconds: sleep() alone can
+    # overshoot by a scheduler tick
+    while True:
+        remaining = wall_time - time.time()
+        if remaining <= 0:
+            return
+        if remaining > spin:
+            time.sleep(remaining - spin)
+
+def common_grid(times_per_device, start, interval):
+    # Reference times start + k * interval (k integer) within the span sampled by every device. A sampler's first
+    # sample comes one interval after the start and the devices don't stop at the same instant, so the grid only
+    # begins once all of them have a sample and ends with the first one to stop
+    first = max(times[0] for times in times_per_device)
+    last = min(times[-1] for times in times_per_device)
+    steps = np.arange(np.ceil((first - start) / interval - 1e-9), np.floor((last - start) / interval + 1e-9) + 1)
+    return start + steps * interval
+
+def align_series(series, times, start, grid):
+    # Resamples every column of series, sampled at `times` (reference clock, increasing), on grid (a common_grid())
+    # by linear interpolation. "aligned_time" holds the grid in seconds since start
+    aligned = {"aligned_time": grid - start}
+    for column, values in series.items():
+        aligned[column] = np.interp(grid, times, values)
+    return aligned
@@ -0,0 +1,45 @@
+import configparser
+import os
+
+from common.instrumentation import HARNESS
+
+# Config helpers shared by the KPI scripts and the benchmark runner.
+# Paths in a config file are relative to the file itself, so the scripts can be started from any directory.
+
+def load_config(filename, interpolation=True):
+    config = configparser.ConfigParser() if interpolation else configparser.ConfigParser(interpolation=None)
+    if not config.read(filename):
+        raise FileNotFoundError(f"Config file not found: {filename}")
+    return config
+
+def script_config(script_file, name="config.cfg"):
+    # The config.cfg next to a KPI script
+    return os.path.join(os.path.dirname(os.path.abspath(script_file)), name)
+
+def config_path(config_file, path):
+    # Resolves a path read from config_file relative to its directory. Empty paths stay empty (disabled)
+    path = (path or "").strip()
+    if not path or os.path.isabs(path):
+        return path
+    return os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(config_file)), path))
+
+def read_layers(config, default_concurrency=1):
+    # Device inventory: {"layers": [...], <layer>: {device_name: ip}, "layer_concurrency": {layer: limit}}
+    layers = [layer.strip() for layer in config['general'].get('layers').split(',') if layer.strip()]
+    variables = {"layers": layers, "layer_concurrency": {}}
+    for layer in layers:
+        variables[layer] = {k.replace("_ip", ""): v for k, v in config[layer].items() if k.endswith('_ip')}
+        variables["layer_concurrency"][layer] = int(config[layer].get('concurrency', default_concurrency))
+    return variables
+
+@HARNESS.timed("write")
+def write_starting_layer_notice(results_file, category):
+    with open(results_file, "a") as file:
+        file.write(f"[Starting tests for {category.replace('-', ' ').title()}]\n")
+        file.write("-----------------------------------\n")
+
+@HARNESS.timed("write")
+def write_completion_layer_notice(results_file, category):
+    with open(results_file, "a") as file:
+        file.write("-----------------------------------\n")
+        file.write(f"[Completed tests for {category.replace('-', ' ').title()}]\n\n")
@@ -0,0 +1,160 @@
+import base64
+import json
+import math
+import zlib
+
+import numpy as np
+
+# HDR-style latency histogram: values (ms) are recorded as integer multiples of `resolution` into log-bucketed
+# counts with a fixed relative precision (significant_figures), so memory doesn't grow with the number of samples
+# and percentiles stay within 10^-significant_figures of the real value from `resolution` up to `highest`.
+#
+# Every bucket holds sub_bucket_count linear sub-buckets, and every bucket covers twice the range of the previous one
+# with the same number of sub-buckets. The first bucket is fully linear, as in HdrHistogram.
+#
+# encode() gives a compact text form (zlib + base64 of the non-empty buckets only), small enough to go
+# into a results file line or a store record, and histograms with the same layout merge by adding counts.
+
+class LatencyHistogram:
+    def __init__(self, highest=60000.0, resolution=0.001, significant_figures=3):
+        self.highest = highest
+        self.resolution = resolution
+        self.significant_figures = significant_figures
+
+        self._half_magnitude = max(int(math.ceil(math.log2(2 * 10 ** significant_figures))) - 1, 0)
+        self._half_count = 1 << self._half_magnitude
+        self._mask = 2 * self._half_count - 1
+        self._highest_units = max(int(math.ceil(highest / resolution)), 2 * self._half_count)
+        bucket_count, untrackable = 1, 2 * self._half_count
+        while untrackable <= self._highest_units:
+            untrackable <<= 1
+            bucket_count += 1
+        self.counts = np.zeros((bucket_count + 1) * self._half_count, dtype=np.int64)
+
+        self.total_count = 0
+        self.lost = 0  # Samples recorded as NaN (lost probes, failed requests)
+        self.min = math.inf
+        self.max = -math.inf
+        self._sum = 0.0
+        self._sum_squares = 0.0
+
+    def _indexes(self, units):
+        # bucket = position of the highest bit above the sub-bucket range, sub = the value shifted into that range
+        bucket = np.frexp((units | self._mask).astype(np.float64))[1] - (self._half_magnitude + 1)
+        sub = units >> bucket
+        return ((bucket + 1) << self._half_magnitude) + (sub - self._half_count)
+
+    def _lowest_values(self, indexes):
+        bucket = (indexes >> self._half_magnitude) - 1
+        sub = (indexes & (self._half_count - 1)) + self._half_count
+        first = bucket < 0
+        sub = np.where(first, sub - self._half_count, sub)
+        bucket = np.where(first, 0, bucket)
+        return sub << bucket, bucket
+
+    def record_values(self, values, expected_interval=None):
+        # values: latencies in ms, NaN for lost samples.
+        # expected_interval: ms between samples of a closed-loop measurement. Each value longer than it also records
+        # the samples that would have been taken while waiting (HdrHistogram's coordinated omission correction).
+        # Open-loop measurements (see common.open_loop) are already corrected and must not pass it.
+        values = np.asarray(values, dtype=np.float64).ravel()
+        lost = np.isnan(values)
+        self.lost += int(lost.sum())
+        values = values[~lost]
+        if values.size == 0:
+            return
+        if expected_interval:
+            missing = np.maximum(np.floor(values / expected_interval).astype(np.int64) - 1, 0)
+            if missing.sum():
+                repeated = np.repeat(values, missing)
+                starts = np.repeat(np.cumsum(missing) - missing, missing)
+                steps = np.arange(repeated.size) - starts + 1
+                values = np.concatenate((values, repeated - steps * expected_interval))
+
+        self.total_count += values.size
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self._sum += float(values.sum())
+        self._sum_squares += float(np.dot(values, values))
+        units = np.clip(np.round(values / self.resolution), 0, self._highest_units).astype(np.int64)
+        self.counts += np.bincount(self._indexes(units), minlength=self.counts.size)
+
+    def record(self, value, count=1):
+        self.record_values(np.full(count, value, dtype=np.float64))
+
+    def add(self, other):
+        # Merges another histogram with the same layout into this one
+        if (other.resolution, other.significant_figures, other.counts.size) != \
+                (self.resolution, self.significant_figures, self.counts.size):
+            raise ValueError("Only histograms with the same highest, resolution and significant_figures can be merged")
+        self.counts += other.counts
+        self.total_count += other.total_count
+        self.lost += other.lost
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._sum += other._sum
+        self._sum_squares += other._sum_squares
+        return self
+
+    def mean(self):
+        return self._sum / self.total_count if self.total_count else math.nan
+
+    def stdev(self):
+        # Population standard deviation, ping's mdev
+        if not self.total_count:
+            return math.nan
+        mean = self.mean()
+        return math.sqrt(max(self._sum_squares / self.total_count - mean * mean, 0))
+
+    def percentiles(self, percentiles):
+        # Highest value equivalent to the bucket holding each percentile, clamped to the recorded min/max
+        if not self.total_count:
+            return [math.nan for _ in percentiles]
+        cumulative = np.cumsum(self.counts)
+        targets = np.maximum(np.ceil(np.asarray(percentiles, dtype=np.float64) / 100 * self.total_count), 1)
+        indexes = np.searchsorted(cumulative, targets)
+        lowest, bucket = self._lowest_values(indexes)
+        highest = (lowest + (1 << bucket) - 1) * self.resolution
+        return [float(min(max(value, self.min), self.max)) for value in highest]
+
+    def percentile(self, percentile):
+        return self.percentiles([percentile])[0]
+
+    def buckets(self):
+        # (value in ms at the middle of every non-empty bucket, count), for plotting
+        indexes = np.flatnonzero(self.counts)
+        lowest, bucket = self._lowest_values(indexes)
+        return (lowest + ((1 << bucket) - 1) / 2) * self.resolution, self.counts[indexes]
+
+    def encode(self):
+        header = {
+            "highest": self.highest, "resolution": self.resolution, "significant_figures": self.significant_figures,
+            "total_count": self.total_count, "lost": self.lost, "min": self.min, "max": self.max,
+            "sum": self._sum, "sum_squares": self._sum_squares,
+        }
+        # Non-empty buckets as (index delta, count) columns, which compress far better than the dense counts
+        indexes = np.flatnonzero(self.counts)
+        deltas = np.diff(indexes, prepend=0).astype("<u4")
+        body = json.dumps(header, separators=(",", ":")).encode() + b"\n" + deltas.tobytes() + \
+            self.counts[indexes].astype("<i8").tobytes()
+        return base64.b64encode(zlib.compress(body, 9)).decode("ascii")
+
+    @classmethod
+    def decode(cls, text):
+        header, body = zlib.decompress(base64.b64decode(text)).split(b"\n", 1)
+        header = json.loads(header)
+        histogram = cls(header["highest"], header["resolution"], header["significant_figures"])
+        buckets = len(body) // 12
+        indexes = np.cumsum(np.frombuffer(body[:4 * buckets], dtype="<u4").astype(np.int64))
+        histogram.counts[indexes] = np.frombuffer(body[4 * buckets:], dtype="<i8")
+        histogram.total_count, histogram.lost = header["total_count"], header["lost"]
+        histogram.min, histogram.max = header["min"], header["max"]
+        histogram._sum, histogram._sum_squares = header["sum"], header["sum_squares"]
+        return histogram
+
+def merge_histograms(histograms, **options):
+    # Sum of any number of histograms (repetitions, devices, layers) into a new one
+    merged = LatencyHistogram(**options)
+    for histogram in histograms:
+        merged.add(histogram)
+    return merged
@@ -0,0 +1,193 @@
+import contextlib
+import functools
+import os
+import resource
+import subprocess
+import threading
+import time
+
+from common.kpi import Record, store_records
+
+# Self-instrumentation: how much of a measurement is the harness itself.
+#
+# Work done for a device is timed in phases: spawn (starting ping/iperf3/vmstat), probe (waiting for a measurement),
+# parse (turning output into numbers) and write (results file and store). Each phase adds its wall time and the CPU
+# time of the thread running it to the current scope, usually a (layer, device) set by sweep_devices, so concurrent
+# devices don't mix. Nested phases are timed exclusively: a parse inside a probe counts once, as parse.
+# process_usage() gives the CPU time and RSS of the whole harness process.
+#
+# Hooks cost a couple of clock reads each and nothing at all until HARNESS.start() is called.
+
+PHASES = ("spawn", "probe", "parse", "write")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+class Instrumentation:
+    def __init__(self):
+        self.enabled = False
+        self.started_usage = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._totals = {}  # {(scope, phase): [count, wall_ns, cpu_ns]}
+
+    def start(self):
+        with self._lock:
+            self._totals = {}
+        self.started_usage = process_usage()
+        self.enabled = True
+
+    def current_scope(self):
+        return getattr(self._local, "scope", None)
+
+    @contextlib.contextmanager
+    def scope(self, key):
+        # Phases run by this thread in the block are reported under key
+        previous = self.current_scope()
+        self._local.scope = key
+        try:
+            yield
+        finally:
+            self._local.scope = previous
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        stack = self._local.__dict__.setdefault("stack", [])
+        stack.append([0, 0])  # Wall and CPU time of the phases nested in this one
+        wall_start, cpu_start = time.perf_counter_ns(), time.thread_time_ns()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter_ns() - wall_start, time.thread_time_ns() - cpu_start
+            nested_wall, nested_cpu = stack.pop()
+            if stack:
+                stack[-1][0] += wall
+                stack[-1][1] += cpu
+            with self._lock:
+                totals = self._totals.setdefault((self.current_scope(), name), [0, 0, 0])
+                totals[0] += 1
+                totals[1] += wall - nested_wall
+                totals[2] += cpu - nested_cpu
+
+    def timed(self, name):
+        # Decorator running the whole function as one phase
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.phase(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def take(self, scope):
+        # {phase: {"count", "wall_ms", "cpu_ms"}} of a scope, which starts again from zero
+        with self._lock:
+            keys = [key for key in self._totals if key[0] == scope]
+            totals = {key[1]: self._totals.pop(key) for key in keys}
+        return {name: {"count": count, "wall_ms": wall / 1e6, "cpu_ms": cpu / 1e6}
+                for name, (count, wall, cpu) in sorted(totals.items(), key=lambda item: phase_order(item[0]))}
+
+HARNESS = Instrumentation()
+
+def phase_order(name):
+    return PHASES.index(name) if name in PHASES else len(PHASES)
+
+def run_command(cmd, timeout=None, check=False, merge_stderr=False):
+    # subprocess.run() timed as spawn (until the program is running) then probe (until it exits).
+    # Returns a CompletedProcess with text output
+    with HARNESS.phase("spawn"):
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT if merge_stderr else subprocess.PIPE,
+                                   universal_newlines=True)
+    with process, HARNESS.phase("probe"):
+        try:
+            stdout, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            raise
+    if check and process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, cmd, stdout, stderr)
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+def process_usage():
+    # CPU time of the harness process (all its threads) and of its finished children (ping, iperf3, stress workers...),
+    # in seconds, and its current and peak RSS in MB
+    own, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    try:
+        with open("/proc/self/statm") as file:
+            rss_mb = int(file.read().split()[1]) * PAGE_SIZE / (1024 * 1024)
+    except OSError:
+        rss_mb = own.ru_maxrss / 1024
+    return {
+        "time": time.monotonic(),
+        "cpu_user_s": own.ru_utime,
+        "cpu_system_s": own.ru_stime,
+        "children_cpu_s": children.ru_utime + children.ru_stime,
+        "rss_mb": rss_mb,
+        "peak_rss_mb": max(own.ru_maxrss / 1024, rss_mb),  # KB on Linux, updated lazily
+    }
+
+def usage_since(started):
+    # Harness process usage since `started` (a process_usage()), CPU as a share of one core over the elapsed time
+    now = process_usage()
+    elapsed = now["time"] - started["time"]
+    cpu = (now["cpu_user_s"] - started["cpu_user_s"]) + (now["cpu_system_s"] - started["cpu_system_s"])
+    return {
+        "elapsed_s": elapsed,
+        "cpu_s": cpu,
+        "cpu_percent": cpu / elapsed * 100 if elapsed > 0 else 0.0,
+        "children_cpu_s": now["children_cpu_s"] - started["children_cpu_s"],
+        "rss_mb": now["rss_mb"],
+        "peak_rss_mb": now["peak_rss_mb"],
+    }
+
+def format_phases(phases):
+    parts = [f"{name} {totals['wall_ms']:.1f} ms ({totals['count']}x, CPU {totals['cpu_ms']:.1f} ms)"
+             for name, totals in phases.items()]
+    return ", ".join(parts) or "nothing recorded"
+
+def format_usage(usage):
+    return (f"CPU {usage['cpu_s']:.2f} s ({usage['cpu_percent']:.1f}% of a core over {usage['elapsed_s']:.1f} s), "
+            f"children CPU {usage['children_cpu_s']:.2f} s, RSS {usage['rss_mb']:.1f} MB (peak {usage['peak_rss_mb']:.1f} MB)")
+
+def write_overhead_to_file(results_file, phases):
+    with open(results_file, "a") as file:
+        file.write(f"Harness Overhead: {format_phases(phases)}\n")
+
+def write_usage_to_file(results_file, usage):
+    with open(results_file, "a") as file:
+        file.write(f"Harness Process: {format_usage(usage)}\n")
+
+def overhead_records(phases, **fields):
+    # One "harness_overhead" record per device/KPI: the wall time of every phase as samples, in PHASES order
+    # (phase_names), with their counts and CPU times
+    flat = {}
+    for name, totals in phases.items():
+        flat[f"{name}_count"] = totals["count"]
+        flat[f"{name}_cpu_ms"] = totals["cpu_ms"]
+    return [Record("harness_overhead", [totals["wall_ms"] for totals in phases.values()], "ms",
+                   dict(phase_names=list(phases), **flat, **fields))]
+
+def usage_records(usage):
+    return [Record("harness_process", [usage["cpu_s"]], "s", dict(usage))]
+
+def report_overhead(scope, device, results_file=None, store=None, run_id=None, **fields):
+    # Writes the phases of a scope (a device, or a device and KPI) next to its results. Called outside the scope,
+    # so these writes aren't counted in the next report
+    phases = HARNESS.take(scope)
+    if store is not None:
+        store_records(store, run_id, device, overhead_records(phases, **fields))
+    if results_file:
+        write_overhead_to_file(results_file, phases)
+    return phases
+
+def report_usage(device, results_file=None, store=None, run_id=None):
+    # Harness process usage since HARNESS.start(), at the end of a run
+    usage = usage_since(HARNESS.started_usage)
+    if store is not None:
+        store_records(store, run_id, device, usage_records(usage))
+    if results_file:
+        write_usage_to_file(results_file, usage)
+    print(f"Harness Process: {format_usage(usage)}")
+    return usage
@@ -0,0 +1,49 @@
+import importlib
+from collections import namedtuple
+
+# KPI plugins for the benchmark runner (scripts/benchmark.py).
+#
+# A plugin reads its options from its own section of the runner config (the same keys as the [general] section of
+# the KPI's config.cfg) and measures one device at a time, returning the records to store. The KPI scripts keep
+# working on their own; the plugin classes live next to them and reuse their functions.
+
+Device = namedtuple("Device", ["layer", "name", "ip"])
+# samples go to the store's sample file, fields to the record's index line
+Record = namedtuple("Record", ["kpi", "samples", "unit", "fields"])
+
+# name: (module, class). Modules are imported only when their KPI is selected,
+# so the dependencies of the other KPIs don't need to be installed
+PLUGINS = {
+    "latency": ("network_latency.network_latency", "LatencyKpi"),
+    "availability": ("service_availability.service_availability", "AvailabilityKpi"),
+    "throughput": ("network_throughput.network_throughput", "ThroughputKpi"),
+}
+
+class Kpi:
+    name = None
+    # Exclusive KPIs (e.g. throughput, saturating the link) never run at the same time as any other measurement
+    exclusive = False
+
+    def __init__(self, options):
+        self.options = options
+
+    @classmethod
+    def read_options(cls, section):
+        return {}
+
+    def measure(self, device):
+        raise NotImplementedError
+
+def register_kpi(name, module, class_name):
+    PLUGINS[name] = (module, class_name)
+
+def load_kpi(name):
+    if name not in PLUGINS:
+        raise ValueError(f"Unknown KPI '{name}'. Available: {', '.join(PLUGINS)}")
+    module, class_name = PLUGINS[name]
+    return getattr(importlib.import_module(module), class_name)
+
+def store_records(store, run_id, device, records, **fields):
+    for record in records:
+        store.append(run_id, device.layer, device.name, record.kpi, record.samples, record.unit, device_ip=device.ip,
+                     **record.fields, **fields)
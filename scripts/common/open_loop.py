@@ -0,0 +1,91 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from common.histogram import LatencyHistogram
+
+# Open-loop load generator: operations are issued at a target rate on a fixed monotonic schedule, whether or not
+# the previous ones have finished. Waiting for each operation before issuing the next (closed loop) silently skips
+# the samples that should have been taken during a slowdown, hiding the tail latency (coordinated omission).
+#
+# The intended start, actual start and end of every operation are kept in preallocated arrays. The corrected latency
+# runs from the intended start, so time spent behind a slow operation is counted instead of hidden.
+
+class OpenLoopScheduler:
+    def __init__(self, rate, count, workers=1):
+        self.rate = rate
+        self.count = count
+        # workers = 1 runs the operations inline: a slow one delays the next ones, which then start late (and count it).
+        # More workers keep up to that many operations in flight
+        self.workers = max(1, workers)
+        self.intended_ns = np.zeros(count, dtype=np.int64)
+        self.started_ns = np.zeros(count, dtype=np.int64)
+        self.finished_ns = np.zeros(count, dtype=np.int64)
+        self.ok = np.zeros(count, dtype=bool)
+        self.issued = 0
+        self.elapsed = 0.0
+
+    def run(self, operation, stop_event=None):
+        # operation(seq) returns a result or raises on failure.
+        # Returns the results in seq order (None for failed operations), stopping early when stop_event is set
+        results = [None] * self.count
+        lock = threading.Lock()
+
+        def call(seq):
+            self.started_ns[seq] = time.monotonic_ns()
+            try:
+                result = operation(seq)
+                ok = True
+            except Exception:
+                result, ok = None, False
+            finished = time.monotonic_ns()
+            with lock:
+                results[seq] = result
+                self.ok[seq] = ok
+                self.finished_ns[seq] = finished
+
+        period_ns = 1e9 / self.rate
+        start = time.monotonic_ns()
+        executor = ThreadPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+        try:
+            for seq in range(self.count):
+                if stop_event is not None and stop_event.is_set():
+                    break
+                intended = start + int(seq * period_ns)
+                self.intended_ns[seq] = intended
+                delay = (intended - time.monotonic_ns()) / 1e9
+                if delay > 0:
+                    if stop_event is not None:
+                        stop_event.wait(delay)
+                    else:
+                        time.sleep(delay)
+                self.issued = seq + 1
+                if executor is not None:
+                    executor.submit(call, seq)
+                else:
+                    call(seq)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+        self.elapsed = (time.monotonic_ns() - start) / 1e9
+        return results[:self.issued]
+
+    def latencies_ms(self, corrected=True, seqs=None):
+        # corrected: from the intended start. Otherwise from the actual start (service time only).
+        # Failed operations are NaN. seqs selects a subset (e.g. one operation class)
+        seqs = np.arange(self.issued) if seqs is None else np.asarray(seqs)
+        begin = self.intended_ns if corrected else self.started_ns
+        latencies = (self.finished_ns[seqs] - begin[seqs]) / 1e6
+        latencies[~self.ok[seqs]] = np.nan
+        return latencies
+
+    def lag_ms(self):
+        # How late every operation started compared to its schedule
+        return (self.started_ns[:self.issued] - self.intended_ns[:self.issued]) / 1e6
+
+    def histogram(self, corrected=True, seqs=None, **options):
+        histogram = LatencyHistogram(**options)
+        histogram.record_values(self.latencies_ms(corrected, seqs))
+        return histogram
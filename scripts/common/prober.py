@@ -0,0 +1,282 @@
+import argparse
+import math
+import os
+import re
+import socket
+import socketserver
+import struct
+import threading
+import time
+from collections import namedtuple
+
+from common.instrumentation import HARNESS, run_command
+from common.open_loop import OpenLoopScheduler
+
+# One echo request/reply. rtt_ns is None when the probe was lost.
+# intended_ns is when the probe was scheduled to be sent, sent_ns when it actually was
+ProbeSample = namedtuple("ProbeSample", ["seq", "sent_ns", "rtt_ns", "ok", "intended_ns"], defaults=(None,))
+
+ICMP_ECHO_REQUEST = {socket.AF_INET: 8, socket.AF_INET6: 128}
+ICMP_ECHO_REPLY = {socket.AF_INET: 0, socket.AF_INET6: 129}
+PAYLOAD_SIZE = 56  # Same payload size as the ping binary
+
+def resolve(device_ip, port=0, socktype=socket.SOCK_DGRAM):
+    family, _, _, _, address = socket.getaddrinfo(device_ip, port, type=socktype)[0]
+    return family, address
+
+def icmp_checksum(data):
+    if len(data) % 2:
+        data += b"\0"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+def build_payload(seq):
+    # Sequence number followed by padding, so replies can be matched without parsing any text
+    return struct.pack("!HQ", seq & 0xffff, time.monotonic_ns()).ljust(PAYLOAD_SIZE, b"\0")
+
+class IcmpBackend:
+    # Unprivileged ICMP datagram socket (net.ipv4.ping_group_range must include the user's group)
+    name = "icmp"
+
+    def __init__(self, device_ip, port=None, timeout=1.0):
+        self.family, self.address = resolve(device_ip)
+        protocol = socket.IPPROTO_ICMP if self.family == socket.AF_INET else socket.IPPROTO_ICMPV6
+        self.sock = socket.socket(self.family, socket.SOCK_DGRAM, protocol)
+        self.sock.settimeout(timeout)
+        self.timeout = timeout
+
+    def probe(self, seq):
+        header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST[self.family], 0, 0, 0, seq & 0xffff)
+        payload = build_payload(seq)
+        checksum = icmp_checksum(header + payload)
+        packet = struct.pack("!BBHHH", ICMP_ECHO_REQUEST[self.family], 0, checksum, 0, seq & 0xffff) + payload
+
+        sent_ns = time.monotonic_ns()
+        self.sock.sendto(packet, self.address)
+        deadline = sent_ns + int(self.timeout * 1e9)
+        while True:
+            remaining = (deadline - time.monotonic_ns()) / 1e9
+            if remaining <= 0:
+                return ProbeSample(seq, sent_ns, None, False)
+            self.sock.settimeout(remaining)
+            try:
+                reply = self.sock.recv(1024)
+            except socket.timeout:
+                return ProbeSample(seq, sent_ns, None, False)
+            received_ns = time.monotonic_ns()
+            # Ping sockets deliver the ICMP message without the IP header
+            reply_type, _, _, _, reply_seq = struct.unpack("!BBHHH", reply[:8])
+            if reply_type == ICMP_ECHO_REPLY[self.family] and reply_seq == seq & 0xffff:
+                return ProbeSample(seq, sent_ns, received_ns - sent_ns, True)
+
+    def close(self):
+        self.sock.close()
+
+class UdpEchoBackend:
+    # RFC 862 echo over UDP, works against any echo service (see start_echo_server)
+    name = "udp"
+
+    def __init__(self, device_ip, port=7, timeout=1.0):
+        self.family, self.address = resolve(device_ip, port)
+        self.sock = socket.socket(self.family, socket.SOCK_DGRAM)
+        self.sock.connect(self.address)
+        self.timeout = timeout
+
+    def probe(self, seq):
+        payload = build_payload(seq)
+        sent_ns = time.monotonic_ns()
+        self.sock.send(payload)
+        deadline = sent_ns + int(self.timeout * 1e9)
+        while True:
+            remaining = (deadline - time.monotonic_ns()) / 1e9
+            if remaining <= 0:
+                return ProbeSample(seq, sent_ns, None, False)
+            self.sock.settimeout(remaining)
+            try:
+                reply = self.sock.recv(PAYLOAD_SIZE)
+            except (socket.timeout, ConnectionRefusedError):
+                return ProbeSample(seq, sent_ns, None, False)
+            received_ns = time.monotonic_ns()
+            if reply[:2] == payload[:2]:
+                return ProbeSample(seq, sent_ns, received_ns - sent_ns, True)
+
+    def close(self):
+        self.sock.close()
+
+class TcpEchoBackend:
+    # RFC 862 echo over a single persistent TCP connection
+    name = "tcp"
+
+    def __init__(self, device_ip, port=7, timeout=1.0):
+        self.family, self.address = resolve(device_ip, port, socket.SOCK_STREAM)
+        self.timeout = timeout
+        self.sock = None
+
+    def connect(self):
+        self.sock = socket.create_connection(self.address[:2], timeout=self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def probe(self, seq):
+        payload = build_payload(seq)
+        sent_ns = time.monotonic_ns()
+        try:
+            if self.sock is None:
+                self.connect()
+                sent_ns = time.monotonic_ns()
+            self.sock.sendall(payload)
+            reply = b""
+            while len(reply) < len(payload):
+                chunk = self.sock.recv(len(payload) - len(reply))
+                if not chunk:
+                    raise ConnectionResetError("Echo server closed the connection")
+                reply += chunk
+        except OSError:
+            # Reconnect on the next probe
+            self.close()
+            return ProbeSample(seq, sent_ns, None, False)
+        return ProbeSample(seq, sent_ns, time.monotonic_ns() - sent_ns, True)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+class SystemPingBackend:
+    # One ping binary run per probe, for probing one request at a time (e.g. the availability monitor) without
+    # socket permissions. Every probe pays for a process start, so it's the least accurate backend
+    name = "system"
+
+    def __init__(self, device_ip, port=None, timeout=1.0):
+        self.device_ip = device_ip
+        self.timeout = timeout
+
+    def probe(self, seq):
+        sent_ns = time.monotonic_ns()
+        cmd = ["ping", "-c", "1", "-W", str(max(1, math.ceil(self.timeout))), self.device_ip]
+        output = run_command(cmd, merge_stderr=True).stdout
+        return parse_ping_output(output, 1, sent_ns)[0]._replace(seq=seq, intended_ns=None)
+
+    def close(self):
+        pass
+
+BACKENDS = {
+    "icmp": IcmpBackend,
+    "udp": UdpEchoBackend,
+    "tcp": TcpEchoBackend,
+    "system": SystemPingBackend,
+}
+
+def open_backend(name, device_ip, port=7, timeout=1.0):
+    # "auto" uses ICMP when the kernel allows unprivileged ping sockets and falls back to UDP echo otherwise
+    if name == "auto":
+        try:
+            return IcmpBackend(device_ip, timeout=timeout)
+        except PermissionError:
+            return UdpEchoBackend(device_ip, port, timeout)
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown prober backend '{name}'. Available: auto, {', '.join(BACKENDS)}")
+    return BACKENDS[name](device_ip, port, timeout)
+
+def probe_device(device_ip, count, interval=1.0, backend="auto", port=7, timeout=1.0):
+    # Sends `count` probes spaced `interval` seconds apart on an open-loop schedule (see common.open_loop):
+    # a probe waiting for its reply delays the next ones, but they keep their scheduled send times
+    prober = open_backend(backend, device_ip, port, timeout)
+    scheduler = OpenLoopScheduler(1 / interval, count)
+
+    def probe(seq):
+        with HARNESS.phase("probe"):
+            return prober.probe(seq)
+
+    try:
+        results = scheduler.run(probe)
+    finally:
+        prober.close()
+    samples = []
+    for seq, sample in enumerate(results):
+        if sample is None:
+            # The probe raised (e.g. network unreachable): counted as lost
+            sample = ProbeSample(seq, int(scheduler.started_ns[seq]), None, False)
+        samples.append(sample._replace(intended_ns=int(scheduler.intended_ns[seq])))
+    return samples
+
+@HARNESS.timed("parse")
+def parse_ping_output(output, count, start_ns, interval=1.0):
+    # One ProbeSample per echo request of a "ping -c count" run started at start_ns. The ping binary prints only the
+    # replies, so requests without a "bytes from ... icmp_seq=N ... time=X ms" line were lost
+    rtts = {}
+    for seq, rtt in re.findall(r"bytes from .*?icmp_seq=(\d+).*?time=([\d.]+) ms", output):
+        rtts.setdefault(int(seq) - 1, float(rtt))
+    samples = []
+    for seq in range(count):
+        sent_ns = start_ns + int(seq * interval * 1e9)
+        rtt = rtts.get(seq)
+        samples.append(ProbeSample(seq, sent_ns, None if rtt is None else int(rtt * 1e6), rtt is not None, sent_ns))
+    return samples
+
+def run_ping(device_ip, count, interval=1.0):
+    # Returns the ping binary's output and when it started
+    start_ns = time.monotonic_ns()
+    cmd = ["ping", "-c", str(count), device_ip]
+    if interval != 1.0:
+        cmd[1:1] = ["-i", str(interval)]
+    return run_command(cmd, merge_stderr=True).stdout, start_ns
+
+def collect_probes(device_ip, count, interval=1.0, backend="system", port=7, timeout=1.0):
+    # `count` probes with any prober, "system" included, as ProbeSamples
+    if backend == "system":
+        output, start_ns = run_ping(device_ip, count, interval)
+        return parse_ping_output(output, count, start_ns, interval)
+    return probe_device(device_ip, count, interval, backend, port, timeout)
+
+def rtts_ms(samples, corrected=False):
+    # corrected: add the time each probe was sent late, i.e. measure from its scheduled send time
+    return [(sample.rtt_ns + (sample.sent_ns - sample.intended_ns if corrected and sample.intended_ns else 0)) / 1e6
+            for sample in samples if sample.ok]
+
+class UdpEchoHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        data, sock = self.request
+        sock.sendto(data, self.client_address)
+
+class TcpEchoHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        while True:
+            data = self.request.recv(4096)
+            if not data:
+                break
+            self.request.sendall(data)
+
+class ThreadingUDPServer(socketserver.ThreadingMixIn, socketserver.UDPServer):
+    daemon_threads = True
+
+class ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def start_echo_server(host="127.0.0.1", port=0, protocol="udp"):
+    # Local echo stand-in for the UDP/TCP backends. Call server.shutdown() to stop it
+    if protocol == "udp":
+        server = ThreadingUDPServer((host, port), UdpEchoHandler)
+    else:
+        server = ThreadingTCPServer((host, port), TcpEchoHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    # Run an echo service on a target device: python -m common.prober --protocol udp --port 7
+    parser = argparse.ArgumentParser(description="Echo service for the UDP/TCP latency probers")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=7)
+    parser.add_argument("--protocol", choices=["udp", "tcp"], default="udp")
+    args = parser.parse_args()
+
+    server = start_echo_server(args.host, args.port, args.protocol)
+    print(f"{args.protocol.upper()} echo server listening on {args.host}:{server.server_address[1]} (pid {os.getpid()})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
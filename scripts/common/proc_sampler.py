@@ -0,0 +1,177 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+# Low-overhead CPU/RAM sampler reading /proc directly.
+# The /proc files are opened once and re-read with pread() on every sample,
+# and the samples go into arrays preallocated for the whole run.
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+PRESSURE_RESOURCES = ("cpu", "memory", "io")
+READ_SIZE = 65536  # /proc/stat carries a long interrupt line on big machines
+
+class ProcSampler:
+    def __init__(self, interval, duration, pids=(), proc_dir="/proc"):
+        self.interval = interval
+        self.capacity = int(duration / interval) + 1
+        self.num_samples = 0
+        # pids: {label: pid}, or a list of pids labelled by their own number
+        self.pids = dict(pids) if isinstance(pids, dict) else {str(pid): pid for pid in pids}
+
+        self._stat_fd = os.open(os.path.join(proc_dir, "stat"), os.O_RDONLY)
+        self._meminfo_fd = os.open(os.path.join(proc_dir, "meminfo"), os.O_RDONLY)
+        # Pressure stall information needs Linux 4.20+ with PSI enabled
+        self._pressure_fds = {}
+        for resource in PRESSURE_RESOURCES:
+            try:
+                self._pressure_fds[resource] = os.open(os.path.join(proc_dir, "pressure", resource), os.O_RDONLY)
+            except OSError:
+                pass
+        self._pid_fds = {label: os.open(os.path.join(proc_dir, str(pid), "stat"), os.O_RDONLY) for label, pid in self.pids.items()}
+
+        columns = ["timestamp", "cpu_us", "cpu_sy", "cpu_id", "cpu_wa", "cpu_st", "run_queue",
+                   "ram_used_mb", "ram_available_mb", "ram_usage"]
+        columns += [f"psi_{resource}" for resource in self._pressure_fds]
+        for label in self.pids:
+            columns += [f"proc_{label}_cpu", f"proc_{label}_rss_mb"]
+        self._series = {column: np.zeros(self.capacity) for column in columns}
+
+        self._previous = None
+
+    def _read(self, fd):
+        return os.pread(fd, READ_SIZE, 0)
+
+    def _cpu_times(self, stat):
+        # First line: cpu user nice system idle iowait irq softirq steal ...
+        line = stat.split(b"\n", 1)[0]
+        values = [int(value) for value in line.split()[1:9]]
+        user, nice, system, idle, iowait, irq, softirq, steal = values + [0] * (8 - len(values))
+        # Grouped as vmstat reports them
+        return np.array([user + nice, system + irq + softirq, idle, iowait, steal], dtype=np.float64)
+
+    def _run_queue(self, stat):
+        # "procs_running N": runnable tasks, the r column of vmstat
+        position = stat.find(b"procs_running ")
+        if position < 0:
+            return np.nan
+        return int(stat[position + len(b"procs_running "):].split(b"\n", 1)[0])
+
+    def _memory_kb(self):
+        memory = {}
+        for line in self._read(self._meminfo_fd).split(b"\n"):
+            if line.startswith((b"MemTotal:", b"MemAvailable:")):
+                key, value = line.split()[:2]
+                memory[key] = int(value)
+                if len(memory) == 2:
+                    break
+        return memory.get(b"MemTotal:", 0), memory.get(b"MemAvailable:", 0)
+
+    def _pressure_totals(self):
+        # "some avg10=0.00 avg60=0.00 avg300=0.00 total=<microseconds stalled>"
+        totals = {}
+        for resource, fd in self._pressure_fds.items():
+            some = self._read(fd).split(b"\n", 1)[0]
+            totals[resource] = int(some.rsplit(b"total=", 1)[1])
+        return totals
+
+    def _pid_times(self):
+        times = {}
+        for label, fd in self._pid_fds.items():
+            try:
+                # Fields after the command name, which may contain spaces: utime is 14, stime 15 and rss 24
+                fields = self._read(fd).rsplit(b")", 1)[1].split()
+            except OSError:
+                times[label] = (np.nan, np.nan)
+                continue
+            times[label] = (int(fields[11]) + int(fields[12]), int(fields[21]))
+        return times
+
+    def sample(self):
+        now = time.monotonic()
+        stat = self._read(self._stat_fd)
+        cpu = self._cpu_times(stat)
+        run_queue = self._run_queue(stat)
+        pressure = self._pressure_totals()
+        pid_times = self._pid_times()
+        total_kb, available_kb = self._memory_kb()
+
+        previous, self._previous = self._previous, (now, cpu, pressure, pid_times)
+        if previous is None:
+            return False  # The first read only sets the baseline for the deltas
+        if self.num_samples >= self.capacity:
+            return False
+
+        elapsed = now - previous[0]
+        cpu_delta = cpu - previous[1]
+        cpu_percent = cpu_delta / max(cpu_delta.sum(), 1) * 100
+
+        index = self.num_samples
+        series = self._series
+        series["timestamp"][index] = now
+        series["cpu_us"][index], series["cpu_sy"][index], series["cpu_id"][index], \
+            series["cpu_wa"][index], series["cpu_st"][index] = cpu_percent
+        series["run_queue"][index] = run_queue
+        series["ram_used_mb"][index] = (total_kb - available_kb) / 1024
+        series["ram_available_mb"][index] = available_kb / 1024
+        series["ram_usage"][index] = (total_kb - available_kb) / total_kb * 100 if total_kb else np.nan
+        for resource, total in pressure.items():
+            series[f"psi_{resource}"][index] = (total - previous[2][resource]) / (elapsed * 1e6) * 100
+        for label, (ticks, rss_pages) in pid_times.items():
+            series[f"proc_{label}_cpu"][index] = (ticks - previous[3][label][0]) / CLOCK_TICKS / elapsed * 100
+            series[f"proc_{label}_rss_mb"][index] = rss_pages * PAGE_SIZE / (1024 * 1024)
+        self.num_samples += 1
+        return True
+
+    def run(self, stop_event=None, on_sample=None):
+        # Samples on a fixed monotonic schedule until the arrays are full or stop_event is set.
+        # on_sample(index) is called after every new sample, e.g. to stream it (see row())
+        start = time.monotonic()
+        tick = 0
+        self.sample()
+        while self.num_samples < self.capacity and not (stop_event and stop_event.is_set()):
+            tick += 1
+            delay = start + tick * self.interval - time.monotonic()
+            if delay > 0:
+                if stop_event:
+                    stop_event.wait(delay)
+                else:
+                    time.sleep(delay)
+            if self.sample() and on_sample is not None:
+                on_sample(self.num_samples - 1)
+
+    def start(self):
+        # Samples from a background thread until stop() is called
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self.run, args=(self._stop_event,), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+
+    def row(self, index):
+        return {column: float(values[index]) for column, values in self._series.items()}
+
+    def series(self):
+        return {column: values[:self.num_samples] for column, values in self._series.items()}
+
+    def summary(self):
+        # Same keys as process_metrics() in resource_utilization.py, averaged over the whole time series
+        series = self.series()
+        if self.num_samples == 0:
+            return {'avg_us': 0, 'avg_sy': 0, 'avg_id': 0, 'ram_usage_percent': 0, 'avg_used_ram_gb': 0}
+        return {
+            'avg_us': float(series["cpu_us"].mean()),
+            'avg_sy': float(series["cpu_sy"].mean()),
+            'avg_id': float(series["cpu_id"].mean()),
+            'ram_usage_percent': float(series["ram_usage"].mean()),
+            'avg_used_ram_gb': float(series["ram_used_mb"].mean() / 1024)
+        }
+
+    def close(self):
+        for fd in [self._stat_fd, self._meminfo_fd, *self._pressure_fds.values(), *self._pid_fds.values()]:
+            os.close(fd)
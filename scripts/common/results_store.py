@@ -0,0 +1,123 @@
+import contextlib
+import datetime
+import fcntl
+import json
+import os
+import threading
+
+import numpy as np
+
+from common.instrumentation import HARNESS
+
+# Append-only results store shared by every KPI script.
+#
+# <store_dir>/samples.f64  raw little-endian float64 sample arrays, one after another
+# <store_dir>/index.jsonl  one typed record per line, pointing at its slice of samples.f64
+#
+# Figures and reports look records up by run/device/KPI through the index and only read the
+# slices they need (memory-mapped), instead of re-parsing the whole text results file.
+#
+# Several processes append to the same store (every KPI script, the availability monitor...). An append holds an
+# exclusive flock on <store_dir>/.lock from the end-of-file offset to the index line, readers a shared one.
+
+SAMPLES_FILE = "samples.f64"
+INDEX_FILE = "index.jsonl"
+LOCK_FILE = ".lock"
+SAMPLE_DTYPE = np.dtype("<f8")
+
+def new_run_id(script_name):
+    script = os.path.splitext(os.path.basename(script_name))[0]
+    return f"{script}-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+
+class ResultsStore:
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.samples_path = os.path.join(store_dir, SAMPLES_FILE)
+        self.index_path = os.path.join(store_dir, INDEX_FILE)
+        self.lock_path = os.path.join(store_dir, LOCK_FILE)
+        self._lock = threading.Lock()
+        self._records = []
+        self._by_key = {}
+        self._index_offset = 0
+        os.makedirs(store_dir, exist_ok=True)
+
+    def append(self, run_id, layer, device, kpi, samples=(), unit="", **fields):
+        samples = np.ascontiguousarray(samples, dtype=SAMPLE_DTYPE).ravel()
+        with HARNESS.phase("write"), self._lock, self._file_lock(fcntl.LOCK_EX):
+            with open(self.samples_path, "ab") as file:
+                offset = file.tell() // SAMPLE_DTYPE.itemsize
+                file.write(samples.tobytes())
+            record = {
+                "run_id": run_id,
+                "timestamp": datetime.datetime.now().timestamp(),
+                "layer": layer,
+                "device": device,
+                "kpi": kpi,
+                "unit": unit,
+                "offset": offset,
+                "count": int(samples.size),
+                "fields": fields,
+            }
+            # The index line is written last, so a record never points at samples that are not on disk
+            with open(self.index_path, "a") as file:
+                file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        return record
+
+    @contextlib.contextmanager
+    def _file_lock(self, operation):
+        # Between processes, self._lock being for the threads of this one
+        with open(self.lock_path, "a") as file:
+            fcntl.flock(file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    def refresh(self):
+        # Reads only the index lines appended since the last call
+        if not os.path.exists(self.index_path):
+            return
+        with self._lock, self._file_lock(fcntl.LOCK_SH), open(self.index_path, "rb") as file:
+            file.seek(self._index_offset)
+            for line in file:
+                if not line.endswith(b"\n"):
+                    break  # Partially written line, picked up on the next refresh
+                self._index_offset += len(line)
+                record = json.loads(line)
+                self._records.append(record)
+                key = (record["run_id"], record["device"], record["kpi"])
+                self._by_key.setdefault(key, []).append(record)
+
+    def records(self, run_id=None, device=None, kpi=None, layer=None):
+        self.refresh()
+        if run_id is not None and device is not None and kpi is not None:
+            candidates = self._by_key.get((run_id, device, kpi), [])
+        else:
+            candidates = self._records
+        return [record for record in candidates
+                if (run_id is None or record["run_id"] == run_id)
+                and (device is None or record["device"] == device)
+                and (kpi is None or record["kpi"] == kpi)
+                and (layer is None or record["layer"] == layer)]
+
+    def runs(self, kpi=None):
+        # Run ids in the order they were first written
+        return list(dict.fromkeys(record["run_id"] for record in self.records(kpi=kpi)))
+
+    def latest_run(self, kpi=None):
+        runs = self.runs(kpi)
+        return runs[-1] if runs else None
+
+    def load(self, record):
+        if record["count"] == 0:
+            return np.empty(0, dtype=SAMPLE_DTYPE)
+        samples = np.memmap(self.samples_path, dtype=SAMPLE_DTYPE, mode="r",
+                            offset=record["offset"] * SAMPLE_DTYPE.itemsize, shape=(record["count"],))
+        return np.array(samples)
+
+    def load_samples(self, run_id=None, device=None, kpi=None, layer=None):
+        # Concatenated samples of every matching record
+        matches = self.records(run_id, device, kpi, layer)
+        if not matches:
+            return np.empty(0, dtype=SAMPLE_DTYPE)
+        return np.concatenate([self.load(record) for record in matches])
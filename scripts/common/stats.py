@@ -0,0 +1,210 @@
+import math
+
+import numpy as np
+
+# Batched statistics for latency/throughput samples, and the tests comparing two runs (see regression.py).
+# Lost samples are passed as NaN, so loss can be computed from the same array as the RTTs.
+
+PERCENTILES = (50, 90, 99, 99.9)
+BOOTSTRAP_RESAMPLES = 1000
+MAX_BOOTSTRAP_SIZE = 100_000  # Larger groups are bootstrapped on a random subsample (see bootstrap_mean_ci)
+MAX_MEDIAN_BOOTSTRAP_SIZE = 10_000  # Medians cost more to resample than means
+BOOTSTRAP_CHUNK_ELEMENTS = 1 << 22  # Bounds the memory of a batch of resamples to ~32 MB
+
+def percentile_key(percentile):
+    return f"p{percentile:g}".replace(".", "_")
+
+def summarize_groups(groups, percentiles=PERCENTILES, expected=None, confidence=0.95,
+                     resamples=BOOTSTRAP_RESAMPLES, seed=None):
+    # groups: {name: samples}. All groups are summarized in one vectorized pass over the concatenated samples.
+    # expected: {name: number of samples sent} when lost samples were dropped instead of passed as NaN
+    names = list(groups)
+    arrays = [np.asarray(groups[name], dtype=np.float64).ravel() for name in names]
+    num_groups = len(names)
+    if num_groups == 0:
+        return {}
+
+    values = np.concatenate(arrays)
+    ids = np.repeat(np.arange(num_groups), [array.size for array in arrays])
+    sent = np.array([array.size for array in arrays], dtype=np.float64)
+    if expected is not None:
+        sent = np.maximum(sent, [expected.get(name, 0) for name in names])
+
+    received = ~np.isnan(values)
+    values, ids = values[received], ids[received]
+    counts = np.bincount(ids, minlength=num_groups)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sums = np.bincount(ids, weights=values, minlength=num_groups)
+        squares = np.bincount(ids, weights=values * values, minlength=num_groups)
+        means = sums / counts
+        # Same definition as ping's mdev
+        mdevs = np.sqrt(np.maximum(squares / counts - means * means, 0))
+        loss = np.where(sent > 0, 1 - counts / sent, np.nan)
+
+        # Sorting once by (group, value) gives every group's order statistics
+        sorted_values = values[np.lexsort((values, ids))]
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        last = np.maximum(counts - 1, 0)
+        has_samples = counts > 0
+        safe_index = lambda index: np.where(has_samples, index, 0)
+        minimums = np.where(has_samples, sorted_values[safe_index(starts)] if values.size else np.nan, np.nan)
+        maximums = np.where(has_samples, sorted_values[safe_index(starts + last)] if values.size else np.nan, np.nan)
+
+        # Linear interpolation between the closest ranks, as numpy.percentile does
+        quantiles = {}
+        for percentile in percentiles:
+            position = last * (percentile / 100)
+            lower = np.floor(position).astype(np.int64)
+            upper = np.ceil(position).astype(np.int64)
+            if values.size:
+                low_values = sorted_values[safe_index(starts + lower)]
+                high_values = sorted_values[safe_index(starts + upper)]
+                interpolated = low_values + (high_values - low_values) * (position - lower)
+            else:
+                interpolated = np.full(num_groups, np.nan)
+            quantiles[percentile] = np.where(has_samples, interpolated, np.nan)
+
+        jitters = rfc3550_jitter(values, ids, num_groups)
+
+    summaries = {}
+    rng = np.random.default_rng(seed)
+    for index, name in enumerate(names):
+        summary = {
+            "count": int(counts[index]),
+            "sent": int(sent[index]),
+            "loss": float(loss[index]),
+            "mean": float(means[index]),
+            "min": float(minimums[index]),
+            "max": float(maximums[index]),
+            "mdev": float(mdevs[index]),
+            "jitter": float(jitters[index]),
+        }
+        for percentile in percentiles:
+            summary[percentile_key(percentile)] = float(quantiles[percentile][index])
+        group_values = sorted_values[starts[index]:starts[index] + counts[index]]
+        summary["mean_ci"] = bootstrap_mean_ci(group_values, confidence, resamples, rng)
+        summaries[name] = summary
+    return summaries
+
+def summarize(samples, expected=None, **kwargs):
+    expected = None if expected is None else {"samples": expected}
+    return summarize_groups({"samples": samples}, expected=expected, **kwargs)["samples"]
+
+def rfc3550_jitter(values, ids, num_groups):
+    # RFC 3550 interarrival jitter J += (|D| - J) / 16 over consecutive samples of each group.
+    # Unrolled, the final J is a weighted sum of |D| with weights (1/16) * (15/16)^(samples after it),
+    # which is computed for all groups at once instead of iterating sample by sample.
+    if values.size < 2:
+        return np.full(num_groups, np.nan)
+    same_group = ids[1:] == ids[:-1]
+    differences = np.abs(np.diff(values))[same_group]
+    diff_ids = ids[1:][same_group]
+    if differences.size == 0:
+        return np.full(num_groups, np.nan)
+    diff_counts = np.bincount(diff_ids, minlength=num_groups)
+    group_ends = np.cumsum(diff_counts)
+    samples_after = group_ends[diff_ids] - 1 - np.arange(differences.size)
+    weights = (1 / 16) * np.power(15 / 16, samples_after)
+    jitter = np.bincount(diff_ids, weights=differences * weights, minlength=num_groups)
+    return np.where(diff_counts > 0, jitter, np.nan)
+
+def bootstrap_mean_ci(values, confidence=0.95, resamples=BOOTSTRAP_RESAMPLES, rng=None):
+    # Percentile bootstrap of the mean, generated in chunks of resamples so memory stays bounded.
+    # Above MAX_BOOTSTRAP_SIZE samples the resampling runs on a random subsample and the spread is
+    # rescaled by sqrt(m / n), since the standard error of the mean shrinks with 1 / sqrt(n).
+    values = np.asarray(values, dtype=np.float64)
+    if values.size < 2 or resamples <= 0:
+        return (float("nan"), float("nan"))
+    rng = rng if rng is not None else np.random.default_rng()
+    mean = values.mean()
+
+    subsample = values
+    if values.size > MAX_BOOTSTRAP_SIZE:
+        subsample = rng.choice(values, MAX_BOOTSTRAP_SIZE, replace=False)
+    size = subsample.size
+    chunk = max(1, BOOTSTRAP_CHUNK_ELEMENTS // size)
+
+    means = np.empty(resamples)
+    for start in range(0, resamples, chunk):
+        stop = min(start + chunk, resamples)
+        indices = rng.integers(0, size, (stop - start, size))
+        means[start:stop] = subsample[indices].mean(axis=1)
+
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(means, [alpha, 1 - alpha])
+    scale = np.sqrt(size / values.size)
+    center = subsample.mean()
+    return (float(mean + (low - center) * scale), float(mean + (high - center) * scale))
+
+def mann_whitney(baseline, candidate):
+    # Mann-Whitney U test of candidate against baseline (NaN dropped), normal approximation with tie and continuity
+    # corrections, close to exact from ~8 samples per side.
+    # p_greater: one-sided p-value of candidate values tending to be larger, p_less of them tending to be smaller.
+    # cliffs_delta: P(candidate > baseline) - P(candidate < baseline), from -1 to 1
+    x = np.asarray(baseline, dtype=np.float64).ravel()
+    y = np.asarray(candidate, dtype=np.float64).ravel()
+    x, y = x[~np.isnan(x)], y[~np.isnan(y)]
+    n1, n2 = x.size, y.size
+    if n1 == 0 or n2 == 0:
+        return {"u": float("nan"), "p_greater": float("nan"), "p_less": float("nan"), "cliffs_delta": float("nan")}
+
+    # Average ranks, tied values sharing the mean of their ranks
+    _, inverse, counts = np.unique(np.concatenate((x, y)), return_inverse=True, return_counts=True)
+    ranks = (np.cumsum(counts) - (counts - 1) / 2)[inverse]
+    u = ranks[n1:].sum() - n2 * (n2 + 1) / 2  # Pairs where the candidate is larger, ties counting half
+
+    n = n1 + n2
+    variance = n1 * n2 / 12 * ((n + 1) - (counts ** 3 - counts).sum() / (n * (n - 1)))
+    if variance <= 0:
+        # Every value identical
+        p_greater = p_less = 1.0
+    else:
+        deviation = np.sqrt(variance)
+        p_greater = 0.5 * math.erfc((u - n1 * n2 / 2 - 0.5) / deviation / math.sqrt(2))
+        p_less = 0.5 * math.erfc(-(u - n1 * n2 / 2 + 0.5) / deviation / math.sqrt(2))
+    return {"u": float(u), "p_greater": float(min(p_greater, 1.0)), "p_less": float(min(p_less, 1.0)),
+            "cliffs_delta": float(2 * u / (n1 * n2) - 1)}
+
+def holm_adjust(p_values):
+    # Holm-Bonferroni adjusted p-values, in the same order: comparing each against alpha keeps the probability of
+    # any false positive among all of them below alpha
+    p_values = np.asarray(p_values, dtype=np.float64)
+    order = np.argsort(p_values)
+    adjusted = np.minimum(np.maximum.accumulate((p_values.size - np.arange(p_values.size)) * p_values[order]), 1)
+    result = np.empty_like(adjusted)
+    result[order] = adjusted
+    return result
+
+def bootstrap_median_change(baseline, candidate, confidence=0.95, resamples=BOOTSTRAP_RESAMPLES, rng=None):
+    # Relative change of the median (candidate / baseline - 1) and its percentile bootstrap interval.
+    # Groups above MAX_MEDIAN_BOOTSTRAP_SIZE are resampled from a random subsample, their spread rescaled as in
+    # bootstrap_mean_ci (the standard error of the median also shrinks with 1 / sqrt(n))
+    rng = rng if rng is not None else np.random.default_rng()
+    groups = [np.asarray(values, dtype=np.float64).ravel() for values in (baseline, candidate)]
+    groups = [values[~np.isnan(values)] for values in groups]
+    if any(values.size == 0 for values in groups) or np.median(groups[0]) == 0:
+        return float("nan"), (float("nan"), float("nan"))
+    medians = [float(np.median(values)) for values in groups]
+    change = medians[1] / medians[0] - 1
+    if any(values.size < 2 for values in groups) or resamples <= 0:
+        return change, (float("nan"), float("nan"))
+
+    resampled = []
+    for values, median in zip(groups, medians):
+        subsample = values
+        if values.size > MAX_MEDIAN_BOOTSTRAP_SIZE:
+            subsample = rng.choice(values, MAX_MEDIAN_BOOTSTRAP_SIZE, replace=False)
+        size = subsample.size
+        chunk = max(1, BOOTSTRAP_CHUNK_ELEMENTS // size)
+        group_medians = np.empty(resamples)
+        for start in range(0, resamples, chunk):
+            stop = min(start + chunk, resamples)
+            group_medians[start:stop] = np.median(subsample[rng.integers(0, size, (stop - start, size))], axis=1)
+        resampled.append(median + (group_medians - np.median(subsample)) * np.sqrt(size / values.size))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        changes = resampled[1] / resampled[0] - 1
+    alpha = (1 - confidence) / 2
+    low, high = np.nanquantile(changes, [alpha, 1 - alpha])
+    return change, (float(low), float(high))
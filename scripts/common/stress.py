@@ -0,0 +1,259 @@
+import mmap
+import multiprocessing
+import os
+import queue
+import time
+
+import numpy as np
+
+# CPU stress engine running one worker process per core, so the stress isn't serialized by the GIL
+# and doesn't compete with the sampler for the same interpreter.
+#
+# Every kernel factory returns a step() function doing a short batch of work (a few milliseconds at most)
+# and returning the number of operations it did. Workers only check the clock between steps.
+
+DUTY_PERIOD = 0.1  # Seconds. A worker is busy for load * DUTY_PERIOD then sleeps for the rest of the period
+MEMORY_SAFETY_FRACTION = 0.8  # Never allocate more than this fraction of MemAvailable
+TOUCH_CHUNK = 4 * 1024 * 1024  # Bytes touched between two rate checks
+
+def integer_kernel():
+    # Fibonacci additions kept within 64 bits
+    def step():
+        a, b = 0, 1
+        for _ in range(10000):
+            a, b = b, (a + b) & 0xffffffffffffffff
+        return 10000
+    return step
+
+def float_kernel():
+    # Dense matrix multiplication, 2 * n^3 floating point operations per call
+    size = 64
+    rng = np.random.default_rng(0)
+    a, b = rng.random((size, size)), rng.random((size, size))
+    def step():
+        np.matmul(a, b)
+        return 2 * size ** 3
+    return step
+
+def branchy_kernel():
+    # Collatz sequences: data-dependent, hard to predict branches
+    state = {"start": 1}
+    def step():
+        steps = 0
+        for start in range(state["start"], state["start"] + 100):
+            value = start
+            while value != 1:
+                value = value // 2 if value % 2 == 0 else 3 * value + 1
+                steps += 1
+        state["start"] += 100
+        return steps
+    return step
+
+def cache_kernel():
+    # Random gathers over a buffer far larger than the caches
+    size = 8 * 1024 * 1024  # 64 MB of float64
+    buffer = np.ones(size)
+    indices = np.random.default_rng(0).integers(0, size, 65536)
+    def step():
+        buffer[indices].sum()
+        return indices.size
+    return step
+
+KERNELS = {
+    "integer": integer_kernel,
+    "float": float_kernel,
+    "branchy": branchy_kernel,
+    "cache": cache_kernel,
+}
+
+def worker_main(function, worker, results, *args):
+    # Process entry point: puts the worker's result, or the error that stopped it, so the parent never waits on it
+    try:
+        results.put(function(worker, *args))
+    except Exception as e:
+        results.put({"worker": worker, "error": f"{type(e).__name__}: {e}"})
+
+def collect_results(processes, results, timeout, name):
+    # One result per worker, sorted by worker number. Raises RuntimeError as soon as a worker reports an error
+    # or dies without a result (e.g. OOM-killed), and stops the other workers
+    deadline = time.monotonic() + timeout
+    worker_results = []
+    try:
+        while len(worker_results) < len(processes):
+            try:
+                result = results.get(timeout=1)
+            except queue.Empty:
+                dead = [process for process in processes if process.exitcode not in (None, 0)]
+                if dead:
+                    raise RuntimeError(f"{name} worker process exited with code {dead[0].exitcode}")
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"{name} workers didn't report within {timeout:.0f} seconds")
+                continue
+            if "error" in result:
+                raise RuntimeError(f"{name} worker {result['worker']} failed: {result['error']}")
+            worker_results.append(result)
+    except Exception:
+        for process in processes:
+            process.terminate()
+        raise
+    finally:
+        for process in processes:
+            process.join()
+    return sorted(worker_results, key=lambda result: result["worker"])
+
+def cpu_worker(worker, kernel, duration, load, core, stop_event=None):
+    if core is not None and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, {core})
+        except OSError:
+            pass
+    step = KERNELS[kernel]()
+
+    operations = 0
+    busy_time = 0.0
+    start = time.monotonic()
+    end = start + duration
+    period_start = start
+    now = start
+    while now < end and not (stop_event and stop_event.is_set()):
+        busy_until = min(period_start + load * DUTY_PERIOD, end)
+        busy_start = now
+        while now < busy_until:
+            operations += step()
+            now = time.monotonic()
+        busy_time += now - busy_start
+
+        period_start += DUTY_PERIOD
+        if load < 1:
+            delay = min(period_start, end) - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        now = time.monotonic()
+
+    elapsed = now - start
+    return {
+        "worker": worker,
+        "core": core,
+        "kernel": kernel,
+        "operations": operations,
+        "ops_per_second": operations / elapsed if elapsed else 0,
+        "achieved_load": busy_time / elapsed * 100 if elapsed else 0,
+    }
+
+def run_cpu_stress(duration, workers=None, kernel="integer", load=1.0, stop_event=None):
+    # Blocks for `duration` seconds (or until stop_event, a multiprocessing.Event, is set)
+    # and returns one result per worker, sorted by worker number. Raises RuntimeError if a worker fails
+    if kernel not in KERNELS:
+        raise ValueError(f"Unknown CPU stress kernel '{kernel}'. Available: {', '.join(KERNELS)}")
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else [None]
+    workers = workers or len(cores)
+    load = min(max(load, 0.0), 1.0)
+
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=worker_main, daemon=True,
+                                         args=(cpu_worker, worker, results, kernel, duration, load, cores[worker % len(cores)], stop_event))
+                 for worker in range(workers)]
+    for process in processes:
+        process.start()
+    # Drain the queue before joining so no worker blocks on a full pipe
+    return collect_results(processes, results, duration + 60, "CPU stress")
+
+# Memory stress engine: every worker maps its share of the target in one anonymous mmap, touches its pages
+# at a controlled rate and then measures STREAM-style read/write/copy bandwidth over it until the end.
+
+def read_meminfo_kb(keys=("MemTotal", "MemAvailable")):
+    memory = {}
+    with open("/proc/meminfo", "r") as file:
+        for line in file:
+            key, value = line.split(":", 1)
+            if key in keys:
+                memory[key] = int(value.split()[0])
+    return memory
+
+def parse_memory_size(size):
+    # "50M", "1G", "512K", "1048576" (bytes) or "25%" of MemTotal
+    text = str(size).strip().upper().rstrip("B").rstrip("I")
+    if text.endswith("%"):
+        value = int(read_meminfo_kb()["MemTotal"] * 1024 * float(text[:-1]) / 100)
+    else:
+        units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+        value = int(float(text[:-1]) * units[text[-1]]) if text and text[-1] in units else int(float(text))
+    if value < 0:
+        raise ValueError(f"Invalid memory size '{size}'")
+    return value
+
+def memory_ceiling():
+    return int(read_meminfo_kb()["MemAvailable"] * 1024 * MEMORY_SAFETY_FRACTION)
+
+def memory_worker(worker, size, duration, touch_rate):
+    end = time.monotonic() + duration
+    size -= size % (2 * mmap.PAGESIZE)
+    buffer = mmap.mmap(-1, size, flags=mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS)
+    data = np.frombuffer(buffer, dtype=np.uint8)
+
+    # Touch one byte per page so the kernel backs the whole buffer, at touch_rate bytes/second when given
+    touch_start = time.monotonic()
+    for offset in range(0, size, TOUCH_CHUNK):
+        data[offset:offset + TOUCH_CHUNK:mmap.PAGESIZE] = 1
+        if touch_rate:
+            delay = touch_start + (offset + TOUCH_CHUNK) / touch_rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        if time.monotonic() >= end:
+            break
+    touch_seconds = time.monotonic() - touch_start
+
+    # STREAM-style kernels over two halves of the buffer. Copy counts the bytes read and written
+    words = np.frombuffer(buffer, dtype=np.float64)
+    a, b = words[:words.size // 2], words[words.size // 2:]
+    moved = {"read": 0, "write": 0, "copy": 0}
+    spent = {"read": 0.0, "write": 0.0, "copy": 0.0}
+    while time.monotonic() < end:
+        started = time.perf_counter()
+        a.sum()
+        spent["read"] += time.perf_counter() - started
+        moved["read"] += a.nbytes
+
+        started = time.perf_counter()
+        b.fill(1.0)
+        spent["write"] += time.perf_counter() - started
+        moved["write"] += b.nbytes
+
+        started = time.perf_counter()
+        np.copyto(b, a)
+        spent["copy"] += time.perf_counter() - started
+        moved["copy"] += 2 * a.nbytes
+
+    del data, words, a, b
+    buffer.close()
+    result = {"worker": worker, "allocated_bytes": size, "touch_seconds": touch_seconds}
+    for kernel in moved:
+        result[f"{kernel}_mb_per_second"] = moved[kernel] / spent[kernel] / 1e6 if spent[kernel] else 0
+    return result
+
+def run_memory_stress(duration, target, workers=1, touch_rate=0):
+    # target: total bytes, or a size string accepted by parse_memory_size. It's clamped to the safety ceiling
+    # read from /proc/meminfo, so the stress can't get the device OOM-killed.
+    # touch_rate: total bytes/second at which pages are first touched, split among workers (0 = as fast as possible)
+    # workers = 0 disables the memory stress: nothing is allocated and the result has no workers.
+    # Raises ValueError if a worker's share is below two pages (one per STREAM half), RuntimeError if a worker fails
+    requested = parse_memory_size(target)
+    ceiling = memory_ceiling()
+    total = min(requested, ceiling)
+    workers = max(0, workers)
+    if workers and total // workers < 2 * mmap.PAGESIZE:
+        raise ValueError(f"Memory stress of {total} bytes over {workers} workers is below two pages "
+                         f"({2 * mmap.PAGESIZE} bytes) per worker")
+
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=worker_main, daemon=True,
+                                         args=(memory_worker, worker, results, total // workers, duration, touch_rate / workers))
+                 for worker in range(workers)]
+    for process in processes:
+        process.start()
+    return {
+        "requested_bytes": requested,
+        "ceiling_bytes": ceiling,
+        "clamped": requested > ceiling,
+        "workers": collect_results(processes, results, duration + 60, "Memory stress"),
+    }
@@ -0,0 +1,93 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from common.instrumentation import HARNESS
+from common.kpi import Device
+
+# Concurrent sweeps over the device inventory, shared by network_latency.py, the benchmark runner and the
+# resource utilization coordinator.
+
+class ConcurrencyTracker:
+    # Keeps the number of measurements in flight and the peak observed while each one was running
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._peaks = {}
+
+    def start(self, key):
+        with self._lock:
+            self._peaks[key] = 0
+            in_flight = len(self._peaks)
+            for running in self._peaks:
+                self._peaks[running] = max(self._peaks[running], in_flight)
+
+    def stop(self, key):
+        with self._lock:
+            return self._peaks.pop(key)
+
+def sweep_devices(config, measure):
+    # Measures every device of every layer concurrently, bounded by the global and per-layer limits.
+    # Returns {layer: [(device_name, device_ip, future)]} in config order, so results can be written in order
+    global_limit = threading.BoundedSemaphore(max(1, config['concurrency']))
+    tracker = ConcurrencyTracker()
+    executors = []
+    sweep = {}
+
+    def run(category, device_name, device_ip):
+        with global_limit, HARNESS.scope((category, device_name)):
+            tracker.start((category, device_name))
+            try:
+                result = measure(Device(category, device_name, device_ip))
+            finally:
+                peak = tracker.stop((category, device_name))
+        return result, peak
+
+    for category in config.get('layers', []):
+        devices = config[category]
+        workers = max(1, min(config['layer_concurrency'][category], config['concurrency'], len(devices)))
+        executor = ThreadPoolExecutor(max_workers=workers)
+        executors.append(executor)
+        sweep[category] = [(device_name, device_ip, executor.submit(run, category, device_name, device_ip))
+                           for device_name, device_ip in devices.items()]
+
+    for executor in executors:
+        executor.shutdown(wait=False)
+    return sweep
+
+class SharedExclusiveLock:
+    # Any number of shared holders, or a single exclusive one. Measurements that would disturb every other one
+    # (e.g. saturating the link) hold it exclusively, the rest share it. Waiting exclusive holders block new shared
+    # ones, so they aren't starved by a steady stream of short measurements
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._shared = 0
+        self._exclusive = False
+        self._waiting = 0
+
+    @contextmanager
+    def shared(self):
+        with self._condition:
+            while self._exclusive or self._waiting:
+                self._condition.wait()
+            self._shared += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._shared -= 1
+                self._condition.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._condition:
+            self._waiting += 1
+            while self._exclusive or self._shared:
+                self._condition.wait()
+            self._waiting -= 1
+            self._exclusive = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._exclusive = False
+                self._condition.notify_all()
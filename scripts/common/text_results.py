@@ -0,0 +1,41 @@
+import json
+import os
+
+# Helpers to parse the append-only results/*.txt files incrementally.
+# A checkpoint remembers the byte offset reached and the results parsed so far,
+# so the next call only parses what was appended in between.
+
+def checkpoint_path(filename):
+    directory, name = os.path.split(filename)
+    return os.path.join(directory, f".{name}.checkpoint.json")
+
+def iter_lines(filename, offset=0):
+    # Yields (line, end_offset) for every complete line from the given byte offset
+    with open(filename, "rb") as file:
+        file.seek(offset)
+        for raw_line in file:
+            if not raw_line.endswith(b"\n"):
+                break  # Still being written, picked up on the next call
+            offset += len(raw_line)
+            yield raw_line.decode("utf-8", errors="replace").rstrip("\r\n"), offset
+
+def load_checkpoint(filename, checkpoint_file):
+    # Starts from scratch when there's no checkpoint or the results file was replaced/truncated
+    empty = {"offset": 0, "inode": None, "results": {}}
+    if checkpoint_file is None or not os.path.exists(checkpoint_file):
+        return empty
+    with open(checkpoint_file, "r") as file:
+        checkpoint = json.load(file)
+    stat = os.stat(filename)
+    if checkpoint.get("inode") != stat.st_ino or checkpoint.get("offset", 0) > stat.st_size:
+        return empty
+    return checkpoint
+
+def save_checkpoint(filename, checkpoint_file, checkpoint):
+    if checkpoint_file is None:
+        return
+    checkpoint["inode"] = os.stat(filename).st_ino
+    temporary_file = checkpoint_file + ".tmp"
+    with open(temporary_file, "w") as file:
+        json.dump(checkpoint, file)
+    os.replace(temporary_file, checkpoint_file)
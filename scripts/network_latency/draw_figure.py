@@ -1,29 +1,76 @@
 import matplotlib.pyplot as plt
 import re
 import configparser
+import os
+import sys
 
-def parse_results(filename):
-    with open(filename, 'r') as file:
-        content = file.read()
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.histogram import LatencyHistogram
+from common.results_store import ResultsStore
+from common.text_results import checkpoint_path, iter_lines, load_checkpoint, save_checkpoint
 
-    # Extract the device name and their results
-    device_pattern = re.compile(r"Device Name: (.+?)\nDevice IP: .+?\n\n(.*?)\n\nSummary:", re.DOTALL)
+def iter_device_records(filename, offset=0):
+    # Streams the results file line by line and yields (device_name, histogram, end_offset) per device block.
+    # Device blocks hold either one line per ping or one encoded histogram per repetition (record_mode)
     ping_pattern = re.compile(r"Ping nº\d+: ([\d.]+) ms")
+    histogram_prefix = "Latency Histogram for Repetition "
+    device_name, histogram, pings = None, None, []
 
+    for line, end_offset in iter_lines(filename, offset):
+        if line.startswith("Device Name: "):
+            device_name, histogram, pings = line[len("Device Name: "):], LatencyHistogram(), []
+        elif device_name is not None:
+            match = ping_pattern.match(line)
+            if match:
+                pings.append(float(match.group(1)))
+            elif line.startswith(histogram_prefix):
+                histogram.add(LatencyHistogram.decode(line.split(": ", 1)[1]))
+            elif line == "Summary:":
+                histogram.record_values(pings)
+                yield device_name, histogram, end_offset
+                device_name = None
+
+def parse_results(filename, checkpoint_file=None):
+    # Only the device blocks appended since the last checkpoint are parsed.
+    # The checkpoint keeps every device's histogram encoded
+    checkpoint = load_checkpoint(filename, checkpoint_file)
     results = {}
+    for device_name, histogram in checkpoint["results"].items():
+        if isinstance(histogram, list):
+            # Checkpoint written before histograms, holding the pings
+            results[device_name] = LatencyHistogram()
+            results[device_name].record_values(histogram)
+        else:
+            results[device_name] = LatencyHistogram.decode(histogram)
+
+    for device_name, histogram, end_offset in iter_device_records(filename, checkpoint["offset"]):
+        results[device_name] = histogram
+        checkpoint["offset"] = end_offset
 
-    for match in device_pattern.findall(content):
-        device_name, pings_data = match
-        pings = [float(ping) for ping in ping_pattern.findall(pings_data)]
-        results[device_name] = pings
+    checkpoint["results"] = {device_name: histogram.encode() for device_name, histogram in results.items()}
+    save_checkpoint(filename, checkpoint_file, checkpoint)
+    return results
 
+def load_results_from_store(store_dir, run_id=None):
+    # Same {device: histogram} layout as parse_results, read through the store index (latest run by default).
+    # The repetitions of a device are merged, whether they were stored as histograms or as raw samples
+    store = ResultsStore(store_dir)
+    run_id = run_id or store.latest_run("latency")
+    results = {}
+    for record in store.records(run_id=run_id, kpi="latency"):
+        histogram = results.setdefault(record["device"], LatencyHistogram())
+        if "histogram" in record["fields"]:
+            histogram.add(LatencyHistogram.decode(record["fields"]["histogram"]))
+        else:
+            histogram.record_values(store.load(record))
     return results
 
 def plot_results(devices_data, output_file):
     plt.figure(figsize=(12, 7))
 
     labels = list(devices_data.keys())
-    averages = [sum(devices_data[device])/len(devices_data[device]) for device in labels]
+    averages = [histogram.mean() if histogram.total_count else 0 for histogram in devices_data.values()]
+    tails = [histogram.percentile(99) if histogram.total_count else 0 for histogram in devices_data.values()]
     color_palette = plt.cm.viridis  # Using the viridis colormap, but you can choose another if you prefer
 
     bars = plt.bar(labels, averages, color=[color_palette(i) for i in range(len(averages))])
@@ -33,6 +80,10 @@ def plot_results(devices_data, output_file):
         yval = bar.get_height()
         plt.text(bar.get_x() + bar.get_width()/2, yval + 0.01, round(yval, 2), ha='center', va='bottom')
 
+    # Tail latency next to the average
+    plt.scatter(labels, tails, marker='_', s=800, color='red', label='p99 Network Latency (ms)', zorder=3)
+    plt.legend()
+
     plt.title('Network Latency')  # Adjusted the title as per your request
     plt.xlabel('Device')  # Label for the devices
     plt.ylabel('Average Network Latency (ms)')  # Adjusted the y-axis label as per your request
@@ -40,8 +91,21 @@ def plot_results(devices_data, output_file):
 
     # Save the figure to the specified file
     plt.savefig(output_file)
+    plt.close()
+
+def render(results_dir, figures_dir, store_dir=None):
+    # Figures of this KPI from the store when it holds latency records, else from the text results
+    store_dir = store_dir or os.path.join(results_dir, "store")
+    if os.path.exists(os.path.join(store_dir, "index.jsonl")) and ResultsStore(store_dir).latest_run("latency"):
+        results = load_results_from_store(store_dir)
+    else:
+        results_file = os.path.join(results_dir, "network_latency.txt")
+        results = parse_results(results_file, checkpoint_path(results_file))
+    output_file = os.path.join(figures_dir, "network_latency.png")
+    plot_results(results, output_file)
+    return [output_file]
 
 
 if __name__ == "__main__":
-    results = parse_results('../../results/network_latency.txt')
-    plot_results(results, "../../figures/network_latency.png")
+    base_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+    render(os.path.join(base_dir, "results"), os.path.join(base_dir, "figures"))
@@ -1,44 +1,93 @@
-import subprocess
 import os
-import configparser
 import re
 import datetime
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.config import (config_path, load_config, read_layers, script_config, write_completion_layer_notice,
+                           write_starting_layer_notice)
+from common.availability import availability_lines, availability_records, summarize_availability
+from common.histogram import LatencyHistogram, merge_histograms
+from common.instrumentation import HARNESS, report_overhead, report_usage
+from common.kpi import Device, Kpi, Record, store_records
+from common.prober import parse_ping_output, probe_device, rtts_ms, run_ping
+from common.results_store import ResultsStore, new_run_id
+from common.stats import summarize
+from common.sweep import sweep_devices
+
+RECORD_MODES = ("histogram", "samples")
+
+def read_options(section):
+    # Measurement options, shared with the benchmark runner's [latency] section
+    options = {
+        "repetitions": int(section.get('repetitions')),
+        "duration": int(section.get('duration')),
+        "prober": section.get('prober', 'system').strip(),
+        "echo_port": int(section.get('echo_port', 7)),
+        "corrected_latency": section.getboolean('corrected_latency', True),
+        "record_mode": section.get('record_mode', 'histogram').strip(),
+        "availability": section.getboolean('availability', False),
+        "outage_probes": int(section.get('outage_probes', 1)),
+    }
+    if options['record_mode'] not in RECORD_MODES:
+        raise ValueError(f"Unknown record_mode '{options['record_mode']}'. Available: {', '.join(RECORD_MODES)}")
+    return options
 
 def read_config(filename):
-    config = configparser.ConfigParser()
-    config.read(filename)
+    config = load_config(filename)
     
-    layers = [layer.strip() for layer in config['general'].get('layers').split(',')]
+    concurrency = int(config['general'].get('concurrency', 1))
     variables = {
-        "results_file": config['general'].get('results_file', ''),
-        "repetitions": int(config['general'].get('repetitions')),
-        "duration": int(config['general'].get('duration')),
-        "layers": layers
+        "results_file": config_path(filename, config['general'].get('results_file', '')),
+        "concurrency": concurrency,
+        "store_dir": config_path(filename, config['general'].get('store_dir', '')),
+        "text_results": config['general'].getboolean('text_results', True),
+        "instrumentation": config['general'].getboolean('instrumentation', False),
+        **read_options(config['general'])
     }
-
-    for layer in layers:
-        variables[layer] = {k.replace("_ip", ""): v for k, v in config[layer].items()}
-
+    variables.update(read_layers(config, concurrency))
     return variables
 
-def ping_device(device_ip, duration, repetitions):
-    results = []
-
-    for _ in range(repetitions):
-        try:
-            cmd = ["ping", "-c", str(duration), device_ip]
-            result = subprocess.check_output(cmd, stderr=subprocess.STDOUT, universal_newlines=True)
-            results.append(result)
-        except subprocess.CalledProcessError as e:
-            results.append(e.output)
-    return "\n".join(results)
+def to_histogram(times):
+    histogram = LatencyHistogram()
+    histogram.record_values(times)
+    return histogram
+
+def measure_probes(device_ip, config):
+    # Returns the RTTs (ms) of each repetition, the average RTT of each repetition and the probes (ProbeSamples) of
+    # each repetition, from which availability is computed without probing the device a second time.
+    # With record_mode = histogram every repetition's RTTs are folded into a LatencyHistogram as soon as it ends
+    if config['prober'] == 'system':
+        runs = [run_ping(device_ip, config['duration']) for _ in range(config['repetitions'])]
+        times_per_repetition, avg_rtts = filtering_values_from_output("\n".join(output for output, _ in runs))
+        probes = [parse_ping_output(output, config['duration'], start_ns) for output, start_ns in runs]
+    else:
+        times_per_repetition = []
+        avg_rtts = []
+        probes = []
+        for _ in range(config['repetitions']):
+            samples = probe_device(device_ip, config['duration'], backend=config['prober'], port=config['echo_port'])
+            times = rtts_ms(samples, config['corrected_latency'])
+            if times:
+                avg_rtts.append(sum(times) / len(times))
+            times_per_repetition.append(times)
+            probes.append(samples)
+
+    if config['record_mode'] == 'histogram':
+        times_per_repetition = [to_histogram(times) for times in times_per_repetition]
+    return times_per_repetition, avg_rtts, probes
+
+def measure_latency(device_ip, config):
+    times_per_repetition, avg_rtts, _ = measure_probes(device_ip, config)
+    return times_per_repetition, avg_rtts
 
+@HARNESS.timed("parse")
 def filtering_values_from_output(ping_output):
     time_per_second_pattern = re.compile(r"time=([\d.]+) ms")
     rtt_pattern = re.compile(r"rtt min/avg/max/mdev = [\d.]+/([\d.]+)/[\d.]+/[\d.]+ ms")
 
     # Split by "--- IP_ADDRESS ping statistics ---" to separate each repetition
-    repetitions = re.split(r"--- \d+\.\d+\.\d+\.\d+ ping statistics ---", ping_output)
+    repetitions = re.split(r"--- \S+ ping statistics ---", ping_output)
 
     times_per_repetition = []
     avg_rtts = []
@@ -56,8 +105,8 @@ def filtering_values_from_output(ping_output):
 
     return times_per_repetition, avg_rtts
 
-def write_results_to_file(results_file, device_name, device_ip, repetition_number, ping_output):
-    times_per_repetition, avg_rtts = filtering_values_from_output(ping_output)
+@HARNESS.timed("write")
+def write_results_to_file(results_file, device_name, device_ip, repetition_number, times_per_repetition, avg_rtts, peak_concurrency=1, concurrency_limit=1, expected_pings=None):
     repetition_number = int(repetition_number) + 1
 
     with open(results_file, "a") as file:
@@ -67,6 +116,9 @@ def write_results_to_file(results_file, device_name, device_ip, repetition_numbe
 
         # Writing each repetition's results
         for index, time_per_second in enumerate(times_per_repetition):
+            if isinstance(time_per_second, LatencyHistogram):
+                file.write(f"Latency Histogram for Repetition {index + 1}: {time_per_second.encode()}\n\n")
+                continue
             file.write("Detailed Ping Results for Repetition " + str(index + 1) + ":\n")
             for i, time in enumerate(time_per_second):
                 file.write(f"Ping nº{i + 1}: {time:.3f} ms\n")
@@ -81,38 +133,106 @@ def write_results_to_file(results_file, device_name, device_ip, repetition_numbe
         total_avg_rtt = sum(avg_rtts) / len(avg_rtts) if avg_rtts else 0
         file.write(f"Total Average RTT: {total_avg_rtt:.3f} ms\n")
 
-def write_starting_layer_notice(results_file, category):
+        if times_per_repetition and isinstance(times_per_repetition[0], LatencyHistogram):
+            # Tail latency and loss from the merged histogram of the device (jitter needs the samples in order)
+            histogram = merge_histograms(times_per_repetition)
+            p50, p90, p99, p99_9 = histogram.percentiles((50, 90, 99, 99.9))
+            sent = max(expected_pings or 0, histogram.total_count + histogram.lost)
+            loss = 1 - histogram.total_count / sent if sent else float("nan")
+            file.write(f"RTT Percentiles (p50/p90/p99/p99.9): {p50:.3f}/{p90:.3f}/{p99:.3f}/{p99_9:.3f} ms\n")
+            file.write(f"RTT min/max/mdev: {histogram.min:.3f}/{histogram.max:.3f}/{histogram.stdev():.3f} ms\n")
+            file.write(f"Packet Loss: {loss * 100:.2f}%\n")
+        else:
+            # Tail latency, jitter and loss over all the pings of the device
+            stats = summarize([time for times in times_per_repetition for time in times], expected=expected_pings)
+            file.write(f"RTT Percentiles (p50/p90/p99/p99.9): {stats['p50']:.3f}/{stats['p90']:.3f}/{stats['p99']:.3f}/{stats['p99_9']:.3f} ms\n")
+            file.write(f"RTT min/max/mdev: {stats['min']:.3f}/{stats['max']:.3f}/{stats['mdev']:.3f} ms\n")
+            file.write(f"Jitter (RFC 3550): {stats['jitter']:.3f} ms\n")
+            file.write(f"Packet Loss: {stats['loss'] * 100:.2f}%\n")
+            file.write(f"Average RTT 95% CI: [{stats['mean_ci'][0]:.3f}, {stats['mean_ci'][1]:.3f}] ms\n")
+        file.write(f"Concurrent Measurements: {peak_concurrency} (limit {concurrency_limit})\n")
+
+@HARNESS.timed("write")
+def write_availability_to_file(results_file, summary):
+    # Availability computed from the same pings as the latency above
     with open(results_file, "a") as file:
-        file.write(f"[Starting tests for {category.replace('-', ' ').title()}]\n")
-        file.write("-----------------------------------\n")
+        file.write("\n".join(availability_lines(summary)) + "\n")
 
-def write_completion_layer_notice(results_file, category):
-    with open(results_file, "a") as file:
-        file.write("-----------------------------------\n")
-        file.write(f"[Completed tests for {category.replace('-', ' ').title()}]\n\n")
+def latency_records(times_per_repetition):
+    records = []
+    for index, times in enumerate(times_per_repetition):
+        if isinstance(times, LatencyHistogram):
+            # No raw samples, the record carries the encoded histogram
+            records.append(Record("latency", [], "ms", {"repetition": index + 1, "histogram": times.encode()}))
+        else:
+            records.append(Record("latency", times, "ms", {"repetition": index + 1}))
+    return records
+
+def store_results(store, run_id, category, device_name, device_ip, times_per_repetition, peak_concurrency, concurrency_limit):
+    store_records(store, run_id, Device(category, device_name, device_ip), latency_records(times_per_repetition),
+                  peak_concurrency=peak_concurrency, concurrency_limit=concurrency_limit)
+
+class LatencyKpi(Kpi):
+    name = "latency"
+
+    @classmethod
+    def read_options(cls, section):
+        return read_options(section)
+
+    def measure(self, device):
+        times_per_repetition, _, probes = measure_probes(device.ip, self.options)
+        records = latency_records(times_per_repetition)
+        if self.options['availability']:
+            records += availability_records(summarize_availability(probes, outage_probes=self.options['outage_probes']))
+        return records
 
 
 if __name__ == "__main__":
     try:
-        config = read_config("config.cfg")
+        config = read_config(script_config(__file__))
+        store = ResultsStore(config['store_dir']) if config['store_dir'] else None
+        run_id = new_run_id(__file__)
 
         # Write the initial lines to the results file
         script_name = os.path.basename(__file__)
         current_date = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-        with open(config['results_file'], "a") as file:
-            file.write(f"Running {script_name} on {current_date}\n")
-            file.write(f"(Configuration --> Duration: {config['duration']} seconds, Repetitions: {config['repetitions']})\n")
-            file.write(f"{'*' * 60}\n\n")
+        results_file = config['results_file'] if config['text_results'] else None
+        if config['instrumentation']:
+            HARNESS.start()
+
+        if config['text_results']:
+            with open(config['results_file'], "a") as file:
+                file.write(f"Running {script_name} on {current_date}\n")
+                file.write(f"(Configuration --> Duration: {config['duration']} seconds, Repetitions: {config['repetitions']})\n")
+                file.write(f"{'*' * 60}\n\n")
             
-        # Loop through the layers dynamically:
+        # Ping the devices of all layers concurrently, but write the results in config order
+        sweep = sweep_devices(config, lambda device: measure_probes(device.ip, config))
         for category in config.get('layers', []):
-            write_starting_layer_notice(config['results_file'], category)
-            for device_name, device_ip in config[category].items():
-                ping_results = ping_device(device_ip, config['duration'], config['repetitions'])
-                write_results_to_file(config['results_file'], device_name, device_ip, config['repetitions'], ping_results)
-            write_completion_layer_notice(config['results_file'], category)
-        print("Script successfully executed. Results stored in: " +config['results_file'])
+            if config['text_results']:
+                write_starting_layer_notice(config['results_file'], category)
+            concurrency_limit = min(config['layer_concurrency'][category], config['concurrency'])
+            for device_name, device_ip, future in sweep[category]:
+                (times_per_repetition, avg_rtts, probes), peak_concurrency = future.result()
+                summary = summarize_availability(probes, outage_probes=config['outage_probes']) if config['availability'] else None
+                # The sweep timed this device's pings under the same scope
+                with HARNESS.scope((category, device_name)):
+                    if store is not None:
+                        store_results(store, run_id, category, device_name, device_ip, times_per_repetition, peak_concurrency, concurrency_limit)
+                        if summary is not None:
+                            store_records(store, run_id, Device(category, device_name, device_ip), availability_records(summary))
+                    if config['text_results']:
+                        write_results_to_file(config['results_file'], device_name, device_ip, config['repetitions'], times_per_repetition, avg_rtts, peak_concurrency, concurrency_limit,
+                                              config['duration'] * config['repetitions'])
+                        if summary is not None:
+                            write_availability_to_file(config['results_file'], summary)
+                if config['instrumentation']:
+                    report_overhead((category, device_name), Device(category, device_name, device_ip), results_file, store, run_id)
+            if config['text_results']:
+                write_completion_layer_notice(config['results_file'], category)
+        if config['instrumentation']:
+            report_usage(Device("local", "harness", ""), results_file, store, run_id)
+        print(f"Script successfully executed. Results stored in: {config['store_dir'] or config['results_file']} (run {run_id})")
 
     except Exception as e:
         print(f"Error: {e}")
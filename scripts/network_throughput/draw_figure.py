@@ -1,31 +1,69 @@
 import matplotlib.pyplot as plt
 import re
+import os
+import sys
 
-def parse_throughput(filename):
-    with open(filename, 'r') as file:
-        content = file.read()
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.results_store import ResultsStore
+from common.text_results import checkpoint_path, iter_lines, load_checkpoint, save_checkpoint
 
-    device_pattern = re.compile(r"Device Name: (.+?)\nDevice IP: .+?\n(.*?)\niperf Done\.", re.DOTALL)
+def device_label(device_name, client_name):
+    return device_name if client_name in (None, "local") else f"{client_name} -> {device_name}"
+
+def iter_device_records(filename, offset=0):
+    # Streams the results file line by line and yields (device_label, throughputs, end_offset) per device block.
+    # Blocks hold the receiver throughput of every repetition ("Receiver X Mbits/sec", iperf3 JSON engine)
+    # or, in results written by older versions, the raw iperf3 text output
     throughput_pattern = re.compile(r"\[\s+\d\]\s+\d+\.\d{2}-\d+\.\d{2}\s+sec\s+\d+(\.\d+)?\s([G|M])Bytes\s+(\d+(\.\d+)?)\s([G|M])bits/sec")
+    receiver_pattern = re.compile(r"Repetition \d+: .*Receiver ([\d.]+) Mbits/sec")
+    device_name, client_name, throughputs = None, None, []
 
-    results = {}
+    for line, end_offset in iter_lines(filename, offset):
+        if line.startswith("Device Name: "):
+            device_name, client_name, throughputs = line[len("Device Name: "):], None, []
+        elif device_name is not None:
+            t_match = throughput_pattern.search(line)
+            r_match = receiver_pattern.match(line)
+            if line.startswith("Client: "):
+                client_name = line[len("Client: "):]
+            elif r_match:
+                throughputs.append(float(r_match.group(1)))
+            elif line.startswith("Average Throughput: "):
+                yield device_label(device_name, client_name), throughputs, end_offset
+                device_name = None
+            elif t_match:
+                value, unit = float(t_match.group(3)), t_match.group(5)
+                # Convert to Mbits/sec if necessary
+                if unit == "G":
+                    value *= 1000
+                throughputs.append(value)
+            elif line.startswith("iperf Done."):
+                yield device_name, throughputs, end_offset
+                device_name = None
 
-    for match in device_pattern.findall(content):
-        device_name, throughput_data = match
-        throughputs = []
-        
-        for t_match in throughput_pattern.findall(throughput_data):
-            value, _, unit = float(t_match[2]), t_match[3], t_match[4]
-            # Convert to Mbits/sec if necessary
-            if unit == "G":
-                value *= 1000
-            throughputs.append(value)
+def parse_throughput(filename, checkpoint_file=None):
+    # Only the device blocks appended since the last checkpoint are parsed
+    checkpoint = load_checkpoint(filename, checkpoint_file)
+    results = checkpoint["results"]
 
-        avg_throughput = sum(throughputs) / len(throughputs) if throughputs else 0
-        results[device_name] = avg_throughput
+    for device_name, throughputs, end_offset in iter_device_records(filename, checkpoint["offset"]):
+        results[device_name] = sum(throughputs) / len(throughputs) if throughputs else 0
+        checkpoint["offset"] = end_offset
 
+    save_checkpoint(filename, checkpoint_file, checkpoint)
     return results
 
+def load_throughput_from_store(store_dir, run_id=None):
+    # Same {device: average Mbit/s} layout as parse_throughput, read through the store index (latest run by default)
+    store = ResultsStore(store_dir)
+    run_id = run_id or store.latest_run("throughput")
+    throughputs = {}
+    for record in store.records(run_id=run_id, kpi="throughput"):
+        if "error" not in record["fields"]:
+            label = device_label(record["device"], record["fields"].get("client"))
+            throughputs.setdefault(label, []).append(record["fields"]["received_mbps"])
+    return {label: sum(values) / len(values) for label, values in throughputs.items()}
+
 def plot_throughput(devices_data, output_file):
     plt.figure(figsize=(12, 7))
 
@@ -47,8 +85,21 @@ def plot_throughput(devices_data, output_file):
 
     # Save the figure to the specified file
     plt.savefig(output_file)
+    plt.close()
+
+def render(results_dir, figures_dir, store_dir=None):
+    # Figures of this KPI from the store when it holds throughput records, else from the text results
+    store_dir = store_dir or os.path.join(results_dir, "store")
+    if os.path.exists(os.path.join(store_dir, "index.jsonl")) and ResultsStore(store_dir).latest_run("throughput"):
+        results = load_throughput_from_store(store_dir)
+    else:
+        results_file = os.path.join(results_dir, "network_throughput.txt")
+        results = parse_throughput(results_file, checkpoint_path(results_file))
+    output_file = os.path.join(figures_dir, "network_throughput.png")
+    plot_throughput(results, output_file)
+    return [output_file]
 
 
 if __name__ == "__main__":
-    results = parse_throughput('../../results/network_throughput.txt')
-    plot_throughput(results, "../../figures/network_throughput.png")
+    base_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+    render(os.path.join(base_dir, "results"), os.path.join(base_dir, "figures"))
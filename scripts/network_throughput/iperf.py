@@ -0,0 +1,108 @@
+import json
+import shlex
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from common.instrumentation import HARNESS, run_command
+
+# iperf3 engine: runs the client with -J and reads the structured JSON report instead of scraping its text output.
+# A test is a (client, server) pair. client None runs iperf3 from this machine, any other client runs it through
+# client_command (e.g. "ssh {client}") so device-to-device pairs can be measured from here.
+
+MODES = ("normal", "reverse", "bidir")
+PROTOCOLS = ("tcp", "udp")
+
+def build_iperf_command(server_ip, duration, streams=1, mode="normal", protocol="tcp", bitrate="", interval=1.0,
+                        port=5201, client_ip=None, client_command="ssh {client}"):
+    cmd = ["iperf3", "-c", server_ip, "-p", str(port), "-t", str(duration), "-P", str(streams),
+           "-i", str(interval), "-J"]
+    if mode == "reverse":
+        cmd.append("-R")
+    elif mode == "bidir":
+        cmd.append("--bidir")
+    if protocol == "udp":
+        # Without a target bitrate iperf3 sends UDP at 1 Mbit/s only
+        cmd += ["-u", "-b", bitrate or "0"]
+    elif bitrate:
+        cmd += ["-b", bitrate]
+    if client_ip is not None:
+        cmd = shlex.split(client_command.format(client=client_ip)) + cmd
+    return cmd
+
+def run_iperf(cmd, timeout):
+    # iperf3 -J reports its errors in the JSON too, with a non-zero exit code
+    process = run_command(cmd, timeout)
+    try:
+        with HARNESS.phase("parse"):
+            report = json.loads(process.stdout)
+    except ValueError:
+        raise RuntimeError((process.stderr or process.stdout).strip() or f"iperf3 exited with code {process.returncode}")
+    if report.get("error"):
+        raise RuntimeError(report["error"])
+    return report
+
+def bits_to_mbits(summary):
+    return summary.get("bits_per_second", 0) / 1e6 if summary else 0.0
+
+@HARNESS.timed("parse")
+def parse_iperf_report(report):
+    # Throughput in Mbit/s. "intervals" is the throughput of every reporting interval (all streams summed) as the client
+    # saw it: the sender's view in a normal test, the receiver's with reverse. The _reverse keys are the second
+    # direction of a bidirectional test. retransmits is None when iperf3 doesn't count them (UDP, non-Linux senders)
+    end = report.get("end", {})
+    # UDP reports have a single "sum" (older iperf3) or sum_sent/sum_received like TCP
+    sent = end.get("sum_sent") or end.get("sum", {})
+    received = end.get("sum_received") or end.get("sum", {})
+    result = {
+        "streams": report.get("start", {}).get("test_start", {}).get("num_streams", len(end.get("streams", []))),
+        "sent_mbps": bits_to_mbits(sent),
+        "received_mbps": bits_to_mbits(received),
+        "retransmits": sent.get("retransmits"),
+        "jitter_ms": end.get("sum", {}).get("jitter_ms", received.get("jitter_ms")),
+        "lost_percent": end.get("sum", {}).get("lost_percent", received.get("lost_percent")),
+        "intervals": [bits_to_mbits(interval.get("sum")) for interval in report.get("intervals", [])],
+    }
+    if "sum_sent_bidir_reverse" in end:
+        result["reverse_sent_mbps"] = bits_to_mbits(end["sum_sent_bidir_reverse"])
+        result["reverse_received_mbps"] = bits_to_mbits(end.get("sum_received_bidir_reverse"))
+        result["reverse_intervals"] = [bits_to_mbits(interval.get("sum_bidir_reverse"))
+                                       for interval in report.get("intervals", [])]
+    return result
+
+def measure_iperf(server_ip, duration, repetitions, client_ip=None, **options):
+    # One parsed report per repetition, or {"error": message} when the test failed
+    cmd = build_iperf_command(server_ip, duration, client_ip=client_ip, **options)
+    results = []
+    for _ in range(repetitions):
+        try:
+            results.append(parse_iperf_report(run_iperf(cmd, duration + 30)))
+        except (RuntimeError, subprocess.TimeoutExpired, OSError) as e:
+            results.append({"error": str(e)})
+    return results
+
+def star_rounds(devices):
+    # Every test has this machine as the client, so they would compete for its link: one test per round
+    return [[(None, device_name)] for device_name in devices]
+
+def mesh_rounds(devices):
+    # Round-robin schedule (circle method): every pair of devices is tested once, and no device is in
+    # two tests of the same round, so the tests of a round don't share an endpoint and run concurrently.
+    # n devices take n - 1 rounds (n if odd) instead of n * (n - 1) / 2 sequential tests
+    names = list(devices)
+    if len(names) % 2:
+        names.append(None)
+    rounds = []
+    for _ in range(len(names) - 1):
+        pairs = [(names[index], names[-1 - index]) for index in range(len(names) // 2)]
+        rounds.append([(client, server) for client, server in pairs if client is not None and server is not None])
+        names = [names[0], names[-1]] + names[1:-1]
+    return [pairs for pairs in rounds if pairs]
+
+def run_rounds(rounds, measure):
+    # measure(client_name, server_name) is called for every pair. The pairs of a round run concurrently,
+    # rounds one after another. Yields (client_name, server_name, result) in schedule order
+    for pairs in rounds:
+        with ThreadPoolExecutor(max_workers=len(pairs)) as executor:
+            futures = [(client, server, executor.submit(measure, client, server)) for client, server in pairs]
+            for client, server, future in futures:
+                yield client, server, future.result()
@@ -1,115 +1,182 @@
-import subprocess
 import os
-import configparser
-import re
 import datetime
-import pdb
+import shutil
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common.config import (config_path, load_config, read_layers, script_config, write_completion_layer_notice,
+                           write_starting_layer_notice)
+from common.instrumentation import HARNESS, report_overhead, report_usage
+from common.kpi import Device, Kpi, Record, store_records
+from common.results_store import ResultsStore, new_run_id
+from iperf import MODES, PROTOCOLS, measure_iperf, mesh_rounds, run_rounds, star_rounds
+from tcp_throughput import measure_tcp_throughput
+
+def read_options(section, topology='star'):
+    # Measurement options, shared with the benchmark runner's [throughput] section
+    options = {
+        "repetitions": int(section.get('repetitions')),
+        "duration": int(section.get('duration')),
+        "engine": select_engine(section.get('engine', 'auto').strip(), topology),
+        "builtin_port": int(section.get('builtin_port', 5202)),
+        "iperf": {
+            "streams": int(section.get('streams', 1)),
+            "mode": section.get('mode', 'normal').strip(),
+            "protocol": section.get('protocol', 'tcp').strip(),
+            "bitrate": section.get('bitrate', '').strip(),
+            "interval": float(section.get('interval', 1)),
+            "port": int(section.get('port', 5201)),
+            "client_command": section.get('client_command', 'ssh {client}').strip(),
+        },
+    }
+    if options['iperf']['mode'] not in MODES:
+        raise ValueError(f"Unknown mode '{options['iperf']['mode']}'. Available: {', '.join(MODES)}")
+    if options['iperf']['protocol'] not in PROTOCOLS:
+        raise ValueError(f"Unknown protocol '{options['iperf']['protocol']}'. Available: {', '.join(PROTOCOLS)}")
+    if options['engine'] not in ('iperf3', 'builtin'):
+        raise ValueError(f"Unknown engine '{options['engine']}'. Available: auto, iperf3, builtin")
+    if options['engine'] == 'builtin' and (topology == 'mesh' or options['iperf']['protocol'] == 'udp'):
+        raise ValueError("The built-in engine only measures TCP from this machine (topology = star, protocol = tcp)")
+    return options
 
 def read_config(filename):
-    config = configparser.ConfigParser()
-    config.read(filename)
+    config = load_config(filename)
     
-    layers = [layer.strip() for layer in config['general'].get('layers').split(',')]
+    topology = config['general'].get('topology', 'star').strip()
+    if topology not in ('star', 'mesh'):
+        raise ValueError(f"Unknown topology '{topology}'. Available: star, mesh")
     variables = {
-        "results_file": config['general'].get('results_file', ''),
-        "repetitions": int(config['general'].get('repetitions')),
-        "duration": int(config['general'].get('duration')),
-        "layers": layers
+        "results_file": config_path(filename, config['general'].get('results_file', '')),
+        "topology": topology,
+        "store_dir": config_path(filename, config['general'].get('store_dir', '')),
+        "text_results": config['general'].getboolean('text_results', True),
+        "instrumentation": config['general'].getboolean('instrumentation', False),
+        **read_options(config['general'], topology)
     }
-
-    for layer in layers:
-        variables[layer] = {k.replace("_ip", ""): v for k, v in config[layer].items()}
-
+    variables.update(read_layers(config))
     return variables
 
-def measure_throughput(server_ip, duration, repetitions):
-    results = []
-
-    for _ in range(repetitions):
-        try:
-            cmd = ["iperf3", "-c", server_ip, "-t", str(duration)]
-            result = subprocess.check_output(cmd, stderr=subprocess.STDOUT, universal_newlines=True)
-            results.append(result)
-        except subprocess.CalledProcessError as e:
-            results.append(e.output)
-    return "\n".join(results)
-
-# TODO Fix regex pattern
-# def extract_bandwidth_from_output(iperf_output):
-#     bandwidth_pattern = re.compile(r"\[\s+\d+\]\s+\d+\.\d+-\d+\.\d+\s+sec\s+\d+\s+\w+Bytes\s+(\d+\.\d+)\s+(\wbits/sec)\s+receiver")
-#     bandwidths = []
-    
-#     for line in iperf_output.splitlines():
-#         match = bandwidth_pattern.search(line)
-#         if match:
-#             value, unit = float(match.group(1)), match.group(2)
-
-#             # Convert to Mbits/sec if necessary
-#             if unit == "Kbits/sec":
-#                 value /= 1000
-#             elif unit == "Gbits/sec":
-#                 value *= 1000
-#             # Add other potential conversions if needed
-
-#             # pdb.set_trace()
-
-#             bandwidths.append(value)
-
-#     return bandwidths
-    
-def write_results_to_file(results_file, device_name, device_ip, iperf_output):
-    # bandwidths = extract_bandwidth_from_output(iperf_output)
-    # bandwidths = iperf_output
-    # total_avg_bandwidth = sum(bandwidths) / len(bandwidths) if bandwidths else 0
-
-    # results = [
-    #     f"Device Name: {device_name}",
-    #     f"Device IP: {device_ip}",
-    # ]
-    # results.append(f"\nTotal Average Bandwidth: {total_avg_bandwidth:.3f} Mbits/sec")
-
-    # with open(results_file, "a") as file:
-    #     file.write("-------------------------\n")
-    #     file.write("\n".join(results) + "\n\n")
-
+def select_engine(engine, topology):
+    # auto: iperf3 when it's installed here, the built-in TCP tester otherwise.
+    # Mesh clients run on the devices, where only iperf3 can be assumed
+    if engine == 'auto':
+        return 'iperf3' if topology == 'mesh' or shutil.which("iperf3") else 'builtin'
+    return engine
+
+def measure_throughput(server_ip, duration, repetitions, client_ip=None, engine='iperf3', builtin_port=5202, **options):
+    # One result per repetition: sender/receiver throughput (Mbit/s), retransmits, UDP jitter/loss
+    # and the per-interval throughput, parsed from iperf3's JSON report or measured by the built-in tester
+    if engine == 'builtin':
+        with HARNESS.phase("probe"):
+            return measure_tcp_throughput(server_ip, duration, repetitions, options['streams'], options['mode'],
+                                          options['interval'], builtin_port)
+    return measure_iperf(server_ip, duration, repetitions, client_ip=client_ip, **options)
+
+@HARNESS.timed("write")
+def write_results_to_file(results_file, device_name, device_ip, results, client_name="local"):
     with open(results_file, "a") as file:
-        # file.write("\n".join(results) + "\n\n")
         file.write(f"Device Name: {device_name}\n")
         file.write(f"Device IP: {device_ip}\n")
-        file.write(iperf_output)
-
-def write_starting_layer_notice(results_file, category):
-    with open(results_file, "a") as file:
-        file.write(f"[Starting tests for {category.replace('-', ' ').title()}]\n")
-        file.write("-----------------------------------\n")
-
-def write_completion_layer_notice(results_file, category):
-    with open(results_file, "a") as file:
-        file.write("-----------------------------------\n")
-        file.write(f"[Completed tests for {category.replace('-', ' ').title()}]\n\n")
+        file.write(f"Client: {client_name}\n")
+        for index, result in enumerate(results):
+            if "error" in result:
+                file.write(f"Repetition {index + 1}: Error: {result['error']}\n")
+                continue
+            file.write(f"Repetition {index + 1}: Sender {result['sent_mbps']:.3f} Mbits/sec, "
+                       f"Receiver {result['received_mbps']:.3f} Mbits/sec, "
+                       f"Retransmits {'n/a' if result['retransmits'] is None else result['retransmits']}, "
+                       f"Streams {result['streams']}\n")
+            if "reverse_received_mbps" in result:
+                file.write(f"Reverse: Sender {result['reverse_sent_mbps']:.3f} Mbits/sec, "
+                           f"Receiver {result['reverse_received_mbps']:.3f} Mbits/sec\n")
+            if result['jitter_ms'] is not None:
+                file.write(f"UDP Jitter: {result['jitter_ms']:.3f} ms, Lost: {result['lost_percent']:.2f}%\n")
+            file.write(f"Interval Throughput: {', '.join(f'{value:.1f}' for value in result['intervals'])} Mbits/sec\n")
+
+        received = [result['received_mbps'] for result in results if "error" not in result]
+        total_avg_bandwidth = sum(received) / len(received) if received else 0
+        file.write(f"Average Throughput: {total_avg_bandwidth:.3f} Mbits/sec\n\n")
+
+def throughput_records(results, client_name, options):
+    records = []
+    for index, result in enumerate(results):
+        fields = {key: value for key, value in result.items() if not key.endswith("intervals")}
+        records.append(Record("throughput", result.get("intervals", []), "Mbit/s",
+                              dict(client=client_name, repetition=index + 1, mode=options['mode'],
+                                   protocol=options['protocol'], **fields)))
+    return records
+
+def store_results(store, run_id, category, device_name, device_ip, results, client_name, options):
+    store_records(store, run_id, Device(category, device_name, device_ip), throughput_records(results, client_name, options))
+
+class ThroughputKpi(Kpi):
+    # Saturates the link of this machine, which every other measurement goes through
+    name = "throughput"
+    exclusive = True
+
+    @classmethod
+    def read_options(cls, section):
+        return read_options(section)
+
+    def measure(self, device):
+        options = self.options
+        results = measure_throughput(device.ip, options['duration'], options['repetitions'], None, options['engine'],
+                                     options['builtin_port'], **options['iperf'])
+        return throughput_records(results, "local", options['iperf'])
 
 
 if __name__ == "__main__":
     try:
-        config = read_config("config.cfg")
+        config = read_config(script_config(__file__))
+        store = ResultsStore(config['store_dir']) if config['store_dir'] else None
+        run_id = new_run_id(__file__)
 
         # Write the initial lines to the results file
         script_name = os.path.basename(__file__)
         current_date = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-        with open(config['results_file'], "a") as file:
-            file.write(f"Running {script_name} on {current_date}\n")
-            file.write(f"(Configuration --> Duration: {config['duration']} seconds, Repetitions: {config['repetitions']})\n")
-            file.write(f"{'*' * 60}\n\n")
-
-        # Run the script in the devices specified in the config file
+        results_file = config['results_file'] if config['text_results'] else None
+        if config['instrumentation']:
+            HARNESS.start()
+
+        if config['text_results']:
+            with open(config['results_file'], "a") as file:
+                file.write(f"Running {script_name} on {current_date}\n")
+                file.write(f"(Configuration --> Duration: {config['duration']} seconds, Repetitions: {config['repetitions']})\n")
+                file.write(f"{'*' * 60}\n\n")
+
+        # Run the script in the devices specified in the config file.
+        # star: from this machine to every device, one at a time. mesh: between every pair of devices of a layer,
+        # running the pairs that don't share a device concurrently
         for category in config.get('layers', []):
-            write_starting_layer_notice(config['results_file'], category)
-            for device_name, device_ip in config[category].items():
-                throughput_results = measure_throughput(device_ip, config['duration'], config['repetitions'])
-                write_results_to_file(config['results_file'], device_name, device_ip, throughput_results)
-            write_completion_layer_notice(config['results_file'], category)
-        print("Script successfully executed. Results stored in: " +config['results_file'])
+            if config['text_results']:
+                write_starting_layer_notice(config['results_file'], category)
+            devices = config[category]
+            rounds = mesh_rounds(devices) if config['topology'] == 'mesh' else star_rounds(devices)
+
+            def measure(client, server):
+                # Mesh pairs run in their own threads, each pair timed under its own scope
+                with HARNESS.scope((category, client, server)):
+                    return measure_throughput(devices[server], config['duration'], config['repetitions'], devices.get(client),
+                                              config['engine'], config['builtin_port'], **config['iperf'])
+
+            for client, device_name, throughput_results in run_rounds(rounds, measure):
+                client_name = client or "local"
+                with HARNESS.scope((category, client, device_name)):
+                    if store is not None:
+                        store_results(store, run_id, category, device_name, devices[device_name], throughput_results,
+                                      client_name, config['iperf'])
+                    if config['text_results']:
+                        write_results_to_file(config['results_file'], device_name, devices[device_name], throughput_results,
+                                              client_name)
+                if config['instrumentation']:
+                    report_overhead((category, client, device_name), Device(category, device_name, devices[device_name]),
+                                    results_file, store, run_id, client=client_name)
+            if config['text_results']:
+                write_completion_layer_notice(config['results_file'], category)
+        if config['instrumentation']:
+            report_usage(Device("local", "harness", ""), results_file, store, run_id)
+        print(f"Script successfully executed. Results stored in: {config['store_dir'] or config['results_file']} (run {run_id})")
 
     except Exception as e:
         print(f"Error: {e}")
@@ -0,0 +1,259 @@
+import argparse
+import asyncio
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+
+# Built-in TCP throughput tester, used when iperf3 isn't installed (engine = auto/builtin).
+# Every stream is one TCP connection opening with a header: magic, direction and duration.
+#   direction 0: the client sends for `duration`, half-closes, and the server answers with the bytes it received
+#   direction 1: the server sends for `duration` and closes, the client counts what it receives
+# Data is sent with sendfile() from a preallocated file (zero-copy) and received with recv_into() into a
+# preallocated buffer, so the tester does no per-chunk allocation or copy in Python.
+#
+# Run the server on the target devices: python tcp_throughput.py --port 5202
+
+MAGIC = b"BCDT"
+HEADER = struct.Struct("!4sBd")
+COUNT = struct.Struct("!Q")
+BUFFER_SIZE = 1024 * 1024  # Bytes per sendfile()/recv_into() call
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024
+MODES = ("normal", "reverse", "bidir")
+
+def tune_socket(sock):
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    for option in (socket.SO_SNDBUF, socket.SO_RCVBUF):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, option, SOCKET_BUFFER_SIZE)
+        except OSError:
+            pass
+    sock.setblocking(False)
+
+def total_retransmits(sock):
+    # tcpi_total_retrans from struct tcp_info (Linux): 8 bytes of flags then u32 fields, it's the 24th
+    if not hasattr(socket, "TCP_INFO"):
+        return None
+    try:
+        info = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 104)
+    except OSError:
+        return None
+    return struct.unpack_from("I", info, 100)[0] if len(info) >= 104 else None
+
+def payload_file(size):
+    # The data sent by every stream: `size` bytes in an unlinked temporary file, kept in the page cache
+    file = tempfile.TemporaryFile()
+    file.write(os.urandom(size))
+    file.flush()
+    return file
+
+async def send_for(loop, sock, file, size, deadline, counter, index):
+    while time.monotonic() < deadline:
+        counter[index] += await loop.sock_sendfile(sock, file, 0, size)
+
+async def receive_all(loop, sock, view, counter, index):
+    while True:
+        received = await loop.sock_recv_into(sock, view)
+        if not received:
+            return
+        counter[index] += received
+
+async def read_exactly(loop, sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = await loop.sock_recv(sock, size - len(data))
+        if not chunk:
+            raise ConnectionResetError("Connection closed by the peer")
+        data += chunk
+    return data
+
+class ThroughputServer:
+    def __init__(self, host="0.0.0.0", port=5202, buffer_size=BUFFER_SIZE):
+        self.host = host
+        self.port = port
+        self.buffer_size = buffer_size
+        self._loop = None
+        self._thread = None
+
+    async def handle(self, sock):
+        loop = asyncio.get_running_loop()
+        tune_socket(sock)
+        try:
+            magic, direction, duration = HEADER.unpack(await read_exactly(loop, sock, HEADER.size))
+            if magic != MAGIC:
+                return
+            counter = [0]
+            if direction == 0:
+                await receive_all(loop, sock, memoryview(bytearray(self.buffer_size)), counter, 0)
+                await loop.sock_sendall(sock, COUNT.pack(counter[0]))
+            else:
+                with payload_file(self.buffer_size) as file:
+                    await send_for(loop, sock, file, self.buffer_size, time.monotonic() + duration, counter, 0)
+        except (OSError, struct.error):
+            pass
+        finally:
+            sock.close()
+
+    async def serve(self, ready=None):
+        loop = asyncio.get_running_loop()
+        family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+        server = socket.socket(family, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((self.host, self.port))
+        server.listen(128)
+        server.setblocking(False)
+        self.port = server.getsockname()[1]
+        if ready is not None:
+            ready.set()
+        try:
+            while True:
+                sock, _ = await loop.sock_accept(server)
+                loop.create_task(self.handle(sock))
+        finally:
+            server.close()
+
+    def start(self):
+        # Serves from a background thread until shutdown(), e.g. for loopback tests
+        ready = threading.Event()
+        self._loop = asyncio.new_event_loop()
+        self._task = self._loop.create_task(self.serve(ready))
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def _run(self):
+        try:
+            self._loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            pass
+
+    def shutdown(self):
+        self._loop.call_soon_threadsafe(self._task.cancel)
+        self._thread.join()
+        self._loop.close()
+
+async def run_test(server_ip, duration, streams, mode, interval, port, buffer_size):
+    loop = asyncio.get_running_loop()
+    directions = {"normal": [0] * streams, "reverse": [1] * streams, "bidir": [0] * streams + [1] * streams}[mode]
+    address = socket.getaddrinfo(server_ip, port, type=socket.SOCK_STREAM)[0]
+    counter = [0] * len(directions)
+    sockets = []
+    for direction in directions:
+        sock = socket.socket(address[0], socket.SOCK_STREAM)
+        tune_socket(sock)
+        await loop.sock_connect(sock, address[4])
+        await loop.sock_sendall(sock, HEADER.pack(MAGIC, direction, duration))
+        sockets.append(sock)
+
+    # Per-interval byte counters, sampled by a ticker while the streams run
+    snapshots = []
+    async def tick(start):
+        while True:
+            await asyncio.sleep(start + (len(snapshots) + 1) * interval - time.monotonic())
+            snapshots.append(list(counter))
+
+    async def forward(index, sock, file):
+        await send_for(loop, sock, file, buffer_size, deadline, counter, index)
+        sent_seconds = time.monotonic() - start
+        retransmits = total_retransmits(sock)
+        sock.shutdown(socket.SHUT_WR)
+        received = COUNT.unpack(await read_exactly(loop, sock, COUNT.size))[0]
+        return sent_seconds, time.monotonic() - start, received, retransmits
+
+    async def backward(index, sock):
+        # Buffers can't be shared between streams receiving at the same time
+        await receive_all(loop, sock, memoryview(bytearray(buffer_size)), counter, index)
+        return time.monotonic() - start
+
+    with payload_file(buffer_size) as file:
+        start = time.monotonic()
+        deadline = start + duration
+        ticker = loop.create_task(tick(start))
+        try:
+            results = await asyncio.gather(*[forward(index, sock, file) if direction == 0 else backward(index, sock)
+                                             for index, (direction, sock) in enumerate(zip(directions, sockets))])
+        finally:
+            ticker.cancel()
+            for sock in sockets:
+                sock.close()
+
+    return directions, counter, snapshots, results
+
+def summarize_test(directions, counter, snapshots, results, duration, interval):
+    # Same keys as iperf.parse_iperf_report. The forward direction is client -> server, except in reverse mode
+    def intervals(wanted):
+        indexes = [index for index, direction in enumerate(directions) if direction == wanted]
+        totals = [0] + [sum(snapshot[index] for index in indexes) for snapshot in snapshots]
+        return [(after - before) * 8 / interval / 1e6 for before, after in zip(totals, totals[1:])]
+
+    def direction_summary(wanted):
+        indexes = [index for index, direction in enumerate(directions) if direction == wanted]
+        if wanted == 0:
+            sent_seconds = max(results[index][0] for index in indexes)
+            received_seconds = max(results[index][1] for index in indexes)
+            received = sum(results[index][2] for index in indexes)
+            retransmits = [results[index][3] for index in indexes]
+            retransmits = None if None in retransmits else sum(retransmits)
+            return sum(counter[index] for index in indexes) * 8 / sent_seconds / 1e6, \
+                received * 8 / received_seconds / 1e6, retransmits
+        # Everything the server wrote before closing is received, but its send time is only known as `duration`
+        received = sum(counter[index] for index in indexes)
+        received_seconds = max(results[index] for index in indexes)
+        return received * 8 / duration / 1e6, received * 8 / received_seconds / 1e6, None
+
+    first = 1 if directions[0] == 1 else 0
+    sent_mbps, received_mbps, retransmits = direction_summary(first)
+    result = {
+        "streams": directions.count(first),
+        "sent_mbps": sent_mbps,
+        "received_mbps": received_mbps,
+        "retransmits": retransmits,
+        "jitter_ms": None,
+        "lost_percent": None,
+        "intervals": intervals(first),
+    }
+    if 1 in directions and 0 in directions:
+        result["reverse_sent_mbps"], result["reverse_received_mbps"], _ = direction_summary(1)
+        result["reverse_intervals"] = intervals(1)
+    return result
+
+def measure_tcp_throughput(server_ip, duration, repetitions, streams=1, mode="normal", interval=1.0, port=5202,
+                           buffer_size=BUFFER_SIZE):
+    # One result per repetition, or {"error": message} when the test failed
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode '{mode}'. Available: {', '.join(MODES)}")
+    results = []
+    for _ in range(repetitions):
+        try:
+            test = asyncio.run(asyncio.wait_for(run_test(server_ip, duration, streams, mode, interval, port, buffer_size),
+                                                duration + 30))
+            results.append(summarize_test(*test, duration, interval))
+        except (OSError, asyncio.TimeoutError) as e:
+            results.append({"error": str(e) or type(e).__name__})
+    return results
+
+
+if __name__ == "__main__":
+    # Run the server on a target device: python tcp_throughput.py --port 5202
+    # or measure from this machine: python tcp_throughput.py --client X.Y.Z.T -t 10 -P 4
+    parser = argparse.ArgumentParser(description="Built-in TCP throughput server/client (iperf3 fallback)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5202)
+    parser.add_argument("--client", help="Measure against this server instead of serving")
+    parser.add_argument("-t", "--duration", type=float, default=10)
+    parser.add_argument("-P", "--streams", type=int, default=1)
+    parser.add_argument("--mode", choices=MODES, default="normal")
+    args = parser.parse_args()
+
+    if args.client:
+        for result in measure_tcp_throughput(args.client, args.duration, 1, args.streams, args.mode, port=args.port):
+            print(result)
+    else:
+        print(f"TCP throughput server listening on {args.host}:{args.port} (pid {os.getpid()})")
+        try:
+            asyncio.run(ThroughputServer(args.host, args.port).serve())
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,247 @@
+import argparse
+import datetime
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common.histogram import LatencyHistogram
+from common.results_store import ResultsStore
+from common.stats import MAX_BOOTSTRAP_SIZE, bootstrap_median_change, holm_adjust, mann_whitney
+
+# Performance regression detection against pinned baselines in the results store:
+#   python regression.py pin [--run RUN_ID] [--kpis latency,throughput] [--devices pi1,pi2]
+#   python regression.py list
+#   python regression.py check [--run RUN_ID] [--alpha 0.01] [--min-effect 0.05] [--report report.json]
+# "pin" makes a run the baseline of every device/KPI it measured (by default the latest run of every KPI); baselines
+# are kept in <store_dir>/baselines.json. "check" compares the latest later run of every pinned device/KPI (or --run)
+# with its baseline, on the raw samples of all their repetitions, separately for every configuration (block size,
+# client, query class...).
+#
+# A comparison is a regression when the one-sided Mann-Whitney test finds the new samples worse (higher latency,
+# lower throughput) with a Holm-adjusted p-value below alpha, and the median moved at least min_effect the wrong way.
+# Small but significant shifts are reported without failing. The effect sizes are the relative median change, with its
+# bootstrap interval, and Cliff's delta.
+#
+# Exit status: 0 no regression, 1 at least one regression, 2 error or nothing to compare.
+
+BASELINES_FILE = "baselines.json"
+
+# Whether a higher value is worse, by KPI then by unit
+KPI_HIGHER_IS_WORSE = {
+    "latency": True, "insertion_time": True, "insert_batch_latency": True, "fsync_latency": True,
+    "throughput": False, "storage_throughput": False, "read_method_throughput": False, "cpu_ops_per_second": False,
+    "memory_read_bandwidth": False, "memory_write_bandwidth": False, "memory_copy_bandwidth": False,
+}
+UNIT_HIGHER_IS_WORSE = {"ms": True, "s": True, "Mbit/s": False, "MB/s": False, "ops/s": False}
+
+# Record fields telling apart configurations measured in the same run, compared separately
+VARIANT_FIELDS = ("client", "mode", "protocol", "pattern", "block_size", "queue_depth", "method", "writer", "batch_size",
+                  "concurrency", "ordered", "write_concern", "query_class", "index_mode")
+
+def higher_is_worse(kpi, unit):
+    return KPI_HIGHER_IS_WORSE.get(kpi, UNIT_HIGHER_IS_WORSE.get(unit))
+
+def baseline_key(layer, device, kpi):
+    return f"{layer}/{device}/{kpi}"
+
+def load_baselines(store_dir):
+    path = os.path.join(store_dir, BASELINES_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+def save_baselines(store_dir, baselines):
+    # Written aside then renamed, so an interrupted pin never leaves a truncated file
+    path = os.path.join(store_dir, BASELINES_FILE)
+    with open(path + ".tmp", "w") as file:
+        json.dump(baselines, file, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+def pin_baselines(store, run_id=None, kpis=None, devices=None):
+    # Pins run_id (by default the latest run of every KPI) for every device/KPI it measured. Returns the keys pinned
+    baselines = load_baselines(store.store_dir)
+    latest_runs = {}
+    pinned = []
+    for record in store.records(run_id=run_id):
+        kpi = record["kpi"]
+        if kpis is None and kpi not in KPI_HIGHER_IS_WORSE:
+            continue
+        if (kpis is not None and kpi not in kpis) or (devices is not None and record["device"] not in devices):
+            continue
+        if run_id is None and record["run_id"] != latest_runs.setdefault(kpi, store.latest_run(kpi)):
+            continue
+        if higher_is_worse(kpi, record["unit"]) is None:
+            raise ValueError(f"Don't know whether higher {kpi} ({record['unit']}) is better or worse")
+        key = baseline_key(record["layer"], record["device"], kpi)
+        if key not in pinned:
+            baselines[key] = {"run_id": record["run_id"], "pinned_at": datetime.datetime.now().isoformat(timespec="seconds")}
+            pinned.append(key)
+    save_baselines(store.store_dir, baselines)
+    return pinned
+
+def record_samples(store, record, rng):
+    # Raw samples of a record, NaN (lost) dropped. Records stored as histograms are expanded to their bucket values,
+    # a random subsample of them when they hold more than MAX_BOOTSTRAP_SIZE samples
+    if record["count"]:
+        samples = store.load(record)
+    elif "histogram" in record["fields"]:
+        histogram = LatencyHistogram.decode(record["fields"]["histogram"])
+        values, counts = histogram.buckets()
+        if counts.sum() > MAX_BOOTSTRAP_SIZE:
+            return rng.choice(values, MAX_BOOTSTRAP_SIZE, p=counts / counts.sum())
+        return np.repeat(values, counts)
+    elif "received_mbps" in record["fields"]:
+        samples = np.array([record["fields"]["received_mbps"]], dtype=np.float64)
+    else:
+        return np.empty(0)
+    return samples[~np.isnan(samples)]
+
+def variant_samples(store, run_id, layer, device, kpi, rng):
+    # {variant: (samples of every repetition, unit)}, variant being a tuple of (field, value)
+    variants = {}
+    for record in store.records(run_id=run_id, device=device, kpi=kpi):
+        if record["layer"] != layer or "error" in record["fields"]:
+            continue
+        variant = tuple((field, record["fields"][field]) for field in VARIANT_FIELDS if field in record["fields"])
+        samples, unit = variants.setdefault(variant, ([], record["unit"]))
+        samples.append(record_samples(store, record, rng))
+    return {variant: (np.concatenate(samples), unit) for variant, (samples, unit) in variants.items()}
+
+def candidate_run(store, layer, device, kpi, baseline_run, run_id=None):
+    # run_id if it measured the device/KPI, else the latest run that did after the baseline
+    runs = list(dict.fromkeys(record["run_id"] for record in store.records(kpi=kpi, device=device) if record["layer"] == layer))
+    if run_id is not None:
+        return run_id if run_id in runs and run_id != baseline_run else None
+    later = runs[runs.index(baseline_run) + 1:] if baseline_run in runs else []
+    return later[-1] if later else None
+
+def compare(store, baselines, run_id=None, kpis=None, alpha=0.01, min_effect=0.05, min_samples=5, confidence=0.95, seed=None):
+    # One result dict per pinned device/KPI/variant with a candidate run
+    rng = np.random.default_rng(seed)
+    results = []
+    for key, baseline in sorted(baselines.items()):
+        layer, device, kpi = key.rsplit("/", 2)
+        if kpis is not None and kpi not in kpis:
+            continue
+        candidate = candidate_run(store, layer, device, kpi, baseline["run_id"], run_id)
+        if candidate is None:
+            continue
+        baseline_variants = variant_samples(store, baseline["run_id"], layer, device, kpi, rng)
+        for variant, (samples, unit) in variant_samples(store, candidate, layer, device, kpi, rng).items():
+            if variant not in baseline_variants:
+                continue
+            baseline_samples = baseline_variants[variant][0]
+            worse_higher = higher_is_worse(kpi, unit)
+            test = mann_whitney(baseline_samples, samples)
+            change, interval = bootstrap_median_change(baseline_samples, samples, confidence, rng=rng)
+            results.append({
+                "layer": layer, "device": device, "kpi": kpi, "unit": unit, "variant": dict(variant),
+                "baseline_run": baseline["run_id"], "candidate_run": candidate,
+                "baseline_count": int(baseline_samples.size), "candidate_count": int(samples.size),
+                "baseline_median": float(np.median(baseline_samples)) if baseline_samples.size else float("nan"),
+                "candidate_median": float(np.median(samples)) if samples.size else float("nan"),
+                "median_change": change, "median_change_ci": interval, "cliffs_delta": test["cliffs_delta"],
+                # Worse and better are the two one-sided tests, in the direction of this KPI
+                "p_worse": test["p_greater"] if worse_higher else test["p_less"],
+                "p_better": test["p_less"] if worse_higher else test["p_greater"],
+                "higher_is_worse": worse_higher,
+            })
+
+    enough = [result for result in results if min(result["baseline_count"], result["candidate_count"]) >= min_samples]
+    if enough:
+        for result, p_worse, p_better in zip(enough, holm_adjust([result["p_worse"] for result in enough]),
+                                             holm_adjust([result["p_better"] for result in enough])):
+            result["p_worse_adjusted"], result["p_better_adjusted"] = float(p_worse), float(p_better)
+    for result in results:
+        worsening = result["median_change"] if result["higher_is_worse"] else -result["median_change"]
+        if "p_worse_adjusted" not in result:
+            result["verdict"] = "insufficient"
+        elif result["p_worse_adjusted"] < alpha and worsening >= min_effect:
+            result["verdict"] = "regression"
+        elif result["p_better_adjusted"] < alpha and -worsening >= min_effect:
+            result["verdict"] = "improvement"
+        elif result["p_worse_adjusted"] < alpha:
+            result["verdict"] = "minor regression"
+        else:
+            result["verdict"] = "unchanged"
+    return results
+
+def format_result(result):
+    variant = "".join(f" {field}={value}" for field, value in result["variant"].items())
+    low, high = result["median_change_ci"]
+    p_value = result.get("p_worse_adjusted", result["p_worse"])
+    return (f"[{result['layer']}] {result['device']} {result['kpi']}{variant}: {result['verdict'].upper()}, "
+            f"median {result['baseline_median']:.3f} -> {result['candidate_median']:.3f} {result['unit']} "
+            f"({result['median_change']:+.1%}, CI {low:+.1%} to {high:+.1%}), Cliff's delta {result['cliffs_delta']:+.2f}, "
+            f"p(worse) = {p_value:.2g}, {result['baseline_count']} vs {result['candidate_count']} samples "
+            f"({result['baseline_run']} -> {result['candidate_run']})")
+
+def json_safe(value):
+    # NaN (no samples, no interval) as null, which every JSON parser reads
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    if isinstance(value, (list, tuple)):
+        return [json_safe(item) for item in value]
+    if isinstance(value, dict):
+        return {key: json_safe(item) for key, item in value.items()}
+    return value
+
+def split_list(value):
+    return [item.strip() for item in value.split(",") if item.strip()] if value else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Detect performance regressions against pinned baseline runs")
+    parser.add_argument("--store-dir", default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "results", "store"))
+    commands = parser.add_subparsers(dest="command", required=True)
+    pin = commands.add_parser("pin", help="Pin a run as the baseline of the devices/KPIs it measured")
+    pin.add_argument("--run", help="Run id, the latest run of every KPI by default")
+    pin.add_argument("--kpis", help="Comma-separated KPIs, the ones with a known direction by default")
+    pin.add_argument("--devices", help="Comma-separated device names, all by default")
+    commands.add_parser("list", help="Show the pinned baselines")
+    check = commands.add_parser("check", help="Compare new runs with their baselines")
+    check.add_argument("--run", help="Run id to check, the latest run of every pinned device/KPI by default")
+    check.add_argument("--kpis", help="Comma-separated KPIs, every pinned one by default")
+    check.add_argument("--alpha", type=float, default=0.01, help="Significance level, after Holm correction")
+    check.add_argument("--min-effect", type=float, default=0.05, help="Smallest relative median change that fails the check")
+    check.add_argument("--min-samples", type=int, default=5, help="Fewer samples on either side can't be tested")
+    check.add_argument("--seed", type=int, help="Seed of the bootstrap, for reproducible intervals")
+    check.add_argument("--report", help="Also write the comparisons to this JSON file")
+    args = parser.parse_args()
+
+    try:
+        store = ResultsStore(args.store_dir)
+        if args.command == "pin":
+            pinned = pin_baselines(store, args.run, split_list(args.kpis), split_list(args.devices))
+            for key in pinned:
+                print(f"{key}: {load_baselines(args.store_dir)[key]['run_id']}")
+            if not pinned:
+                raise ValueError("No matching records to pin")
+            print(f"{len(pinned)} baselines pinned in: {os.path.join(args.store_dir, BASELINES_FILE)}")
+        elif args.command == "list":
+            for key, baseline in sorted(load_baselines(args.store_dir).items()):
+                print(f"{key}: {baseline['run_id']} (pinned {baseline['pinned_at']})")
+        else:
+            baselines = load_baselines(args.store_dir)
+            if not baselines:
+                raise ValueError("No baselines pinned, run 'regression.py pin' first")
+            results = compare(store, baselines, args.run, split_list(args.kpis), args.alpha, args.min_effect,
+                              args.min_samples, seed=args.seed)
+            for result in results:
+                print(format_result(result))
+            if args.report:
+                with open(args.report, "w") as file:
+                    json.dump(json_safe(results), file, indent=2)
+            regressions = sum(result["verdict"] == "regression" for result in results)
+            if not results:
+                raise ValueError("No new run to compare with the baselines")
+            print(f"{regressions} regressions in {len(results)} comparisons")
+            sys.exit(1 if regressions else 0)
+
+    except Exception as e:
+        print(f"Error: {e}")
+        sys.exit(2)
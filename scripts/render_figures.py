@@ -0,0 +1,212 @@
+import argparse
+import importlib
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Renders every figure in one go, without a display:
+#   python render_figures.py [--results-dir ../results] [--figures-dir ../figures] [--runs 5] [--workers N]
+# The figures of every KPI (the render() of its draw_figure.py) and charts comparing runs, layers and devices are drawn
+# in parallel worker processes. Workers switch matplotlib to the Agg backend before pyplot is first imported, and this
+# process never imports it, so nothing needs a display and startup stays fast. Every figure is closed once saved.
+#
+# Comparison charts, from the results store:
+#   latency_cdf_{device,layer,run}.png        latency CDFs from the stored histograms
+#   throughput_box_{device,layer,run}.png     throughput distributions (per-interval samples)
+#   cpu_stacked.png                           stacked CPU time series of every device of the latest run
+# "device" and "layer" compare the latest run, "run" the last --runs runs, every device merged.
+
+KPI_FIGURES = ("network_latency.draw_figure", "network_throughput.draw_figure", "resource_utilization.draw_figure")
+GROUPINGS = ("device", "layer", "run")
+CPU_COLUMNS = (("cpu_us", "User"), ("cpu_sy", "System"), ("cpu_wa", "I/O wait"), ("cpu_st", "Steal"))
+
+def use_agg():
+    # Worker initializer: before any pyplot import
+    import matplotlib
+    matplotlib.use("Agg")
+
+def selected_runs(store, kpi, by, runs):
+    all_runs = store.runs(kpi)
+    return all_runs[-runs:] if by == "run" else all_runs[-1:]
+
+def group_label(record, by):
+    if by == "run":
+        return record["run_id"]
+    if by == "layer":
+        return record["layer"]
+    return f"{record['layer']}/{record['device']}"
+
+def latency_histograms(store, by, runs):
+    # {label: merged histogram} of the latency records of the selected runs
+    from common.histogram import LatencyHistogram
+    histograms = {}
+    for run_id in selected_runs(store, "latency", by, runs):
+        for record in store.records(run_id=run_id, kpi="latency"):
+            histogram = histograms.setdefault(group_label(record, by), LatencyHistogram())
+            if "histogram" in record["fields"]:
+                histogram.add(LatencyHistogram.decode(record["fields"]["histogram"]))
+            else:
+                histogram.record_values(store.load(record))
+    return histograms
+
+def throughput_samples(store, by, runs):
+    # {label: Mbit/s samples}: the per-interval samples of every repetition, or its average when it has none
+    samples = {}
+    for run_id in selected_runs(store, "throughput", by, runs):
+        for record in store.records(run_id=run_id, kpi="throughput"):
+            if "error" in record["fields"]:
+                continue
+            values = store.load(record) if record["count"] else [record["fields"]["received_mbps"]]
+            samples.setdefault(group_label(record, by), []).extend(float(value) for value in values)
+    return samples
+
+def plot_latency_cdf(store_dir, by, runs, output_file):
+    import matplotlib.pyplot as plt
+    import numpy as np
+    from common.results_store import ResultsStore
+
+    histograms = latency_histograms(ResultsStore(store_dir), by, runs)
+    fig, ax = plt.subplots(figsize=(12, 7))
+    for label, histogram in histograms.items():
+        if not histogram.total_count:
+            continue
+        values, counts = histogram.buckets()
+        ax.step(values, np.cumsum(counts) / histogram.total_count, where="post", label=label)
+    ax.set_xscale("log")
+    ax.set_title(f"Network Latency CDF by {by}")
+    ax.set_xlabel("Latency (ms)")
+    ax.set_ylabel("Fraction of probes")
+    ax.grid(True, which="both", linestyle="--", linewidth=0.5)
+    ax.legend()
+    fig.savefig(output_file)
+    plt.close(fig)
+    return [output_file]
+
+def plot_throughput_box(store_dir, by, runs, output_file):
+    import matplotlib.pyplot as plt
+    from common.results_store import ResultsStore
+
+    samples = throughput_samples(ResultsStore(store_dir), by, runs)
+    fig, ax = plt.subplots(figsize=(12, 7))
+    ax.boxplot(list(samples.values()))
+    ax.set_xticks(range(1, len(samples) + 1), list(samples.keys()))
+    ax.set_title(f"Network Throughput by {by}")
+    ax.set_xlabel(by.capitalize())
+    ax.set_ylabel("Throughput (Mbits/sec)")
+    ax.grid(True, axis="y", linestyle="--", linewidth=0.5)
+    fig.autofmt_xdate()
+    fig.savefig(output_file)
+    plt.close(fig)
+    return [output_file]
+
+def cpu_series(store, run_id, layer, device, repetition=1):
+    # (time axis in s, label, {column: samples}) of one repetition, on the shared grid of a synchronized run if any
+    def load(kpi):
+        for record in store.records(run_id=run_id, device=device, kpi=kpi):
+            if record["layer"] == layer and record["fields"].get("repetition") == repetition:
+                return store.load(record)
+        return None
+
+    columns = {column: load(column) for column, _ in CPU_COLUMNS}
+    columns = {column: samples for column, samples in columns.items() if samples is not None}
+    aligned_time, timestamps = load("aligned_time"), load("timestamp")
+    if aligned_time is not None:
+        return aligned_time, "Time since the common start (s)", columns
+    if timestamps is not None:
+        return timestamps - timestamps[0], "Time (s)", columns
+    length = min(samples.size for samples in columns.values())
+    return list(range(length)), "Sample", columns
+
+def plot_cpu_stacked(store_dir, output_file):
+    import matplotlib.pyplot as plt
+    from common.results_store import ResultsStore
+
+    store = ResultsStore(store_dir)
+    run_id = store.latest_run("cpu_us")
+    devices = list(dict.fromkeys((record["layer"], record["device"]) for record in store.records(run_id=run_id, kpi="cpu_us")))
+    fig, axes = plt.subplots(len(devices), 1, figsize=(12, 2.5 * len(devices) + 1), sharex=True, squeeze=False)
+    for ax, (layer, device) in zip(axes[:, 0], devices):
+        times, xlabel, columns = cpu_series(store, run_id, layer, device)
+        length = min([len(times)] + [samples.size for samples in columns.values()])
+        ax.stackplot(times[:length], *[samples[:length] for samples in columns.values()],
+                     labels=[label for column, label in CPU_COLUMNS if column in columns], alpha=0.8)
+        ax.set_ylim(0, 100)
+        ax.set_ylabel("CPU (%)")
+        ax.set_title(f"[{layer}] {device}", fontsize="medium")
+        ax.grid(True, linestyle="--", linewidth=0.5)
+    axes[-1, 0].set_xlabel(xlabel)
+    axes[0, 0].legend(loc="upper right")
+    fig.suptitle(f"CPU Usage ({run_id}, repetition 1)")
+    fig.tight_layout()
+    fig.savefig(output_file)
+    plt.close(fig)
+    return [output_file]
+
+def render_kpi(module_name, results_dir, figures_dir, store_dir):
+    return importlib.import_module(module_name).render(results_dir, figures_dir, store_dir)
+
+def figure_jobs(results_dir, figures_dir, store_dir, runs):
+    # (description, function, arguments) of every figure the available results allow
+    from common.results_store import ResultsStore
+
+    jobs = [(module_name.split(".")[0], render_kpi, (module_name, results_dir, figures_dir, store_dir))
+            for module_name in KPI_FIGURES]
+    if not os.path.exists(os.path.join(store_dir, "index.jsonl")):
+        return jobs
+    store = ResultsStore(store_dir)
+    for by in GROUPINGS:
+        if store.latest_run("latency"):
+            jobs.append((f"latency CDF by {by}", plot_latency_cdf,
+                         (store_dir, by, runs, os.path.join(figures_dir, f"latency_cdf_{by}.png"))))
+        if store.latest_run("throughput"):
+            jobs.append((f"throughput box plot by {by}", plot_throughput_box,
+                         (store_dir, by, runs, os.path.join(figures_dir, f"throughput_box_{by}.png"))))
+    if store.latest_run("cpu_us"):
+        jobs.append(("stacked CPU time series", plot_cpu_stacked, (store_dir, os.path.join(figures_dir, "cpu_stacked.png"))))
+    return jobs
+
+def render_all(jobs, workers=None):
+    # Returns {description: files written, or the exception raised}
+    outcomes = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=use_agg) as executor:
+        futures = {executor.submit(function, *arguments): description for description, function, arguments in jobs}
+        for future in as_completed(futures):
+            try:
+                outcomes[futures[future]] = future.result()
+            except Exception as e:
+                outcomes[futures[future]] = e
+    return outcomes
+
+
+if __name__ == "__main__":
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description="Render every KPI and comparison figure in parallel, headless")
+    parser.add_argument("--results-dir", default=os.path.join(base_dir, "results"))
+    parser.add_argument("--store-dir", help="Results store, <results-dir>/store by default")
+    parser.add_argument("--figures-dir", default=os.path.join(base_dir, "figures"))
+    parser.add_argument("--runs", type=int, default=5, help="Runs compared in the *_run.png charts")
+    parser.add_argument("--workers", type=int, help="Worker processes, one per CPU by default")
+    args = parser.parse_args()
+
+    try:
+        results_dir = os.path.abspath(args.results_dir)
+        store_dir = os.path.abspath(args.store_dir or os.path.join(results_dir, "store"))
+        figures_dir = os.path.abspath(args.figures_dir)
+        os.makedirs(figures_dir, exist_ok=True)
+
+        jobs = figure_jobs(results_dir, figures_dir, store_dir, args.runs)
+        outcomes = render_all(jobs, args.workers)
+        failed = 0
+        for description, _, _ in jobs:
+            outcome = outcomes[description]
+            if isinstance(outcome, Exception):
+                failed += 1
+                print(f"{description}: failed: {outcome}")
+            else:
+                print(f"{description}: {', '.join(os.path.relpath(path) for path in outcome)}")
+        print(f"{len(jobs) - failed}/{len(jobs)} figure jobs rendered in: {figures_dir}")
+
+    except Exception as e:
+        print(f"Error: {e}")
@@ -0,0 +1,154 @@
+import argparse
+import json
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common.clock import wait_until
+from resource_utilization import stress_and_capture
+
+# Resource utilization agent: runs the stress + capture cycle of resource_utilization.py on the device it runs on,
+# when coordinator.py asks for it. Start it on every device to measure:
+#   python agent.py --port 5300
+#
+# Protocol (HTTP/1.0, JSON):
+#   GET  /info  {"hostname": ..., "cpus": ...}
+#   GET  /time  {"time": wall clock of the agent}, to estimate its clock offset (see common/clock.py)
+#   POST /run   body: keyword arguments of stress_and_capture(), and optionally start_at, the agent's wall time at which
+#               to start. The response is streamed as JSON lines:
+#               {"type": "sample", "sample": {column: value}} for every sample of the proc sampler as it's taken, with
+#               its wall time in "wall_time", then {"type": "result", "metrics": ..., "series": ...} ("series" only
+#               with the vmstat sampler, whose samples aren't streamed) or {"type": "error", "error": message}.
+#               metrics["started_at"] is the wall time at which the cycle actually started.
+# A device runs one cycle at a time, a second /run gets 409. With --token, requests need an X-Agent-Token header.
+
+RUN_OPTIONS = ("vmstat_interval", "duration", "sampler", "sample_interval", "cpu_workers", "cpu_kernel", "cpu_load",
+               "vm_workers", "vm_bytes", "vm_touch_rate")
+
+def to_json(value):
+    # NumPy arrays and scalars from the samplers
+    return value.tolist() if hasattr(value, "tolist") else str(value)
+
+def encode_line(message):
+    return (json.dumps(message, default=to_json, separators=(",", ":")) + "\n").encode()
+
+class AgentHandler(BaseHTTPRequestHandler):
+    # The response ends when the connection is closed, so results of any size can be streamed
+    protocol_version = "HTTP/1.0"
+    run_lock = threading.Lock()
+    token = None
+
+    def send_json(self, status, message):
+        body = encode_line(message)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def authorized(self):
+        if self.token and self.headers.get("X-Agent-Token") != self.token:
+            self.send_json(403, {"type": "error", "error": "Invalid or missing X-Agent-Token"})
+            return False
+        return True
+
+    def do_GET(self):
+        if not self.authorized():
+            return
+        if self.path == "/time":
+            self.send_json(200, {"time": time.time()})
+        elif self.path == "/info":
+            self.send_json(200, {"hostname": socket.gethostname(), "cpus": os.cpu_count()})
+        else:
+            self.send_json(404, {"type": "error", "error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if not self.authorized():
+            return
+        if self.path != "/run":
+            self.send_json(404, {"type": "error", "error": f"Unknown path {self.path}"})
+            return
+        try:
+            options = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            start_at = options.pop("start_at", None)
+            unknown = set(options) - set(RUN_OPTIONS)
+            if unknown:
+                raise ValueError(f"Unknown options: {', '.join(sorted(unknown))}")
+            if start_at is not None and start_at - time.time() > 3600:
+                raise ValueError("start_at is more than an hour away, check the clock offset")
+        except ValueError as e:
+            self.send_json(400, {"type": "error", "error": str(e)})
+            return
+        if not self.run_lock.acquire(blocking=False):
+            self.send_json(409, {"type": "error", "error": "A measurement is already running on this device"})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        self.stream_run(options, start_at)
+
+    def stream_run(self, options, start_at=None):
+        # The cycle runs in its own thread and hands its samples over through a queue, None marks the end.
+        # The device is free again as soon as the cycle ends, before its result is sent
+        messages = queue.Queue()
+        wall_offset = 0.0
+
+        def on_sample(sample):
+            messages.put({"type": "sample", "sample": {**sample, "wall_time": sample["timestamp"] + wall_offset}})
+
+        def run():
+            nonlocal wall_offset
+            try:
+                if start_at is not None:
+                    wait_until(start_at)
+                started_at = time.time()
+                # The sampler's timestamps are monotonic, this maps them to the wall clock
+                wall_offset = started_at - time.monotonic()
+                series, metrics = stress_and_capture(on_sample=on_sample, **options)
+                metrics["started_at"] = started_at
+                result = {"type": "result", "metrics": metrics}
+                if options.get("sampler", "vmstat") != "proc":
+                    result["series"] = series
+            except Exception as e:
+                result = {"type": "error", "error": str(e)}
+            finally:
+                self.run_lock.release()
+            messages.put(result)
+            messages.put(None)
+
+        threading.Thread(target=run, daemon=True).start()
+        while True:
+            message = messages.get()
+            if message is None:
+                break
+            try:
+                self.wfile.write(encode_line(message))
+                self.wfile.flush()
+            except OSError:
+                # Coordinator gone: the cycle still finishes before the next one can start
+                pass
+
+    def log_message(self, format, *args):
+        print(f"{self.address_string()} - {format % args}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resource utilization agent, driven by coordinator.py")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5300)
+    parser.add_argument("--token", help="Shared secret the coordinator must send (agent_token in config.cfg)")
+    args = parser.parse_args()
+
+    AgentHandler.token = args.token
+    server = ThreadingHTTPServer((args.host, args.port), AgentHandler)
+    print(f"Resource utilization agent listening on {args.host}:{server.server_address[1]} (pid {os.getpid()})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
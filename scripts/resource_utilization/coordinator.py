@@ -0,0 +1,262 @@
+import datetime
+import http.client
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common.clock import align_series, common_grid, estimate_offset
+from common.config import load_config, read_layers, script_config, write_completion_layer_notice, write_starting_layer_notice
+from common.kpi import Device
+from common.results_store import ResultsStore, new_run_id
+from common.sweep import sweep_devices
+from resource_utilization import read_config as read_measurement_config
+from resource_utilization import store_metrics, stress_options, write_results_to_file
+
+# Runs resource_utilization.py's stress + capture cycle on the devices of the layer sections of config.cfg through
+# their agents (python agent.py on every device), several devices at a time, and collects everything here:
+#   python coordinator.py
+# The devices are measured with the options of config.cfg, and their samples are streamed back as they're taken.
+#
+# With synchronized = yes every repetition starts on all the devices at the same instant instead: the clock offset of
+# every agent is measured first, each agent waits for its own clock to reach the common start, and the samples are
+# resampled on a grid shared by all the devices (seconds since the start, "aligned_time"), so layers are compared
+# under the same conditions. The offset, its uncertainty and the start skew of every device are recorded.
+
+def read_config(filename):
+    variables = read_measurement_config(filename)
+    config = load_config(filename, interpolation=False)
+    coordinator = config['coordinator'] if config.has_section('coordinator') else {}
+
+    concurrency = int(coordinator.get('concurrency', 4))
+    variables.update({
+        "concurrency": concurrency,
+        "agent_port": int(coordinator.get('agent_port', 5300)),
+        "agent_token": coordinator.get('agent_token', '').strip(),
+        "synchronized": coordinator.getboolean('synchronized', False) if coordinator else False,
+        "start_lead": float(coordinator.get('start_lead', 2)),
+        "max_skew_ms": float(coordinator.get('max_skew_ms', 50)),
+        "clock_exchanges": int(coordinator.get('clock_exchanges', 8)),
+    })
+    variables.update(read_layers(config, concurrency))
+    return variables
+
+def agent_address(device_ip, default_port):
+    # "X.Y.Z.T", "X.Y.Z.T:port" or "[IPv6]:port", so several agents can run on one host
+    if device_ip.startswith("["):
+        host, _, port = device_ip[1:].partition("]")
+        return host, int(port.lstrip(":") or default_port)
+    if device_ip.count(":") == 1:
+        host, port = device_ip.split(":")
+        return host, int(port)
+    return device_ip, default_port
+
+def agent_request(host, port, method, path, token=None, body=None, timeout=30):
+    connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["X-Agent-Token"] = token
+    connection.request(method, path, None if body is None else json.dumps(body), headers)
+    response = connection.getresponse()
+    if response.status != 200:
+        try:
+            error = json.loads(response.read()).get("error")
+        except ValueError:
+            error = response.reason
+        connection.close()
+        raise RuntimeError(f"Agent {host}:{port} answered {response.status}: {error}")
+    return connection, response
+
+def agent_info(host, port, token=None):
+    connection, response = agent_request(host, port, "GET", "/info", token)
+    try:
+        return json.loads(response.read())
+    finally:
+        connection.close()
+
+def read_agent_clock(host, port, token=None):
+    # (local time before the request, agent time, local time after the reply). The connection is opened first so
+    # its handshake isn't part of the exchange
+    connection = http.client.HTTPConnection(host, port, timeout=10)
+    try:
+        connection.connect()
+        sent = time.time()
+        connection.request("GET", "/time", headers={"X-Agent-Token": token} if token else {})
+        response = connection.getresponse()
+        body = response.read()
+        received = time.time()
+    finally:
+        connection.close()
+    if response.status != 200:
+        raise RuntimeError(f"Agent {host}:{port} answered {response.status}")
+    return sent, json.loads(body)["time"], received
+
+def run_agent(host, port, options, token=None, on_sample=None):
+    # One stress + capture cycle on the agent. Returns (series, metrics) like stress_and_capture()
+    connection, response = agent_request(host, port, "POST", "/run", token, options, timeout=options['duration'] + 120)
+    samples = {}
+    try:
+        for line in response:
+            message = json.loads(line)
+            if message["type"] == "sample":
+                for column, value in message["sample"].items():
+                    samples.setdefault(column, []).append(value)
+                if on_sample is not None:
+                    on_sample(message["sample"])
+            elif message["type"] == "result":
+                series = message.get("series") or samples
+                return {column: np.asarray(values, dtype=np.float64) for column, values in series.items()}, message["metrics"]
+            else:
+                raise RuntimeError(f"Agent {host}:{port} failed: {message.get('error')}")
+    finally:
+        connection.close()
+    raise RuntimeError(f"Agent {host}:{port} closed the connection before the end of the measurement")
+
+def measure_device(device, config):
+    # Every repetition of one device: {"hostname": ..., "repetitions": [(series, metrics)]}
+    host, port = agent_address(device.ip, config['agent_port'])
+    hostname = agent_info(host, port, config['agent_token'])["hostname"]
+    repetitions = []
+    for _ in range(config['repetitions']):
+        series, metrics = run_agent(host, port, stress_options(config), config['agent_token'])
+        # Without a common start the agent's wall clock has nothing to be aligned with
+        series.pop("wall_time", None)
+        repetitions.append((series, metrics))
+    return {"hostname": hostname, "repetitions": repetitions}
+
+def run_sweep(config):
+    # Returns {(layer, device_name): (result or the exception raised, peak concurrency)}
+    sweep = sweep_devices(config, lambda device: measure_device(device, config))
+    outcomes = {}
+    for category, devices in sweep.items():
+        for device_name, _, future in devices:
+            try:
+                outcomes[(category, device_name)] = future.result()
+            except Exception as e:
+                outcomes[(category, device_name)] = (e, None)
+    return outcomes
+
+def run_synchronized(config):
+    # Every device at once, repetition by repetition. Same return value as run_sweep(), the results also carrying
+    # the clock offset of the device and the start skew of every repetition
+    devices = [Device(category, device_name, device_ip) for category in config['layers']
+               for device_name, device_ip in config[category].items()]
+    if not devices:
+        return {}
+    outcomes = {}
+    with ThreadPoolExecutor(max_workers=len(devices)) as executor:
+        def prepare(device):
+            host, port = agent_address(device.ip, config['agent_port'])
+            hostname = agent_info(host, port, config['agent_token'])["hostname"]
+            offset, round_trip = estimate_offset(lambda: read_agent_clock(host, port, config['agent_token']),
+                                                 config['clock_exchanges'])
+            return {"hostname": hostname, "address": (host, port), "clock_offset": offset,
+                    "clock_uncertainty": round_trip / 2, "repetitions": [], "start_skews": []}
+
+        for device, future in [(device, executor.submit(prepare, device)) for device in devices]:
+            try:
+                outcomes[(device.layer, device.name)] = future.result()
+            except Exception as e:
+                outcomes[(device.layer, device.name)] = e
+
+        ready = [device for device in devices if not isinstance(outcomes[(device.layer, device.name)], Exception)]
+        for _ in range(config['repetitions']):
+            # The lead leaves every agent time to receive the request before the start
+            start = time.time() + config['start_lead']
+            futures = []
+            measured = []
+            for device in ready:
+                result = outcomes[(device.layer, device.name)]
+                options = {**stress_options(config), "start_at": start + result['clock_offset']}
+                futures.append((device, executor.submit(run_agent, *result['address'], options, config['agent_token'])))
+            for device, future in futures:
+                result = outcomes[(device.layer, device.name)]
+                try:
+                    series, metrics = future.result()
+                except Exception as e:
+                    outcomes[(device.layer, device.name)] = e
+                    continue
+                result['start_skews'].append(metrics['started_at'] - result['clock_offset'] - start)
+                # Agent samples on the reference clock
+                times = series.pop("wall_time") - result['clock_offset'] if "wall_time" in series else None
+                measured.append((result, series, metrics, times))
+            # Then on the grid covered by every device of the repetition
+            sampled = [times for _, _, _, times in measured if times is not None and times.size]
+            grid = common_grid(sampled, start, config['sample_interval']) if sampled else None
+            for result, series, metrics, times in measured:
+                if grid is not None and times is not None and times.size:
+                    series = align_series(series, times, start, grid)
+                result['repetitions'].append((series, metrics))
+            ready = [device for device in ready if not isinstance(outcomes[(device.layer, device.name)], Exception)]
+    return {key: (outcome, len(devices)) for key, outcome in outcomes.items()}
+
+def sync_fields(result, repetition_number):
+    if "clock_offset" not in result:
+        return {}
+    return {
+        "clock_offset_ms": result['clock_offset'] * 1000,
+        "clock_uncertainty_ms": result['clock_uncertainty'] * 1000,
+        "start_skew_ms": result['start_skews'][repetition_number] * 1000,
+    }
+
+
+if __name__ == "__main__":
+    try:
+        config = read_config(script_config(__file__))
+        store = ResultsStore(config['store_dir']) if config['store_dir'] else None
+        run_id = new_run_id(__file__)
+
+        script_name = os.path.basename(__file__)
+        current_date = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        if config['text_results']:
+            with open(config['results_file'], "a") as file:
+                file.write(f"\n{'*' * 60}\n")
+                file.write(f"Running {script_name} on {current_date}\n")
+                file.write(f"(Configuration --> Duration: {config['duration']} seconds, Repetitions: {config['repetitions']})\n")
+                file.write(f"{'*' * 60}\n")
+
+        # The devices are measured concurrently, their results written in config order
+        outcomes = run_synchronized(config) if config['synchronized'] else run_sweep(config)
+        for category in config['layers']:
+            if config['text_results']:
+                write_starting_layer_notice(config['results_file'], category)
+            for device_name, device_ip in config[category].items():
+                try:
+                    result, peak_concurrency = outcomes[(category, device_name)]
+                    if isinstance(result, Exception):
+                        raise result
+                except Exception as e:
+                    print(f"[{category}] {device_name} ({device_ip}) failed: {e}")
+                    if config['text_results']:
+                        with open(config['results_file'], "a") as file:
+                            file.write(f"Device name: {device_name}\nError: {e}\n-----------------------------------\n")
+                    continue
+                for repetition_number, (series, metrics) in enumerate(result['repetitions']):
+                    fields = sync_fields(result, repetition_number)
+                    if fields and abs(fields['start_skew_ms']) > config['max_skew_ms']:
+                        print(f"[{category}] {device_name}: repetition {repetition_number + 1} started {fields['start_skew_ms']:.1f} ms "
+                              f"off the common start (max_skew_ms = {config['max_skew_ms']:g})")
+                    if store is not None:
+                        store_metrics(store, run_id, device_name, repetition_number, series, metrics, layer=category,
+                                      device_ip=device_ip, agent_hostname=result['hostname'], peak_concurrency=peak_concurrency,
+                                      **fields)
+                    if config['text_results']:
+                        write_results_to_file(config['results_file'], f"{device_name} ({result['hostname']})", repetition_number, metrics)
+                        with open(config['results_file'], "a") as file:
+                            if fields:
+                                file.write(f"Clock Offset: {fields['clock_offset_ms']:.3f} ms (+/- {fields['clock_uncertainty_ms']:.3f} ms), "
+                                           f"Start Skew: {fields['start_skew_ms']:.3f} ms\n")
+                            file.write("-----------------------------------\n")
+                print(f"[{category}] {device_name} ({device_ip}): {len(result['repetitions'])} repetitions from {result['hostname']}")
+            if config['text_results']:
+                write_completion_layer_notice(config['results_file'], category)
+        print(f"Script successfully executed. Results stored in: {config['store_dir'] or config['results_file']} (run {run_id})")
+
+    except Exception as e:
+        print(f"Error: {e}")
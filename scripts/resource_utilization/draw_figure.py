@@ -1,5 +1,10 @@
 import matplotlib.pyplot as plt
 import re
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.results_store import ResultsStore
 
 def parse_resource_utilization(filename):
     with open(filename, 'r') as file:
@@ -25,6 +30,21 @@ def parse_resource_utilization(filename):
 
     return results
 
+def load_results_from_store(store_dir, run_id=None):
+    # Same layout as parse_resource_utilization, one average per repetition, read through the store index
+    # (latest run by default). "ram" is the RAM usage in % there
+    store = ResultsStore(store_dir)
+    run_id = run_id or store.latest_run("cpu_us")
+    columns = {"cpu_us": "cpu_us", "cpu_sy": "cpu_sy", "cpu_id": "cpu_id", "ram_usage": "ram"}
+    results = {}
+    for kpi, key in columns.items():
+        for record in store.records(run_id=run_id, kpi=kpi):
+            samples = store.load(record)
+            if samples.size:
+                device = results.setdefault(record["device"], {column: [] for column in columns.values()})
+                device[key].append(float(samples.mean()))
+    return results
+
 def plot_cpu_comparison(devices_data, output_file):
     plt.figure(figsize=(12, 7))
 
@@ -44,24 +64,37 @@ def plot_cpu_comparison(devices_data, output_file):
     plt.legend()
     
     plt.savefig(output_file)
-    plt.show()
+    plt.close()
 
-def plot_ram_comparison(devices_data, output_file):
+def plot_ram_comparison(devices_data, output_file, ylabel='Free RAM (MB)'):
     plt.figure(figsize=(12, 7))
 
     labels = list(devices_data.keys())
-    ram_avg = [sum(devices_data[device]['ram']) / len(devices_data[device]['ram']) for device in labels]
+    ram_avg = [sum(devices_data[device]['ram']) / len(devices_data[device]['ram']) if devices_data[device]['ram'] else 0
+               for device in labels]
 
     plt.bar(labels, ram_avg, color='purple')
     plt.title('RAM Usage')
     plt.xlabel('Device')
-    plt.ylabel('Free RAM (MB)')
+    plt.ylabel(ylabel)
     
     # Save the figure to the specified file
     plt.savefig(output_file)
+    plt.close()
+
+def render(results_dir, figures_dir, store_dir=None):
+    # Figures of this KPI from the store when it holds CPU records, else from the text results. Returns the files written
+    store_dir = store_dir or os.path.join(results_dir, "store")
+    if os.path.exists(os.path.join(store_dir, "index.jsonl")) and ResultsStore(store_dir).latest_run("cpu_us"):
+        results, ram_label = load_results_from_store(store_dir), 'RAM Usage (%)'
+    else:
+        results, ram_label = parse_resource_utilization(os.path.join(results_dir, "resource_utilization.txt")), 'Free RAM (MB)'
+    outputs = [os.path.join(figures_dir, "resource_utilization_cpu.png"), os.path.join(figures_dir, "resource_utilization_ram.png")]
+    plot_cpu_comparison(results, outputs[0])
+    plot_ram_comparison(results, outputs[1], ram_label)
+    return outputs
 
 
 if __name__ == "__main__":
-    results = parse_resource_utilization("../../results/resource_utilization.txt")
-    plot_cpu_comparison(results, "../../figures/resource_utilization_cpu.png")
-    plot_ram_comparison(results, "../../figures/resource_utilization_ram.png")
+    base_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+    render(os.path.join(base_dir, "results"), os.path.join(base_dir, "figures"))
@@ -1,43 +1,64 @@
-import subprocess
-import configparser
 import datetime
 import os
 import socket
 import threading
 import errno
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.config import config_path, load_config, script_config
+from common.instrumentation import HARNESS, report_overhead, report_usage, run_command
+from common.kpi import Device
+from common.proc_sampler import ProcSampler
+from common.results_store import ResultsStore, new_run_id
+from common.stress import run_cpu_stress, run_memory_stress
 
 def read_config(filename):
-    config = configparser.ConfigParser()
-    config.read(filename)
+    config = load_config(filename, interpolation=False)
     
     variables = {
-        "results_file": config['general'].get('results_file'),
+        "results_file": config_path(filename, config['general'].get('results_file')),
         "repetitions": int(config['general'].get('repetitions')),
         "duration": int(config['general'].get('duration')),
-        "vmstat_interval": int(config['resource-utilization'].get('vmstat_interval'))
+        "vmstat_interval": int(config['resource-utilization'].get('vmstat_interval')),
+        "sampler": config['resource-utilization'].get('sampler', 'proc').strip(),
+        "stress_cpu": int(config['resource-utilization'].get('stress_cpu', 0)),
+        "cpu_kernel": config['resource-utilization'].get('cpu_kernel', 'integer').strip(),
+        "cpu_load": float(config['resource-utilization'].get('cpu_load', 100)),
+        "stress_vm": int(config['resource-utilization'].get('stress_vm', 1)),
+        "stress_vm_bytes": config['resource-utilization'].get('stress_vm_bytes', '50M').strip(),
+        "vm_touch_rate": float(config['resource-utilization'].get('vm_touch_rate', 0)),
+        "sample_interval": float(config['resource-utilization'].get('sample_interval', config['resource-utilization'].get('vmstat_interval'))),
+        "store_dir": config_path(filename, config['general'].get('store_dir', '')),
+        "text_results": config['general'].getboolean('text_results', True),
+        "instrumentation": config['general'].getboolean('instrumentation', False)
     }
     return variables
 
-def stress_cpu(duration):
-    # fibonacci calculation
-    end_time = datetime.datetime.now() + datetime.timedelta(seconds=duration)
-    a, b = 0, 1
-    while datetime.datetime.now() < end_time:
-        a, b = b, a + b
-
-def stress_memory(duration):
-    # data structure
-    end_time = datetime.datetime.now() + datetime.timedelta(seconds=duration)
-    data = []
-    while datetime.datetime.now() < end_time:
-        try:
-            # Append a large number of elements to the list to use up RAM
-            data.append([0] * 100)
-            
-        except MemoryError:
-            # Clear the list if a MemoryError occurs (i.e., RAM is full)
-            print("RAM is full")
-            data.clear()
+def stress_options(config):
+    # Keyword arguments of stress_and_capture(), also sent as is to the remote agents (see coordinator.py)
+    return {
+        "vmstat_interval": config['vmstat_interval'],
+        "duration": config['duration'],
+        "sampler": config['sampler'],
+        "sample_interval": config['sample_interval'],
+        "cpu_workers": config['stress_cpu'],
+        "cpu_kernel": config['cpu_kernel'],
+        "cpu_load": config['cpu_load'],
+        "vm_workers": config['stress_vm'],
+        "vm_bytes": config['stress_vm_bytes'],
+        "vm_touch_rate": config['vm_touch_rate'],
+    }
+
+# The thread targets below put what they measure in `results`, a dict of the current cycle only
+
+def stress_cpu(results, duration, workers=None, kernel='integer', load=100):
+    # One stress process per worker (see common/stress.py), this thread only waits for their results
+    results['cpu_stress'] = run_cpu_stress(duration, workers, kernel, load / 100)
+
+def stress_memory(results, duration, workers=1, target='50M', touch_rate=0):
+    # Preallocated buffers in worker processes (see common/stress.py), capped below MemAvailable
+    results['memory_stress'] = run_memory_stress(duration, target, workers, touch_rate * 1024 * 1024)
 
 def memory_string_to_float(mem_str):
     mem_str = mem_str.replace("i", "")  # Strip the 'i' if it exists
@@ -57,21 +78,44 @@ def capture_metrics(vmstat_interval, duration):
     vmstat_cmd = ["vmstat", str(vmstat_interval), str(duration)]
     ram_cmd = ["free", "-h"]
 
-    vmstat_output = subprocess.check_output(vmstat_cmd, universal_newlines=True)
-    ram_output = subprocess.check_output(ram_cmd, universal_newlines=True)
+    vmstat_output = run_command(vmstat_cmd, check=True).stdout
+    ram_output = run_command(ram_cmd, check=True).stdout
 
     return vmstat_output, ram_output
 
 # Wrapper function to handle results of capture_metrics
-def capture_metrics_wrapper(vmstat_interval, duration):
-    global vmstat_output, ram_usage  # Or use some shared data structure
-    vmstat_output, ram_usage = capture_metrics(vmstat_interval, duration)
+def capture_metrics_wrapper(results, vmstat_interval, duration):
+    results['vmstat_output'], results['ram_usage'] = capture_metrics(vmstat_interval, duration)
+
+# Native alternative to capture_metrics: a time series of CPU and RAM read from /proc
+def sample_metrics_wrapper(results, sample_interval, duration, on_sample=None):
+    # on_sample({column: value}) gets every sample as soon as it's taken
+    sampler = ProcSampler(sample_interval, duration, pids={"harness": os.getpid()})
+    try:
+        sampler.run(on_sample=None if on_sample is None else lambda index: on_sample(sampler.row(index)))
+        results['series'], results['metrics'] = sampler.series(), sampler.summary()
+    finally:
+        sampler.close()
+
+def run_thread(target, results, *args):
+    # Thread body: an exception is kept in results['errors'] for stress_and_capture() to raise once every thread ended
+    try:
+        target(results, *args)
+    except Exception as e:
+        results.setdefault('errors', []).append(e)
+
+def stress_and_capture(vmstat_interval, duration, sampler='vmstat', sample_interval=None, cpu_workers=None, cpu_kernel='integer', cpu_load=100,
+                       vm_workers=1, vm_bytes='50M', vm_touch_rate=0, on_sample=None):
+    if sampler == 'proc':
+        capture_target, capture_args = sample_metrics_wrapper, (sample_interval or vmstat_interval, duration, on_sample)
+    else:
+        capture_target, capture_args = capture_metrics_wrapper, (vmstat_interval, duration)
 
-def stress_and_capture(vmstat_interval, duration):
     # Threads for each function
-    stress_cpu_thread = threading.Thread(target=stress_cpu, args=(duration,))
-    stress_memory_thread = threading.Thread(target=stress_memory, args=(duration,))
-    capture_metrics_thread = threading.Thread(target=capture_metrics_wrapper, args=(vmstat_interval, duration))
+    results = {}
+    stress_cpu_thread = threading.Thread(target=run_thread, args=(stress_cpu, results, duration, cpu_workers, cpu_kernel, cpu_load))
+    stress_memory_thread = threading.Thread(target=run_thread, args=(stress_memory, results, duration, vm_workers, vm_bytes, vm_touch_rate))
+    capture_metrics_thread = threading.Thread(target=run_thread, args=(capture_target, results) + capture_args)
 
     # Start the threads
     stress_cpu_thread.start()
@@ -82,12 +126,38 @@ def stress_and_capture(vmstat_interval, duration):
     stress_cpu_thread.join()
     stress_memory_thread.join()
     capture_metrics_thread.join()
+    if results.get('errors'):
+        raise results['errors'][0]
+
+    # Both samplers return a time series per metric and the averages written to the results file
+    if sampler == 'proc':
+        series, metrics = results['series'], results['metrics']
+    else:
+        metrics = process_metrics(results['vmstat_output'], results['ram_usage'])
+        series = vmstat_to_series(results['vmstat_output'], metrics)
+
+    # Compute throughput achieved by the stress workers
+    metrics['cpu_stress'] = results['cpu_stress']
+    metrics['cpu_ops_per_second'] = sum(result['ops_per_second'] for result in results['cpu_stress'])
+    metrics['cpu_kernel'] = cpu_kernel
+    metrics['cpu_load'] = cpu_load
 
-    # Assuming you've stored results in some shared data structure or global variable
-    # For example:
-    # return shared_data["vmstat_output"], shared_data["ram_usage"]
-    return vmstat_output, ram_usage  # Modify as per your implementation
+    # Memory bandwidth achieved by the memory stress workers
+    metrics['memory_stress'] = results['memory_stress']
+    for kernel in ("read", "write", "copy"):
+        metrics[f'memory_{kernel}_mb_per_second'] = sum(worker[f'{kernel}_mb_per_second'] for worker in results['memory_stress']['workers'])
+    return series, metrics
 
+@HARNESS.timed("parse")
+def vmstat_to_series(vmstat_output, metrics):
+    lines = vmstat_output.split("\n")[2:-1]
+    columns = {"cpu_us": 12, "cpu_sy": 13, "cpu_id": 14}
+    series = {kpi: [int(line.split()[column]) for line in lines] for kpi, column in columns.items()}
+    # free -h only runs once, at the end of the capture
+    series["ram_usage"] = [metrics['ram_usage_percent']]
+    return series
+
+@HARNESS.timed("parse")
 def process_metrics(vmstat_output, ram_output):
     # Extract the needed values from the vmstat output
     lines = vmstat_output.split("\n")[2:-1]
@@ -113,6 +183,23 @@ def process_metrics(vmstat_output, ram_output):
         'avg_used_ram_gb': used_memory
     }
 
+def store_metrics(store, run_id, hostname, repetition_number, series, metrics, layer="local", **fields):
+    # One record per metric, keeping every sample instead of the averages only
+    for kpi, samples in series.items():
+        unit = "s" if kpi in ("timestamp", "aligned_time") else "MB" if kpi.endswith("_mb") else "%"
+        store.append(run_id, layer, hostname, kpi, samples, unit, repetition=int(repetition_number) + 1, **fields)
+    workers = metrics['cpu_stress']
+    store.append(run_id, layer, hostname, "cpu_ops_per_second", [worker['ops_per_second'] for worker in workers], "ops/s",
+                 repetition=int(repetition_number) + 1, kernel=metrics['cpu_kernel'], target_load=metrics['cpu_load'],
+                 achieved_load=[worker['achieved_load'] for worker in workers], **fields)
+    memory_stress = metrics['memory_stress']
+    allocated = sum(worker['allocated_bytes'] for worker in memory_stress['workers'])
+    for kernel in ("read", "write", "copy"):
+        store.append(run_id, layer, hostname, f"memory_{kernel}_bandwidth",
+                     [worker[f'{kernel}_mb_per_second'] for worker in memory_stress['workers']], "MB/s",
+                     repetition=int(repetition_number) + 1, allocated_bytes=allocated, clamped=memory_stress['clamped'], **fields)
+
+@HARNESS.timed("write")
 def write_results_to_file(results_file, hostname, repetition_number, metrics):
     repetition_number = int(repetition_number) + 1
     with open(results_file, "a") as file:
@@ -123,33 +210,55 @@ def write_results_to_file(results_file, hostname, repetition_number, metrics):
         file.write(f"Average CPU Idle (id): {metrics['avg_id']:.2f}%\n")
         file.write(f"Average RAM Usage: {metrics['ram_usage_percent']:.2f}%\n")
         file.write(f"Average Used RAM: {metrics['avg_used_ram_gb']:.2f}%\n")
+        file.write(f"CPU Stress Throughput: {metrics['cpu_ops_per_second']:.0f} ops/s "
+                   f"({len(metrics['cpu_stress'])} {metrics['cpu_kernel']} workers, target load {metrics['cpu_load']:.0f}%)\n")
+        for worker in metrics['cpu_stress']:
+            file.write(f"Worker {worker['worker']} (core {worker['core']}): {worker['ops_per_second']:.0f} ops/s, "
+                       f"achieved load {worker['achieved_load']:.1f}%\n")
+        memory_stress = metrics['memory_stress']
+        allocated_mb = sum(worker['allocated_bytes'] for worker in memory_stress['workers']) / (1024 * 1024)
+        file.write(f"Memory Stress Allocation: {allocated_mb:.0f} MB in {len(memory_stress['workers'])} workers"
+                   f"{' (clamped to the safety ceiling)' if memory_stress['clamped'] else ''}\n")
+        file.write(f"Memory Bandwidth (read/write/copy): {metrics['memory_read_mb_per_second']:.0f}/"
+                   f"{metrics['memory_write_mb_per_second']:.0f}/{metrics['memory_copy_mb_per_second']:.0f} MB/s\n")
 
 
 if __name__ == "__main__":
     try:
-        config = read_config("config.cfg")
+        config = read_config(script_config(__file__))
+        store = ResultsStore(config['store_dir']) if config['store_dir'] else None
+        run_id = new_run_id(__file__)
 
         script_name = os.path.basename(__file__)
         current_date = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        results_file = config['results_file'] if config['text_results'] else None
+        if config['instrumentation']:
+            HARNESS.start()
 
-        with open(config['results_file'], "a") as file:
-            file.write(f"\n{'*' * 60}\n")
-            file.write(f"Running {script_name} on {current_date}\n")
-            file.write(f"(Configuration --> Duration: {config['duration']} seconds, Repetitions: {config['repetitions']})\n")
-            file.write(f"{'*' * 60}\n")
+        if config['text_results']:
+            with open(config['results_file'], "a") as file:
+                file.write(f"\n{'*' * 60}\n")
+                file.write(f"Running {script_name} on {current_date}\n")
+                file.write(f"(Configuration --> Duration: {config['duration']} seconds, Repetitions: {config['repetitions']})\n")
+                file.write(f"{'*' * 60}\n")
 
         for repetition_number in range(config['repetitions']):
-            vmstat_output, ram_output = stress_and_capture(
-                vmstat_interval=config['vmstat_interval'], 
-                duration=config['duration']
-            )
+            series, metrics = stress_and_capture(**stress_options(config))
 
-            metrics = process_metrics(vmstat_output, ram_output)
             hostname = socket.gethostname()
-            write_results_to_file(config['results_file'], hostname, repetition_number, metrics)
-            with open(config['results_file'], "a") as file:
-                file.write("-----------------------------------\n")
-        print("Script successfully executed. Results stored in: " +config['results_file'])
+            if store is not None:
+                store_metrics(store, run_id, hostname, repetition_number, series, metrics)
+            if config['text_results']:
+                write_results_to_file(config['results_file'], hostname, repetition_number, metrics)
+            if config['instrumentation']:
+                # The vmstat/free runs and the writes of this repetition, the stress workers competing with them
+                report_overhead(None, Device("local", hostname, ""), results_file, store, run_id, repetition=repetition_number + 1)
+            if config['text_results']:
+                with open(config['results_file'], "a") as file:
+                    file.write("-----------------------------------\n")
+        if config['instrumentation']:
+            report_usage(Device("local", socket.gethostname(), ""), results_file, store, run_id)
+        print(f"Script successfully executed. Results stored in: {config['store_dir'] or config['results_file']} (run {run_id})")
 
     except Exception as e: 
         print()
@@ -0,0 +1,239 @@
+import datetime
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.availability import RollingAvailability
+from common.config import config_path, load_config, read_layers, script_config
+from common.kpi import Device
+from common.prober import open_backend
+from common.results_store import ResultsStore, new_run_id
+
+# Availability monitor daemon: probes every device of config.cfg once per interval, at most `concurrency` probes at a
+# time, until stopped (Ctrl+C/SIGTERM) or `duration` seconds have passed:
+#   python monitor.py
+# Outage start/end events (millisecond wall-clock times) are appended to events_file as JSON lines, and every ended
+# outage also goes to the results store. Every report_interval a status line per device gives its availability over
+# the rolling windows and its recent RTTs. The memory per device is fixed (a ring of the last ring_size probes and
+# 60 counters per window), so it can run for weeks on a small device.
+
+def read_config(filename):
+    config = load_config(filename)
+    monitor = config['monitor'] if config.has_section('monitor') else {}
+
+    variables = {
+        "prober": config['general'].get('prober', 'system').strip(),
+        "echo_port": int(config['general'].get('echo_port', 7)),
+        "outage_probes": int(config['general'].get('outage_probes', 1)),
+        "store_dir": config_path(filename, config['general'].get('store_dir', '')),
+        "results_file": config_path(filename, monitor.get('results_file', '')),
+        "events_file": config_path(filename, monitor.get('events_file', '')),
+        "interval": float(monitor.get('interval', 1)),
+        "timeout": float(monitor.get('timeout', 1)),
+        "concurrency": int(monitor.get('concurrency', 8)),
+        "ring_size": int(monitor.get('ring_size', 600)),
+        "windows": [int(window) for window in monitor.get('windows', '60, 3600, 86400').split(',') if window.strip()],
+        "report_interval": float(monitor.get('report_interval', 60)),
+        "duration": float(monitor.get('duration', 0)),
+    }
+    if variables['timeout'] > variables['interval']:
+        raise ValueError("The probe timeout can't be longer than the probing interval")
+    variables.update(read_layers(config))
+    return variables
+
+def format_time(monotonic_ns):
+    # Probe times are time.monotonic_ns(), so outage durations and windows don't jump when NTP steps the clock.
+    # They become wall-clock times only when written, with the current offset between the two clocks
+    wall_ns = monotonic_ns + time.time_ns() - time.monotonic_ns()
+    return datetime.datetime.fromtimestamp(wall_ns / 1e9).isoformat(sep=" ", timespec="milliseconds")
+
+class ProbeRing:
+    # The last `size` probes of a device in preallocated arrays: monotonic send time (ns) and RTT (ms, NaN if lost)
+    def __init__(self, size):
+        self.time_ns = np.zeros(size, dtype=np.int64)
+        self.rtt_ms = np.full(size, np.nan)
+        self.count = 0
+
+    def append(self, time_ns, rtt_ms):
+        index = self.count % self.time_ns.size
+        self.time_ns[index] = time_ns
+        self.rtt_ms[index] = rtt_ms
+        self.count += 1
+
+    def recent(self):
+        # Oldest first
+        size = self.time_ns.size
+        order = np.arange(self.count - size, self.count) % size if self.count > size else np.arange(self.count)
+        return self.time_ns[order], self.rtt_ms[order]
+
+class OutageTracker:
+    # Up/down state of a device: down after outage_probes consecutive lost probes, from the first of them,
+    # and up again at the next successful probe
+    def __init__(self, outage_probes=1):
+        self.outage_probes = outage_probes
+        self.lost = 0
+        self.first_lost_ns = None
+        self.down_since_ns = None
+        self.outages = 0
+
+    @property
+    def down(self):
+        return self.down_since_ns is not None
+
+    def update(self, time_ns, ok):
+        # Returns the outage_start/outage_end event this probe causes, if any
+        if ok:
+            event = None
+            if self.down:
+                self.outages += 1
+                event = {"event": "outage_end", "start": format_time(self.down_since_ns), "end": format_time(time_ns),
+                         "duration_ms": (time_ns - self.down_since_ns) / 1e6, "lost_probes": self.lost}
+            self.lost, self.first_lost_ns, self.down_since_ns = 0, None, None
+            return event
+        if not self.lost:
+            self.first_lost_ns = time_ns
+        self.lost += 1
+        if not self.down and self.lost >= self.outage_probes:
+            self.down_since_ns = self.first_lost_ns
+            return {"event": "outage_start", "start": format_time(self.down_since_ns), "lost_probes": self.lost}
+        return None
+
+class DeviceMonitor:
+    def __init__(self, device, config):
+        self.device = device
+        self.backend = None
+        self.ring = ProbeRing(config['ring_size'])
+        self.tracker = OutageTracker(config['outage_probes'])
+        self.windows = {window: RollingAvailability(window) for window in config['windows']}
+        self.in_flight = False
+        self.skipped = 0  # Probes not sent because the previous one was still waiting for the pool
+
+class AvailabilityMonitor:
+    def __init__(self, config, on_event=None, on_report=None):
+        self.config = config
+        self.on_event = on_event or (lambda monitor, event: None)
+        self.on_report = on_report or (lambda monitors: None)
+        self.monitors = [DeviceMonitor(Device(layer, device_name, device_ip), config)
+                         for layer in config.get('layers', []) for device_name, device_ip in config[layer].items()]
+        self._lock = threading.Lock()
+
+    def probe(self, monitor, seq):
+        time_ns = time.monotonic_ns()
+        try:
+            if monitor.backend is None:
+                monitor.backend = open_backend(self.config['prober'], monitor.device.ip, self.config['echo_port'],
+                                               self.config['timeout'])
+            sample = monitor.backend.probe(seq)
+            ok, rtt_ms = sample.ok, sample.rtt_ns / 1e6 if sample.ok else np.nan
+        except Exception:
+            # Unreachable network, resolution failure...: lost, the backend is reopened on the next probe
+            if monitor.backend is not None:
+                monitor.backend.close()
+                monitor.backend = None
+            ok, rtt_ms = False, np.nan
+        with self._lock:
+            monitor.ring.append(time_ns, rtt_ms)
+            for window in monitor.windows.values():
+                window.add(time_ns / 1e9, ok)
+            event = monitor.tracker.update(time_ns, ok)
+            monitor.in_flight = False
+        if event is not None:
+            self.on_event(monitor, event)
+
+    def report(self):
+        with self._lock:
+            self.on_report(self.monitors)
+
+    def run(self, stop_event):
+        # Probes on a fixed schedule until stop_event is set. A device whose previous probe hasn't run yet
+        # (the pool is saturated) skips the tick instead of queueing probes without bound
+        executor = ThreadPoolExecutor(max_workers=self.config['concurrency'])
+        start = time.monotonic()
+        next_report = start + self.config['report_interval']
+        tick = 0
+        try:
+            while not stop_event.is_set():
+                for monitor in self.monitors:
+                    if monitor.in_flight:
+                        monitor.skipped += 1
+                        continue
+                    monitor.in_flight = True
+                    executor.submit(self.probe, monitor, tick)
+                if time.monotonic() >= next_report:
+                    self.report()
+                    next_report += self.config['report_interval']
+                tick += 1
+                stop_event.wait(max(start + tick * self.config['interval'] - time.monotonic(), 0))
+        finally:
+            executor.shutdown(wait=True)
+            for monitor in self.monitors:
+                if monitor.backend is not None:
+                    monitor.backend.close()
+        self.report()
+
+def status_line(monitor, now_ns):
+    device = monitor.device
+    parts = []
+    for window, rolling in monitor.windows.items():
+        successful, total = rolling.counts(now_ns / 1e9)
+        parts.append(f"{window}s: {successful / total * 100:.2f}% ({successful}/{total})" if total else f"{window}s: n/a")
+    _, rtts = monitor.ring.recent()
+    received = rtts[~np.isnan(rtts)]
+    state = f"DOWN since {format_time(monitor.tracker.down_since_ns)}" if monitor.tracker.down else "up"
+    recent = f"p50/p99 RTT {np.percentile(received, 50):.3f}/{np.percentile(received, 99):.3f} ms" if received.size else "no replies"
+    return (f"{format_time(now_ns)} [{device.layer}] {device.name} ({device.ip}) {state}, Availability {', '.join(parts)}, "
+            f"last {rtts.size} probes: {recent}, outages: {monitor.tracker.outages}, skipped: {monitor.skipped}")
+
+def write_status(results_file, monitors):
+    now_ns = time.monotonic_ns()
+    lines = [status_line(monitor, now_ns) for monitor in monitors]
+    print("\n".join(lines))
+    if results_file:
+        with open(results_file, "a") as file:
+            file.write("\n".join(lines) + "\n")
+
+def write_event(events_file, store, run_id, monitor, event):
+    device = monitor.device
+    event = {**event, "layer": device.layer, "device": device.name, "device_ip": device.ip}
+    print(f"[{device.layer}] {device.name} ({device.ip}) {event['event']}: {json.dumps(event)}")
+    if events_file:
+        with open(events_file, "a") as file:
+            file.write(json.dumps(event) + "\n")
+    if store is not None and event['event'] == "outage_end":
+        store.append(run_id, device.layer, device.name, "outage", [event['duration_ms']], "ms", device_ip=device.ip,
+                     start=event['start'], end=event['end'], lost_probes=event['lost_probes'])
+
+
+if __name__ == "__main__":
+    try:
+        config = read_config(script_config(__file__))
+        store = ResultsStore(config['store_dir']) if config['store_dir'] else None
+        run_id = new_run_id(__file__)
+        stop_event = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+        if config['duration']:
+            timer = threading.Timer(config['duration'], stop_event.set)
+            timer.daemon = True
+            timer.start()
+
+        monitor = AvailabilityMonitor(
+            config,
+            on_event=lambda device_monitor, event: write_event(config['events_file'], store, run_id, device_monitor, event),
+            on_report=lambda monitors: write_status(config['results_file'], monitors),
+        )
+        print(f"Monitoring {len(monitor.monitors)} devices every {config['interval']} s (run {run_id})")
+        try:
+            monitor.run(stop_event)
+        except KeyboardInterrupt:
+            stop_event.set()
+        print(f"Monitor stopped. Events stored in: {config['events_file'] or config['store_dir']} (run {run_id})")
+
+    except Exception as e:
+        print(f"Error: {e}")
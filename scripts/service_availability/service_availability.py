@@ -1,92 +1,109 @@
-import subprocess
 import os
-import configparser
-import re
 import datetime
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.config import (config_path, load_config, read_layers, script_config, write_completion_layer_notice,
+                           write_starting_layer_notice)
+from common.availability import availability_lines, availability_records, summarize_availability
+from common.instrumentation import HARNESS, report_overhead, report_usage
+from common.kpi import Device, Kpi, store_records
+from common.prober import collect_probes
+from common.results_store import ResultsStore, new_run_id
+
+def read_options(section):
+    # Measurement options, shared with the benchmark runner's [availability] section
+    return {
+        "repetitions": int(section.get('repetitions')),
+        "duration": int(section.get('duration')),
+        "prober": section.get('prober', 'system').strip(),
+        "echo_port": int(section.get('echo_port', 7)),
+        "outage_probes": int(section.get('outage_probes', 1)),
+    }
 
 def read_config(filename):
-    config = configparser.ConfigParser()
-    config.read(filename)
+    config = load_config(filename)
     
-    layers = [layer.strip() for layer in config['general'].get('layers').split(',')]
     variables = {
-        "results_file": config['general'].get('results_file', ''),
-        "repetitions": int(config['general'].get('repetitions')),
-        "duration": int(config['general'].get('duration')),
-        "layers": layers
+        "results_file": config_path(filename, config['general'].get('results_file', '')),
+        "store_dir": config_path(filename, config['general'].get('store_dir', '')),
+        "text_results": config['general'].getboolean('text_results', True),
+        "instrumentation": config['general'].getboolean('instrumentation', False),
+        **read_options(config['general'])
     }
-
-    for layer in layers:
-        variables[layer] = {k.replace("_ip", ""): v for k, v in config[layer].items()}
-
+    variables.update(read_layers(config))
     return variables
 
-def ping_device(device_ip, duration, repetitions):
-    successful_pings = 0
-    total_pings = duration * repetitions
-
-    for _ in range(repetitions):
-        try:
-            cmd = ["ping", "-c", str(duration), device_ip]
-            result = subprocess.check_output(cmd, stderr=subprocess.STDOUT, universal_newlines=True)
-            successful_pings += result.count("bytes from")
-        except subprocess.CalledProcessError as e:
-            pass  # Assume no successful pings if there's an error
-
-    return successful_pings, total_pings
-
-def calculate_service_availability(successful_pings, total_pings):
-    if total_pings == 0:
-        return 0  # To avoid division by zero
-    return (successful_pings / total_pings) * 100
+def measure_availability(device_ip, duration, repetitions, prober='system', echo_port=7, outage_probes=1):
+    # One probe per second, `duration` probes per repetition
+    samples_per_repetition = [collect_probes(device_ip, duration, backend=prober, port=echo_port) for _ in range(repetitions)]
+    return summarize_availability(samples_per_repetition, outage_probes=outage_probes)
 
-
-def write_service_availability_to_file(results_file, device_name, device_ip, successful_pings, total_pings):
-    availability = calculate_service_availability(successful_pings, total_pings)
+@HARNESS.timed("write")
+def write_service_availability_to_file(results_file, device_name, device_ip, summary):
     results = [
         f"Device Name: {device_name}",
         f"Device IP: {device_ip}",
-        f"Service Availability: {availability:.2f}%",
-        f"Successful Pings: {successful_pings}",
-        f"Total Pings: {total_pings}",
+        *availability_lines(summary),
     ]
 
     # Write the results to a file
     with open(results_file, "a") as file:
         file.write("\n".join(results) + "\n\n")
 
-def write_starting_layer_notice(results_file, category):
-    with open(results_file, "a") as file:
-        file.write(f"[Starting tests for {category.replace('-', ' ').title()}]\n")
-        file.write("-----------------------------------\n")
+def store_service_availability(store, run_id, category, device_name, device_ip, summary):
+    store_records(store, run_id, Device(category, device_name, device_ip), availability_records(summary))
 
-def write_completion_layer_notice(results_file, category):
-    with open(results_file, "a") as file:
-        file.write("-----------------------------------\n")
-        file.write(f"[Completed tests for {category.replace('-', ' ').title()}]\n\n")
+class AvailabilityKpi(Kpi):
+    name = "availability"
+
+    @classmethod
+    def read_options(cls, section):
+        return read_options(section)
+
+    def measure(self, device):
+        options = self.options
+        return availability_records(measure_availability(device.ip, options['duration'], options['repetitions'],
+                                                         options['prober'], options['echo_port'], options['outage_probes']))
 
 
 if __name__ == "__main__":
     try:
-        config = read_config("config.cfg")
+        config = read_config(script_config(__file__))
+        store = ResultsStore(config['store_dir']) if config['store_dir'] else None
+        run_id = new_run_id(__file__)
 
         # Write the initial lines to the results file
         script_name = os.path.basename(__file__)
         current_date = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        results_file = config['results_file'] if config['text_results'] else None
+        if config['instrumentation']:
+            HARNESS.start()
 
-        with open(config['results_file'], "a") as file:
-            file.write(f"Running {script_name} on {current_date}\n")
-            file.write(f"(Configuration --> Duration: {config['duration']} seconds, Repetitions: {config['repetitions']})\n")
-            file.write(f"{'*' * 60}\n\n")
+        if config['text_results']:
+            with open(config['results_file'], "a") as file:
+                file.write(f"Running {script_name} on {current_date}\n")
+                file.write(f"(Configuration --> Duration: {config['duration']} seconds, Repetitions: {config['repetitions']})\n")
+                file.write(f"{'*' * 60}\n\n")
 
         # Run the script in the devices specified in the config file
         for category in config.get('layers', []):
-            write_starting_layer_notice(config['results_file'], category)
+            if config['text_results']:
+                write_starting_layer_notice(config['results_file'], category)
             for device_name, device_ip in config[category].items():
-                successful_pings, total_pings = ping_device(device_ip, config['duration'], config['repetitions'])
-                write_service_availability_to_file(config['results_file'], device_name, device_ip, successful_pings, total_pings)
-            write_completion_layer_notice(config['results_file'], category)
-        print("Script successfully executed. Results stored in: " +config['results_file'])
+                with HARNESS.scope((category, device_name)):
+                    summary = measure_availability(device_ip, config['duration'], config['repetitions'], config['prober'], config['echo_port'], config['outage_probes'])
+                    if store is not None:
+                        store_service_availability(store, run_id, category, device_name, device_ip, summary)
+                    if config['text_results']:
+                        write_service_availability_to_file(config['results_file'], device_name, device_ip, summary)
+                if config['instrumentation']:
+                    report_overhead((category, device_name), Device(category, device_name, device_ip), results_file, store, run_id)
+            if config['text_results']:
+                write_completion_layer_notice(config['results_file'], category)
+        if config['instrumentation']:
+            report_usage(Device("local", "harness", ""), results_file, store, run_id)
+        print(f"Script successfully executed. Results stored in: {config['store_dir'] or config['results_file']} (run {run_id})")
 
     except Exception as e:
         print(f"Error: {e}")
@@ -0,0 +1,321 @@
+import datetime
+import mmap
+import os
+import shutil
+import socket
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.config import config_path, load_config, script_config
+from common.histogram import LatencyHistogram, merge_histograms
+from common.results_store import ResultsStore, new_run_id
+from common.stress import parse_memory_size
+
+# Storage I/O KPI of the local device: sequential/random read/write throughput, IOPS and latency over block sizes and
+# queue depths, fsync latency, and mmap vs buffered reads of a test file in test_dir.
+#
+# Every I/O goes through page-aligned buffers allocated once per worker (anonymous mmaps), and the file is opened with
+# O_DIRECT when the filesystem supports it, so the numbers are the storage's and not the page cache's. Without
+# O_DIRECT the file's cached pages are dropped before every test and writes are followed by an fsync counted in
+# their time. A queue depth of N is N threads with one I/O in flight each (the syscalls release the GIL).
+
+PATTERNS = ("seq_read", "seq_write", "rand_read", "rand_write")
+ALIGNMENT = 4096  # O_DIRECT offsets and sizes must be multiples of the logical block size, 4 KiB covers every device
+LATENCY_BATCH = 65536  # I/O latencies a worker keeps before folding them into its histogram
+TEST_FILE = "storage_io.test"
+
+def read_config(filename):
+    config = load_config(filename, interpolation=False)
+    section = config['storage-io']
+
+    variables = {
+        "results_file": config_path(filename, config['general'].get('results_file')),
+        "repetitions": int(config['general'].get('repetitions')),
+        "store_dir": config_path(filename, config['general'].get('store_dir', '')),
+        "text_results": config['general'].getboolean('text_results', True),
+        "test_dir": config_path(filename, section.get('test_dir', '../../results')),
+        "file_size": parse_memory_size(section.get('file_size', '256M')),
+        "duration": float(section.get('duration', 5)),
+        "patterns": [pattern.strip() for pattern in section.get('patterns', ', '.join(PATTERNS)).split(',') if pattern.strip()],
+        "block_sizes": [parse_memory_size(size) for size in section.get('block_sizes', '4K, 64K, 1M').split(',') if size.strip()],
+        "queue_depths": [int(depth) for depth in section.get('queue_depths', '1, 4, 16').split(',') if depth.strip()],
+        "direct": section.get('direct', 'auto').strip(),
+        "fsync_count": int(section.get('fsync_count', 200)),
+        "fsync_block_size": parse_memory_size(section.get('fsync_block_size', '4K')),
+        "mmap_block_size": parse_memory_size(section.get('mmap_block_size', '1M')),
+        "seed": int(section.get('seed', 0)),
+    }
+    for pattern in variables['patterns']:
+        if pattern not in PATTERNS:
+            raise ValueError(f"Unknown pattern '{pattern}'. Available: {', '.join(PATTERNS)}")
+    if variables['direct'] not in ("auto", "yes", "no"):
+        raise ValueError("direct must be auto, yes or no")
+    for size in variables['block_sizes'] + [variables['fsync_block_size'], variables['mmap_block_size']]:
+        if size % ALIGNMENT:
+            raise ValueError(f"Block sizes must be multiples of {ALIGNMENT} bytes, got {size}")
+    largest_block = max(variables['block_sizes'] + [variables['mmap_block_size']])
+    if variables['file_size'] < largest_block:
+        raise ValueError(f"file_size must be at least the largest block size ({largest_block} bytes), "
+                         f"got {variables['file_size']}")
+    variables['file_size'] -= variables['file_size'] % largest_block
+    return variables
+
+def aligned_buffer(size):
+    # Anonymous mappings start on a page boundary, as O_DIRECT needs
+    return mmap.mmap(-1, size, flags=mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS)
+
+def direct_supported(path):
+    # O_DIRECT is Linux-only, and some filesystems (tmpfs, some FUSE/overlay setups) refuse it on open or on I/O
+    if not hasattr(os, "O_DIRECT"):
+        return False
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECT)
+    except OSError:
+        return False
+    try:
+        os.preadv(fd, [aligned_buffer(ALIGNMENT)], 0)
+        return True
+    except OSError:
+        return False
+    finally:
+        os.close(fd)
+
+def drop_cache(fd):
+    # Evicts the file's clean pages, so buffered reads come from the storage
+    os.fsync(fd)
+    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+def prepare_file(path, size, chunk_size=4 * 1024 * 1024):
+    # The test file is written in full (incompressible data) before any test, so reads hit allocated blocks
+    free = shutil.disk_usage(os.path.dirname(path)).free
+    if not os.path.exists(path) and free < size * 1.1:
+        raise ValueError(f"Not enough free space in {os.path.dirname(path)} for a {size / 1024 ** 2:.0f} MB test file")
+    chunk = os.urandom(chunk_size)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        for offset in range(0, size, chunk_size):
+            os.write(fd, chunk[:min(chunk_size, size - offset)])
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def run_pattern(path, pattern, block_size, queue_depth, file_size, duration, direct, seed=0):
+    # One pattern for `duration` seconds (sequential ones stop after one pass over the file)
+    write = pattern.endswith("write")
+    fd = os.open(path, (os.O_RDWR if write else os.O_RDONLY) | (os.O_DIRECT if direct else 0))
+    blocks = file_size // block_size
+    next_block = [0]
+    lock = threading.Lock()
+    histograms = [LatencyHistogram() for _ in range(queue_depth)]
+    counts = [0] * queue_depth
+
+    def worker(index):
+        buffer = aligned_buffer(block_size)
+        if write:
+            buffer.write(os.urandom(block_size))
+        view = memoryview(buffer)
+        latencies = np.empty(LATENCY_BATCH)
+        recorded = 0
+        rng = np.random.default_rng(seed + index)
+        offsets, position = None, 0
+        io = os.pwritev if write else os.preadv
+        try:
+            while time.monotonic() < deadline:
+                if pattern.startswith("seq"):
+                    with lock:
+                        block = next_block[0]
+                        next_block[0] += 1
+                    if block >= blocks:
+                        break
+                    offset = block * block_size
+                else:
+                    if offsets is None or position == offsets.size:
+                        offsets, position = rng.integers(0, blocks, 4096) * block_size, 0
+                    offset = int(offsets[position])
+                    position += 1
+                start = time.perf_counter_ns()
+                io(fd, [view], offset)
+                latencies[recorded] = (time.perf_counter_ns() - start) / 1e6
+                recorded += 1
+                if recorded == LATENCY_BATCH:
+                    histograms[index].record_values(latencies)
+                    counts[index] += recorded
+                    recorded = 0
+            histograms[index].record_values(latencies[:recorded])
+            counts[index] += recorded
+        finally:
+            view.release()
+            buffer.close()
+
+    try:
+        if not direct:
+            drop_cache(fd)
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(queue_depth)]
+        start = time.monotonic()
+        deadline = start + duration
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if write:
+            # Written blocks are only stored once they're flushed
+            os.fsync(fd)
+        elapsed = time.monotonic() - start
+    finally:
+        os.close(fd)
+
+    histogram = merge_histograms(histograms)
+    operations = sum(counts)
+    return {
+        "pattern": pattern,
+        "block_size": block_size,
+        "queue_depth": queue_depth,
+        "direct": direct,
+        "operations": operations,
+        "seconds": elapsed,
+        "mb_per_second": operations * block_size / elapsed / 1024 ** 2,
+        "iops": operations / elapsed,
+        "latency": histogram,
+    }
+
+def measure_fsync(path, count, block_size, file_size):
+    # Latency of fsync() after every block written: what a database commit or a log append waits for
+    fd = os.open(path, os.O_WRONLY)
+    buffer = aligned_buffer(block_size)
+    buffer.write(os.urandom(block_size))
+    latencies = np.empty(count)
+    blocks = file_size // block_size
+    try:
+        for index in range(count):
+            os.pwrite(fd, buffer, (index % blocks) * block_size)
+            start = time.perf_counter_ns()
+            os.fsync(fd)
+            latencies[index] = (time.perf_counter_ns() - start) / 1e6
+    finally:
+        os.close(fd)
+        buffer.close()
+    histogram = LatencyHistogram()
+    histogram.record_values(latencies)
+    return histogram
+
+def measure_read_methods(path, file_size, block_size):
+    # Reads the whole file from a cold cache with read syscalls, then through a memory mapping, copying every block
+    # into the same aligned buffer both times. Returns {method: MB/s}
+    buffer = aligned_buffer(block_size)
+    view = memoryview(buffer)
+    fd = os.open(path, os.O_RDONLY)
+    results = {}
+    try:
+        drop_cache(fd)
+        start = time.monotonic()
+        for offset in range(0, file_size, block_size):
+            os.preadv(fd, [view], offset)
+        results["buffered"] = file_size / (time.monotonic() - start) / 1024 ** 2
+
+        drop_cache(fd)
+        start = time.monotonic()
+        with mmap.mmap(fd, file_size, access=mmap.ACCESS_READ) as mapping:
+            if hasattr(mapping, "madvise"):
+                mapping.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(mapping) as mapped:
+                for offset in range(0, file_size, block_size):
+                    view[:] = mapped[offset:offset + block_size]
+        results["mmap"] = file_size / (time.monotonic() - start) / 1024 ** 2
+    finally:
+        os.close(fd)
+        view.release()
+        buffer.close()
+    return results
+
+def measure_storage(config):
+    # Returns the results of one repetition: {"path", "direct", "patterns": [...], "fsync": histogram, "read_methods": {...}}
+    os.makedirs(config['test_dir'], exist_ok=True)
+    path = os.path.join(config['test_dir'], TEST_FILE)
+    prepare_file(path, config['file_size'])
+    try:
+        direct = config['direct'] != "no" and direct_supported(path)
+        if config['direct'] == "yes" and not direct:
+            raise ValueError(f"O_DIRECT isn't supported in {config['test_dir']} (direct = yes)")
+        patterns = []
+        for pattern in config['patterns']:
+            for block_size in config['block_sizes']:
+                for queue_depth in config['queue_depths']:
+                    patterns.append(run_pattern(path, pattern, block_size, queue_depth, config['file_size'],
+                                                config['duration'], direct, config['seed']))
+        fsync = measure_fsync(path, config['fsync_count'], config['fsync_block_size'], config['file_size'])
+        read_methods = measure_read_methods(path, config['file_size'], config['mmap_block_size'])
+    finally:
+        os.remove(path)
+    return {"path": path, "direct": direct, "patterns": patterns, "fsync": fsync, "read_methods": read_methods}
+
+def format_size(size):
+    for unit, factor in (("M", 1024 ** 2), ("K", 1024)):
+        if size >= factor and size % factor == 0:
+            return f"{size // factor}{unit}"
+    return str(size)
+
+def write_results_to_file(results_file, hostname, repetition_number, file_size, results):
+    repetition_number = int(repetition_number) + 1
+    with open(results_file, "a") as file:
+        file.write(f"Device name: {hostname}\n")
+        file.write(f"Repetition number: {repetition_number}\n\n")
+        file.write(f"Test File: {results['path']} ({file_size / 1024 ** 2:.0f} MB, O_DIRECT: {'yes' if results['direct'] else 'no'})\n")
+        for result in results['patterns']:
+            p50, p99, p99_9 = result['latency'].percentiles((50, 99, 99.9))
+            file.write(f"{result['pattern']} (block {format_size(result['block_size'])}, queue depth {result['queue_depth']}): "
+                       f"{result['mb_per_second']:.2f} MB/s, {result['iops']:.0f} IOPS, "
+                       f"latency p50/p99/p99.9 {p50:.3f}/{p99:.3f}/{p99_9:.3f} ms\n")
+        p50, p90, p99, p99_9 = results['fsync'].percentiles((50, 90, 99, 99.9))
+        file.write(f"Fsync Latency (p50/p90/p99/p99.9): {p50:.3f}/{p90:.3f}/{p99:.3f}/{p99_9:.3f} ms "
+                   f"({results['fsync'].total_count} fsyncs)\n")
+        file.write(f"Cold Read Throughput (buffered/mmap): {results['read_methods']['buffered']:.2f}/"
+                   f"{results['read_methods']['mmap']:.2f} MB/s\n")
+
+def store_results(store, run_id, hostname, repetition_number, results):
+    repetition = int(repetition_number) + 1
+    for result in results['patterns']:
+        # The latency histogram is stored encoded, like the network latency ones
+        store.append(run_id, "local", hostname, "storage_throughput", [result['mb_per_second']], "MB/s",
+                     repetition=repetition, pattern=result['pattern'], block_size=result['block_size'],
+                     queue_depth=result['queue_depth'], direct=result['direct'], iops=result['iops'],
+                     operations=result['operations'], histogram=result['latency'].encode())
+    store.append(run_id, "local", hostname, "fsync_latency", [], "ms", repetition=repetition,
+                 histogram=results['fsync'].encode())
+    for method, mb_per_second in results['read_methods'].items():
+        store.append(run_id, "local", hostname, "read_method_throughput", [mb_per_second], "MB/s",
+                     repetition=repetition, method=method)
+
+
+if __name__ == "__main__":
+    try:
+        config = read_config(script_config(__file__))
+        store = ResultsStore(config['store_dir']) if config['store_dir'] else None
+        run_id = new_run_id(__file__)
+
+        script_name = os.path.basename(__file__)
+        current_date = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        if config['text_results']:
+            with open(config['results_file'], "a") as file:
+                file.write(f"\n{'*' * 60}\n")
+                file.write(f"Running {script_name} on {current_date}\n")
+                file.write(f"(Configuration --> Duration: {config['duration']:g} seconds per test, Repetitions: {config['repetitions']})\n")
+                file.write(f"{'*' * 60}\n")
+
+        hostname = socket.gethostname()
+        for repetition_number in range(config['repetitions']):
+            results = measure_storage(config)
+            if store is not None:
+                store_results(store, run_id, hostname, repetition_number, results)
+            if config['text_results']:
+                write_results_to_file(config['results_file'], hostname, repetition_number, config['file_size'], results)
+                with open(config['results_file'], "a") as file:
+                    file.write("-----------------------------------\n")
+        print(f"Script successfully executed. Results stored in: {config['store_dir'] or config['results_file']} (run {run_id})")
+
+    except Exception as e:
+        print(f"Error: {e}")